@@ -0,0 +1,103 @@
+"""Accelerometer sampling pipeline for the nunchuk.
+
+The wiimote reports at around 100 Hz, faster than the control loop
+runs, so a single sample per tick is both noisy and aliased. Instead
+every report goes into a ring buffer, and at tick time one FIR filter
+over the newest samples gives the decimated reading the tick uses.
+
+numpy is imported when the first pipeline is created, which for the
+wiimote is as it starts connecting, in the pairing thread, so the import
+overlaps the wait for 1+2."""
+from __future__ import division
+
+from scheduler import Histogram, monotonic
+
+# Seconds per filter call
+FILTER_BOUNDS = (1e-5, 2e-5, 5e-5, 1e-4, 2e-4, 5e-4, 1e-3)
+
+
+def moving_average(taps):
+    """Coefficients averaging the newest taps samples"""
+    import numpy
+    return numpy.full(taps, 1 / taps)
+
+
+def lowpass(taps, cutoff):
+    """Hamming windowed sinc low-pass coefficients, with cutoff as a
+    fraction of the sample rate, below the 0.5 Nyquist limit. For 100 Hz
+    reports decimated to a 50 Hz loop, a cutoff under 0.25 keeps what
+    the loop can represent"""
+    import numpy
+    n = numpy.arange(taps) - (taps - 1) / 2
+    coefficients = 2 * cutoff * numpy.sinc(2 * cutoff * n) * numpy.hamming(taps)
+    # Unity gain at DC, so a still nunchuk reads the same as unfiltered
+    return coefficients / coefficients.sum()
+
+
+class AccelPipeline(object):
+    """Ring buffer of (x, y, z) accelerometer samples with an FIR filter.
+
+    add() is called for every report, from the cwiid thread, and value()
+    from the control loop. A sample is only counted once fully written,
+    and the filter only reads samples already counted.
+
+    coefficients can also be a function returning them, such as
+    functools.partial(lowpass, 15, 0.2), so that configuring a filter
+    does not import numpy."""
+    def __init__(self, coefficients=None, size=256):
+        import numpy
+        self._numpy = numpy
+        if coefficients is None:
+            coefficients = moving_average(8)
+        elif callable(coefficients):
+            coefficients = coefficients()
+        coefficients = numpy.asarray(coefficients, dtype=float)
+        if not 0 < len(coefficients) < size:
+            raise ValueError(
+                "Filter needs 1 to {0} taps, not {1}".format(
+                    size - 1, len(coefficients)))
+        # Reversed to line up with the window, which is oldest first
+        self.coefficients = coefficients[::-1].copy()
+        self.size = size
+        # Each sample is stored twice, size rows apart, so the newest
+        # samples are always one contiguous slice, with no wrap to join
+        self.samples = numpy.zeros((2 * size, 3))
+        self.count = 0
+        self.filter_time = Histogram(FILTER_BOUNDS)
+
+    def add(self, acc):
+        index = self.count % self.size
+        self.samples[index] = acc
+        self.samples[index + self.size] = acc
+        self.count += 1
+
+    def reset(self):
+        """Forget the samples, e.g. on reconnecting"""
+        self.count = 0
+
+    def value(self):
+        """Filtered (x, y, z) in raw units over the newest samples, or None
+        before the first. Until the buffer holds as many samples as the
+        filter has taps, it is the mean of those there are"""
+        start = monotonic()
+        count = self.count
+        if count == 0:
+            return None
+        taps = len(self.coefficients)
+        end = count % self.size + self.size
+        if count >= taps:
+            filtered = self._numpy.dot(
+                self.coefficients, self.samples[end - taps:end])
+        else:
+            filtered = self.samples[end - count:end].mean(axis=0)
+        filtered = tuple(filtered.tolist())
+        self.filter_time.add(monotonic() - start)
+        return filtered
+
+    def stats(self):
+        """Samples taken and the time per filter call in seconds"""
+        return dict(
+            samples=self.count,
+            taps=len(self.coefficients),
+            filter=self.filter_time.as_dict(),
+        )
@@ -0,0 +1,280 @@
+import ctypes
+import logging
+import multiprocessing
+import threading
+import time
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from libs.Adafruit_PWM_Servo_Driver import PWM
+from scheduler import monotonic
+
+
+class ActuatorWriter():
+    """Background thread that owns writes to the PWM board.
+
+    Each channel has a single latest-value-wins slot, so callers never
+    block on the I2C bus. Slots are flushed as one burst at most
+    max_rate times a second, and any command overwritten before it was
+    flushed is counted as coalesced."""
+    def __init__(self, pwm, max_rate=50):
+        self.pwm = pwm
+        self.min_interval = 1.0 / max_rate
+        # channel -> ((on, off), time submitted)
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Posted once per submit. Acquired with no timeout, as on Python 2
+        # Event.wait(timeout) polls with sleeps of up to 50ms, adding
+        # most of a control period to every write
+        self._wake = threading.Semaphore(0)
+        self.killed = False
+
+        self.submitted = 0
+        self.written = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, channels):
+        """Queue a dict of {channel: (on, off)} for the next flush,
+        replacing any value still waiting for the same channel"""
+        now = monotonic()
+        with self._lock:
+            for channel, value in channels.items():
+                if channel in self._pending:
+                    self.coalesced += 1
+                self._pending[channel] = (value, now)
+            self.submitted += len(channels)
+        self._wake.release()
+
+    def run(self):
+        """Flush pending channel values until stopped"""
+        next_flush = 0.0
+        while not self.killed:
+            # stop() posts too, so this always wakes for it
+            self._wake.acquire()
+            while self._wake.acquire(False):
+                pass
+            delay = next_flush - monotonic()
+            if delay > 0:
+                # Rate limit the bus, later submits coalesce meanwhile
+                time.sleep(delay)
+            next_flush = monotonic() + self.min_interval
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self.pwm.setPWMMulti(dict(
+                (channel, value) for channel, (value, _) in pending.items()
+            ))
+        except Exception:
+            logging.exception("Actuator write failed")
+        now = monotonic()
+        for _, submitted_at in pending.values():
+            latency = now - submitted_at
+            self.latency_total += latency
+            if latency > self.latency_max:
+                self.latency_max = latency
+        self.written += len(pending)
+        self.flushes += 1
+
+    def stop(self):
+        """Stop the writer thread, writing out anything still pending"""
+        self.killed = True
+        self._wake.release()
+        self._thread.join()
+        self._flush()
+
+    def stats(self):
+        """Counters for coalesced updates and queue latency in seconds"""
+        return dict(
+            submitted=self.submitted,
+            written=self.written,
+            coalesced=self.coalesced,
+            flushes=self.flushes,
+            latency_mean=(
+                self.latency_total / self.written if self.written else 0.0
+            ),
+            latency_max=self.latency_max,
+        )
+
+
+# Shared block layout, a seqlock sequence number (odd while a write is
+# in progress), then (on, off) for each of the 16 channels, -1 if unset
+SEQUENCE = 0
+CHANNELS = 1
+# Shared stats layout
+CONSUMED = 0
+WRITTEN = 1
+FLUSHES = 2
+LATENCY_TOTAL = 3
+LATENCY_MAX = 4
+
+
+class ActuatorProcess(object):
+    """Output stage in a separate process, owning its own I2C handle on
+    the PWM board, so its writes never wait for this process' GIL.
+
+    Channel commands go through a shared memory block guarded by a
+    sequence counter, with no pickling or queues. As with
+    ActuatorWriter each channel is latest value wins, flushed at most
+    max_rate times a second, and the PWM shadow registers in the output
+    process suppress writes that would not change the board. The board
+    must already be set up, e.g. by the DriveTrain's own PWM object.
+
+    deadband gives the per channel deadband of the output process' own
+    PWM object, as for PWM.setDeadband, fixed once it has started. bus
+    must be one the forked process can reach the board through, None
+    for the default SMBus or one marked sharedAcrossProcesses; writes
+    to a simulated bus would only reach the output process' copy."""
+    def __init__(self, address=0x40, bus=None, max_rate=50, deadband=None):
+        if bus is not None and not getattr(bus, 'sharedAcrossProcesses', False):
+            raise ValueError(
+                "{0} does not reach the board from another process".format(
+                    type(bus).__name__))
+        self.min_interval = 1.0 / max_rate
+        self._block = RawArray(ctypes.c_long, CHANNELS + 32)
+        for index in range(CHANNELS, CHANNELS + 32):
+            self._block[index] = -1
+        self._submitted_at = RawArray(ctypes.c_double, 1)
+        self._shared_stats = RawArray(ctypes.c_double, 5)
+        self._stopping = RawValue(ctypes.c_int, 0)
+        # Bumped to make the output process forget its register cache
+        self._generation = RawValue(ctypes.c_int, 0)
+        # Only one writer at a time, e.g. the loop and the watchdog
+        self._lock = threading.Lock()
+        # Posted once per submit. A semaphore, as Event.set() waits for
+        # the output process to wake up
+        self._wake = multiprocessing.Semaphore(0)
+        self._sequence = 0
+
+        self.submitted = 0
+        self.coalesced = 0
+
+        self._process = multiprocessing.Process(
+            target=self._serve, args=(address, bus, deadband))
+        self._process.daemon = True
+        self._process.start()
+
+    def submit(self, channels):
+        """Publish a dict of {channel: (on, off)} to the output process,
+        replacing any values it has not written yet"""
+        block = self._block
+        with self._lock:
+            previous = self._sequence
+            if self._shared_stats[CONSUMED] < previous:
+                self.coalesced += 1
+            block[SEQUENCE] = previous + 1
+            for channel, (on, off) in channels.items():
+                block[CHANNELS + 2 * channel] = on
+                block[CHANNELS + 2 * channel + 1] = off
+            self._submitted_at[0] = monotonic()
+            self._sequence = previous + 2
+            block[SEQUENCE] = self._sequence
+            self.submitted += len(channels)
+        self._wake.release()
+
+    def invalidate(self):
+        """Make the output process forget what it last wrote, e.g. after
+        something else has written to the board. Nothing is rewritten
+        until the next submit."""
+        with self._lock:
+            self._generation.value += 1
+
+    def _read(self):
+        """Consistent copy of the block, or None if a write was in
+        progress throughout"""
+        block = self._block
+        for _ in range(100):
+            sequence = block[SEQUENCE]
+            if sequence & 1:
+                continue
+            values = block[:]
+            submitted_at = self._submitted_at[0]
+            if block[SEQUENCE] == sequence:
+                return values, submitted_at
+        return None
+
+    def _serve(self, address, bus, deadband):
+        """Output process main loop"""
+        # Handlers inherited from the parent may rely on its threads
+        logging.getLogger().handlers = [logging.StreamHandler()]
+        pwm = PWM(address, bus=bus, reset=False)
+        for channel, ticks in enumerate(deadband or ()):
+            pwm.setDeadband(channel, ticks)
+        stats = self._shared_stats
+        consumed = 0
+        generation = 0
+        next_flush = 0.0
+        while True:
+            if self._wake.acquire(timeout=0.1):
+                while self._wake.acquire(False):
+                    pass
+            stopping = self._stopping.value
+            delay = next_flush - monotonic()
+            if delay > 0 and not stopping:
+                # Rate limit the bus, later submits coalesce meanwhile
+                time.sleep(delay)
+            snapshot = self._read()
+            if snapshot is None:
+                # Caught mid write, look again straight away
+                self._wake.release()
+                continue
+            values, submitted_at = snapshot
+            if values[SEQUENCE] != consumed:
+                next_flush = monotonic() + self.min_interval
+                if self._generation.value != generation:
+                    generation = self._generation.value
+                    pwm.shadow = [None] * len(pwm.shadow)
+                channels = {}
+                for channel in range(16):
+                    on = values[CHANNELS + 2 * channel]
+                    off = values[CHANNELS + 2 * channel + 1]
+                    if off >= 0:
+                        channels[channel] = (on, off)
+                misses = pwm.cacheMisses
+                try:
+                    pwm.setPWMMulti(channels)
+                except Exception:
+                    logging.exception("Actuator process write failed")
+                latency = monotonic() - submitted_at
+                consumed = values[SEQUENCE]
+                stats[CONSUMED] = consumed
+                stats[WRITTEN] += pwm.cacheMisses - misses
+                stats[FLUSHES] += 1
+                stats[LATENCY_TOTAL] += latency
+                if latency > stats[LATENCY_MAX]:
+                    stats[LATENCY_MAX] = latency
+            if stopping:
+                break
+
+    def stop(self):
+        """Stop the output process, after it writes anything pending"""
+        self._stopping.value = 1
+        self._wake.release()
+        self._process.join(1.0)
+        if self._process.is_alive():
+            self._process.terminate()
+
+    def stats(self):
+        """Counters as for ActuatorWriter, coalesced counts submits that
+        replaced one not yet written, and latency is per flush from the
+        last submit to the end of the bus write, in seconds"""
+        stats = self._shared_stats
+        flushes = int(stats[FLUSHES])
+        return dict(
+            submitted=self.submitted,
+            written=int(stats[WRITTEN]),
+            coalesced=self.coalesced,
+            flushes=flushes,
+            latency_mean=stats[LATENCY_TOTAL] / flushes if flushes else 0.0,
+            latency_max=stats[LATENCY_MAX],
+        )
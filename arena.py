@@ -0,0 +1,147 @@
+"""Run several controller to drivetrain pairings from one process.
+
+Every pairing is serviced in turn from a single fixed rate scheduler,
+rather than one thread and polling loop per robot. Each pairing is an
+rc.rc controller, so the drive logic is the same as for a single robot."""
+from __future__ import division
+import logging
+
+import rc
+from scheduler import FixedRateScheduler, Histogram, monotonic
+
+
+class Pairing(object):
+    """One input source driving one drivetrain, with its own timing"""
+    def __init__(self, name, wiimote, drive):
+        self.name = name
+        # Each tick drives or, without a nunchuk or with B or Z held,
+        # holds this pairing neutral and disabled, as the Supervisor does
+        self.controller = rc.rc(drive, wiimote)
+        self.errors = 0
+        self.last_start = None
+        # Seconds spent servicing this pairing each tick
+        self.service = Histogram()
+        # Seconds from the start of the tick until this pairing's
+        # outputs were written, including the pairings before it
+        self.latency = Histogram()
+        # Seconds between successive updates of this pairing
+        self.periods = Histogram()
+
+    @property
+    def drive(self):
+        return self.controller.drive
+
+    def stats(self):
+        mean = self.periods.mean()
+        return dict(
+            ticks=self.service.count,
+            errors=self.errors,
+            rate=1 / mean if mean else 0.0,
+            service=self.service.as_dict(),
+            latency=self.latency.as_dict(),
+            period=self.periods.as_dict(),
+        )
+
+
+class Arena(object):
+    """Services every pairing once per tick of a shared scheduler"""
+    def __init__(self, rate=50):
+        self.scheduler = FixedRateScheduler(rate)
+        self.pairings = []
+        # One I2C handle per bus that can combine messages, e.g.
+        # I2CRdwrBus, so a tick's writes to every board on it go out
+        # in one transaction
+        self.combined = []
+
+    def add(self, name, wiimote, drive):
+        """Add a pairing, drive should have its own PCA9685 address or
+        its own channel block of a shared board"""
+        pairing = Pairing(name, wiimote, drive)
+        self.pairings.append(pairing)
+        # A writer thread writes on its own schedule, not the arena's
+        i2c = drive.pwm.i2c
+        if (drive.writer is None and hasattr(i2c.bus, 'transaction') and
+                all(other.bus is not i2c.bus for other in self.combined)):
+            self.combined.append(i2c)
+        return pairing
+
+    def tick(self):
+        tick_start = monotonic()
+        # With combined writes a pairing's latency below is until its
+        # writes were queued, they all reach the bus after the last one
+        transactions = [
+            (i2c, i2c.transaction()) for i2c in self.combined
+        ]
+        try:
+            self._tick_pairings(tick_start)
+        finally:
+            # Even on the way out, so the bus is never left with a
+            # transaction open
+            for i2c, transaction in transactions:
+                i2c.commit(transaction)
+
+    def _tick_pairings(self, tick_start):
+        for pairing in self.pairings:
+            start = monotonic()
+            try:
+                pairing.controller.tick()
+            except Exception:
+                # One misbehaving robot must not stop the others
+                pairing.errors += 1
+                logging.exception("Arena pairing {0} failed".format(
+                    pairing.name))
+                pairing.drive.disable_drive()
+            end = monotonic()
+            pairing.service.add(end - start)
+            pairing.latency.add(end - tick_start)
+            if pairing.last_start is not None:
+                pairing.periods.add(start - pairing.last_start)
+            pairing.last_start = start
+
+    def run(self):
+        """Service the pairings until stopped, then set them neutral"""
+        self.scheduler.run(self.tick)
+        for pairing in self.pairings:
+            pairing.controller.hold_neutral()
+
+    def stop(self):
+        self.scheduler.stop()
+
+    def stats(self):
+        """Arena loop stats plus stats for each pairing by name"""
+        return dict(
+            loop=self.scheduler.stats(),
+            pairings=dict(
+                (pairing.name, pairing.stats()) for pairing in self.pairings
+            ),
+        )
+
+
+def main():
+    """Pair one wiimote with one drivetrain per PCA9685 address given
+    on the command line, e.g. arena.py 0x40 0x41"""
+    import sys
+    import drivetrain
+    from wiimote import Wiimote
+
+    logging.basicConfig(stream=sys.stdout, level=logging.WARNING)
+    arena = Arena()
+    for address in sys.argv[1:]:
+        address = int(address, 0)
+        drive = drivetrain.DriveTrain(pwm_i2c=address)
+        wiimote = Wiimote(
+            callbacks=True,
+            background=True,
+            bdaddr_file="wiimote-{0:02x}.bdaddr".format(address)
+        )
+        arena.add("0x{0:02x}".format(address), wiimote, drive)
+    try:
+        arena.run()
+    except KeyboardInterrupt:
+        for pairing in arena.pairings:
+            pairing.drive.set_neutral()
+    logging.warning("Arena stats: {0}".format(arena.stats()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""Logging that costs the control loop as little as possible.
+
+Records are put on a queue by QueueHandler and formatted and written by
+a background thread, so the control thread never waits on formatting or
+on stdout. RateLimitFilter caps how often a per-tick message gets
+through. BinaryLog writes high rate numeric data, such as pulses and
+accelerometer readings, as fixed size binary records rather than text.
+
+    listener = asynclog.setup(level=logging.INFO)
+    ...
+    listener.stop()
+"""
+from __future__ import division
+import logging
+import struct
+import sys
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from scheduler import monotonic
+
+
+class QueueHandler(logging.Handler):
+    """Puts records on a queue unformatted. If the queue is full the
+    record is dropped and counted, rather than blocking the caller"""
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+        self.dropped = 0
+
+    def emit(self, record):
+        # Exception text has to be captured on the thread that has the
+        # exception, everything else is formatted later
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        try:
+            self.records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class QueueListener(object):
+    """Background thread passing queued records to the real handlers"""
+    def __init__(self, records, *handlers):
+        self.records = records
+        self.handlers = handlers
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        while True:
+            record = self.records.get()
+            if record is None:
+                break
+            for handler in self.handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        """Write out every record queued so far, then stop the thread"""
+        self.records.put(None)
+        self._thread.join()
+        for handler in self.handlers:
+            handler.flush()
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets at most rate records a second through from each logging
+    call site, and/or one in every sample records. The count of records
+    held back is added to the next one let through"""
+    def __init__(self, rate=None, sample=None):
+        logging.Filter.__init__(self)
+        self.interval = 1 / rate if rate else 0.0
+        self.sample = sample
+        # (pathname, lineno) -> [next allowed time, seen, suppressed]
+        self.sites = {}
+
+    def filter(self, record):
+        key = (record.pathname, record.lineno)
+        site = self.sites.get(key)
+        if site is None:
+            site = self.sites[key] = [0.0, 0, 0]
+        site[1] += 1
+        now = monotonic()
+        if (now < site[0] or
+                (self.sample and (site[1] - 1) % self.sample != 0)):
+            site[2] += 1
+            return False
+        site[0] = now + self.interval
+        if site[2]:
+            record.msg = "{0} [{1} similar suppressed]".format(
+                record.msg, site[2])
+            site[2] = 0
+        return True
+
+
+def setup(
+    level=logging.INFO,
+    stream=None,
+    fmt=logging.BASIC_FORMAT,
+    rate=None,
+    sample=None,
+    max_queued=10000
+):
+    """Route the root logger through a queue to a stream handler on a
+    background thread, optionally rate limited. Returns the listener,
+    stop it on exit to write out the last records"""
+    records = queue.Queue(max_queued)
+    handler = QueueHandler(records)
+    if rate or sample:
+        handler.addFilter(RateLimitFilter(rate, sample))
+    output = logging.StreamHandler(stream if stream else sys.stdout)
+    output.setFormatter(logging.Formatter(fmt))
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return QueueListener(records, output)
+
+
+MAGIC = b'PNTR\x01'
+# time, kind, value count, then the values as float32
+HEADER = struct.Struct('<dBB')
+
+# Record kinds
+TRACE_INPUT = 1
+TRACE_PULSES = 2
+
+
+class BinaryLog(object):
+    """Append only file of timestamped numeric records, for data logged
+    every tick. Packing a record costs far less than formatting text"""
+    def __init__(self, path, buffering=65536):
+        self.file = open(path, 'ab', buffering)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.records = 0
+        self._structs = {}
+        self._lock = threading.Lock()
+
+    def write(self, kind, values, timestamp=None):
+        """Append a sequence of numbers under the kind id"""
+        if timestamp is None:
+            timestamp = monotonic()
+        count = len(values)
+        packer = self._structs.get(count)
+        if packer is None:
+            packer = self._structs[count] = struct.Struct(
+                '<dBB{0}f'.format(count))
+        record = packer.pack(timestamp, kind, count, *values)
+        with self._lock:
+            self.file.write(record)
+            self.records += 1
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+def read_binary_log(path):
+    """Return a list of (timestamp, kind, values) from a BinaryLog"""
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("{0} is not a binary log".format(path))
+    records = []
+    offset = len(MAGIC)
+    while offset + HEADER.size <= len(data):
+        timestamp, kind, count = HEADER.unpack_from(data, offset)
+        offset += HEADER.size
+        end = offset + count * 4
+        if end > len(data):
+            # Partial record left by an interrupted run
+            break
+        values = struct.unpack_from('<{0}f'.format(count), data, offset)
+        records.append((timestamp, kind, values))
+        offset = end
+    return records
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""Command to bus latency of the PWM output paths.
+
+Sends a channel command every tick, at a fixed rate, through each of:
+a direct PWM write from the loop (sync), the ActuatorWriter thread
+(thread) and the ActuatorProcess output process (process). Every
+command carries a unique off count, and the simulated bus records when
+each one is written, so latency is measured from the submit to the end
+of the bus write. Threads spinning in Python load the GIL, as the
+control loop's own work would:
+
+    python -m benchmarks.bench_actuator [--rate 50] [--seconds 5]
+        [--load 1] [--bus-latency 0.0003] [--bus-rate 200]
+"""
+from __future__ import division, print_function
+import argparse
+import ctypes
+import threading
+import time
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+from actuator import ActuatorProcess, ActuatorWriter
+from libs.Adafruit_PWM_Servo_Driver import PWM
+from libs.PCA9685_Simulator import SimulatedBus
+from metrics import RingBuffer
+from scheduler import monotonic
+
+ADDRESS = 0x40
+LED0_ON_L = 0x06
+# Off counts used as command tags, cycled through
+FIRST_TAG = 300
+TAGS = 3000
+
+
+class RecordingBus(SimulatedBus):
+    """SimulatedBus noting when each channel 0 off count is written, in
+    shared memory so writes from an output process are seen too. Only
+    the recording is shared, the simulated board itself is not"""
+    sharedAcrossProcesses = True
+
+    def __init__(self, latency=0.0, size=TAGS):
+        SimulatedBus.__init__(self, latency)
+        self.attach(ADDRESS)
+        self.times = RawArray(ctypes.c_double, size)
+        self.tags = RawArray(ctypes.c_long, size)
+        self.count = RawValue(ctypes.c_long, 0)
+
+    def write_i2c_block_data(self, addr, reg, data):
+        SimulatedBus.write_i2c_block_data(self, addr, reg, data)
+        if reg == LED0_ON_L and len(data) >= 4:
+            index = self.count.value
+            if index < len(self.times):
+                self.times[index] = monotonic()
+                self.tags[index] = data[2] | data[3] << 8
+                self.count.value = index + 1
+
+    def written(self):
+        """{tag: time written} for every write recorded"""
+        return dict(
+            (self.tags[index], self.times[index])
+            for index in range(self.count.value)
+        )
+
+
+def spin(stop):
+    while not stop.is_set():
+        pass
+
+
+def measure(mode, rate, seconds, load, bus_latency, bus_rate):
+    """Returns percentiles of the submit call time and of command to bus
+    latency, and how many commands reached the bus"""
+    bus = RecordingBus(bus_latency)
+    pwm = PWM(ADDRESS, bus=bus)
+    pwm.setPWMFreq(50)
+    writer = None
+    if mode == 'thread':
+        writer = ActuatorWriter(pwm, max_rate=bus_rate)
+    elif mode == 'process':
+        writer = ActuatorProcess(ADDRESS, bus=bus, max_rate=bus_rate)
+    bus.count.value = 0
+
+    commands = min(int(rate * seconds), TAGS)
+    submitted = {}
+    call = RingBuffer(commands)
+    stop = threading.Event()
+    spinners = [threading.Thread(target=spin, args=(stop,)) for _ in range(load)]
+    for spinner in spinners:
+        spinner.daemon = True
+        spinner.start()
+    try:
+        period = 1 / rate
+        deadline = monotonic()
+        for index in range(commands):
+            tag = FIRST_TAG + index
+            channels = {0: (0, tag)}
+            started = monotonic()
+            submitted[tag] = started
+            if writer is None:
+                pwm.setPWMMulti(channels)
+            else:
+                writer.submit(channels)
+            call.add(monotonic() - started)
+            deadline += period
+            time.sleep(max(deadline - monotonic(), 0.0))
+        # Let the last command through
+        time.sleep(0.1)
+    finally:
+        stop.set()
+        if writer is not None:
+            writer.stop()
+
+    latency = RingBuffer(commands)
+    written = bus.written()
+    for tag, at in written.items():
+        if tag in submitted:
+            latency.add(at - submitted[tag])
+    return call.percentiles(), latency.percentiles(), len(written), commands
+
+
+def report(name, percentiles):
+    print("{0:18s} {1:8.3f} {2:8.3f} {3:8.3f} {4:8.3f}".format(
+        name, percentiles['p50'] * 1000, percentiles['p95'] * 1000,
+        percentiles['p99'] * 1000, percentiles['max'] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=50)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--load', type=int, default=1,
+                        help="threads spinning in this process")
+    parser.add_argument('--bus-latency', type=float, default=0.0003,
+                        help="seconds per simulated bus transaction")
+    parser.add_argument('--bus-rate', type=float, default=200,
+                        help="max_rate of the writer and output process, "
+                        "at the control rate this rate limit adds up to "
+                        "a period of latency")
+    args = parser.parse_args()
+
+    print("Times in ms, {0} Hz, {1} spinning threads".format(
+        args.rate, args.load))
+    print("{0:18s} {1:>8s} {2:>8s} {3:>8s} {4:>8s}".format(
+        "", "p50", "p95", "p99", "max"))
+    for mode in ('sync', 'thread', 'process'):
+        call, latency, written, commands = measure(
+            mode, args.rate, args.seconds, args.load, args.bus_latency,
+            args.bus_rate)
+        report(mode + " submit", call)
+        report(mode + " to bus", latency)
+        print("{0:18s} {1} of {2} commands written".format(
+            "", written, commands))
+
+
+if __name__ == '__main__':
+    main()
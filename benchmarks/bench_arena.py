@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+"""How arena tick time grows with the number of pairings, on the
+simulated I2C bus.
+
+    python -m benchmarks.bench_arena [--latency SECONDS] [--ticks N]
+"""
+from __future__ import division, print_function
+import argparse
+import timeit
+
+import drivetrain
+from arena import Arena
+from inputs import InputSource
+from libs.PCA9685_Simulator import SimulatedBus
+
+
+class SweepInput(InputSource):
+    """Input source sweeping the stick, so every tick changes the
+    outputs and nothing is suppressed by the PWM shadow registers"""
+    def __init__(self, offset=0):
+        super(SweepInput, self).__init__()
+        self.step = offset
+
+    def get_state(self):
+        self.step += 1
+        position = 50 + self.step % 150
+        return {
+            'buttons': 0,
+            'timestamp': None,
+            'nunchuk': {
+                'buttons': 0,
+                'stick': (position, 255 - position),
+                'acc': (125, position, 150),
+            },
+        }
+
+
+def build_arena(pairings, latency):
+    bus = SimulatedBus(latency=latency)
+    arena = Arena()
+    for index in range(pairings):
+        address = 0x40 + index
+        bus.attach(address)
+        drive = drivetrain.DriveTrain(pwm_i2c=address, bus=bus)
+        drive.enable_drive()
+        arena.add("robot{0}".format(index), SweepInput(index * 7), drive)
+    bus.resetCounters()
+    return arena, bus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help="simulated seconds per I2C transaction")
+    parser.add_argument('--ticks', type=int, default=500)
+    args = parser.parse_args()
+
+    print("pairings  us/tick  us/pairing  I2C/tick")
+    for pairings in (1, 2, 4, 8, 16):
+        arena, bus = build_arena(pairings, args.latency)
+        elapsed = min(timeit.repeat(arena.tick, number=args.ticks, repeat=3))
+        per_tick = elapsed / args.ticks * 1e6
+        print("{0:8d}  {1:7.1f}  {2:10.1f}  {3:8.2f}".format(
+            pairings, per_tick, per_tick / pairings,
+            bus.transactions / (3 * args.ticks)))
+
+
+if __name__ == '__main__':
+    main()
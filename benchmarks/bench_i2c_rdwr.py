@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""I2C syscalls per tick, python-smbus against combined I2C_RDWR
+transactions.
+
+Every smbus call is one ioctl, while I2CRdwrBus sends all of a tick's
+register bursts, to every board on the bus, in one. Both run on the
+simulated bus, the I2C_RDWR one through a SimulatedIoctl on a temporary
+file standing in for /dev/i2c-1. Drives have their channels spread
+over the board, so each tick needs a burst per channel, and arenas
+have one board per pairing:
+
+    python -m benchmarks.bench_i2c_rdwr [--ticks N]
+"""
+from __future__ import division, print_function
+import argparse
+import os
+import tempfile
+import timeit
+
+import drivetrain
+from arena import Arena
+from benchmarks.bench_arena import SweepInput
+from libs.I2C_RDWR_Bus import I2CRdwrBus, SimulatedIoctl
+from libs.PCA9685_Simulator import SimulatedBus
+
+
+def build_arena(pairings, device):
+    """Arena on the smbus path if device is None, else on an I2CRdwrBus
+    on that file. Returns the arena and a function counting syscalls"""
+    simulated = SimulatedBus()
+    if device is None:
+        bus = simulated
+
+        def syscalls():
+            return simulated.transactions
+    else:
+        ioctl = SimulatedIoctl(simulated)
+        bus = I2CRdwrBus(path=device, ioctl=ioctl)
+
+        def syscalls():
+            return ioctl.calls
+    arena = Arena()
+    for index in range(pairings):
+        address = 0x40 + index
+        simulated.attach(address)
+        drive = drivetrain.DriveTrain(
+            pwm_i2c=address, bus=bus,
+            left_channel=0, right_channel=4, front_channel=8
+        )
+        drive.enable_drive()
+        arena.add("robot{0}".format(index), SweepInput(index * 7), drive)
+    return arena, syscalls
+
+
+def measure(pairings, device, ticks):
+    arena, syscalls = build_arena(pairings, device)
+    before = syscalls()
+    elapsed = min(timeit.repeat(arena.tick, number=ticks, repeat=3))
+    return elapsed / ticks * 1e6, (syscalls() - before) / (3 * ticks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ticks', type=int, default=500)
+    args = parser.parse_args()
+
+    handle, device = tempfile.mkstemp(prefix='i2c-')
+    os.close(handle)
+    try:
+        print("pairings  smbus us/tick  syscalls  rdwr us/tick  syscalls")
+        for pairings in (1, 2, 4, 8, 16):
+            smbus_time, smbus_calls = measure(pairings, None, args.ticks)
+            rdwr_time, rdwr_calls = measure(pairings, device, args.ticks)
+            print("{0:8d}  {1:13.1f}  {2:8.2f}  {3:12.1f}  {4:8.2f}".format(
+                pairings, smbus_time, smbus_calls, rdwr_time, rdwr_calls))
+    finally:
+        os.unlink(device)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Control loop jitter before and after realtime.enable().
+
+Runs the rc tick on the cwiid and smbus stand-ins at a fixed rate, with
+a tick that also leaves cyclic garbage behind as a worst case for the
+collector, first under normal scheduling and then in real time mode.
+Busy processes can be added to load the CPUs. Run as root on the robot
+for the real time settings to apply:
+
+    sudo python -m benchmarks.bench_jitter [--rate 50] [--seconds 10]
+        [--load 1] [--priority 50] [--cpu 0]
+"""
+from __future__ import division, print_function
+import argparse
+import multiprocessing
+
+from benchmarks import standins
+
+standins.install()
+
+import drivetrain  # noqa: E402
+import rc  # noqa: E402
+import realtime  # noqa: E402
+from metrics import RingBuffer  # noqa: E402
+from scheduler import FixedRateScheduler, monotonic  # noqa: E402
+from wiimote import Wiimote  # noqa: E402
+
+
+def spin():
+    while True:
+        pass
+
+
+def measure(controller, rate, seconds, idle=None):
+    """Run the loop, returning percentiles of the start lateness of each
+    tick against its slot, and the count of slots skipped by overruns"""
+    ticks = int(rate * seconds)
+    lateness = RingBuffer(ticks)
+    scheduler = FixedRateScheduler(rate)
+    scheduler.idle = idle
+    period = 1 / rate
+    state = {'first': None, 'count': 0}
+
+    def tick():
+        now = monotonic()
+        if state['first'] is None:
+            state['first'] = now
+        # Slots missed after an overrun are skipped, so lateness is
+        # measured against the slot the tick started in
+        lateness.add((now - state['first']) % period)
+        state['count'] += 1
+        controller.tick()
+        # Garbage in reference cycles, only freed by the collector
+        for _ in range(20):
+            node = {}
+            node['self'] = node
+        if state['count'] >= ticks:
+            scheduler.stop()
+
+    scheduler.run(tick)
+    return lateness.percentiles(), scheduler.skipped
+
+
+def report(name, percentiles, skipped):
+    print("{0:10s} {1:8.3f} {2:8.3f} {3:8.3f} {4:8.3f} {5:8d}".format(
+        name, percentiles['p50'] * 1000, percentiles['p95'] * 1000,
+        percentiles['p99'] * 1000, percentiles['max'] * 1000, skipped))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=50)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--load', type=int, default=0,
+                        help="busy processes to run alongside")
+    parser.add_argument('--priority', type=int, default=50)
+    parser.add_argument('--cpu', type=int, default=None)
+    args = parser.parse_args()
+
+    drive = drivetrain.DriveTrain()
+    drive.enable_drive()
+    controller = rc.rc(drive, Wiimote())
+
+    load = [multiprocessing.Process(target=spin) for _ in range(args.load)]
+    for process in load:
+        process.daemon = True
+        process.start()
+    try:
+        before = measure(controller, args.rate, args.seconds)
+        applied = realtime.enable(args.priority, args.cpu)
+        gc_scheduler = realtime.GCScheduler().start()
+        after = measure(controller, args.rate, args.seconds, gc_scheduler)
+        gc_scheduler.stop()
+    finally:
+        for process in load:
+            process.terminate()
+
+    print("Real time settings: {0}".format(applied))
+    print("Tick start lateness in ms, {0} Hz, {1} busy processes".format(
+        args.rate, args.load))
+    print("{0:10s} {1:>8s} {2:>8s} {3:>8s} {4:>8s} {5:>8s}".format(
+        "", "p50", "p95", "p99", "max", "skipped"))
+    report("normal", *before)
+    report("real time", *after)
+
+
+if __name__ == '__main__':
+    main()
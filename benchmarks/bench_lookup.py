@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""Per-tick CPU cost of input normalisation and pulse conversion, using
+the original scalar numpy calls versus the precomputed lookup tables.
+
+Run from the project directory, ideally on the robot's own Pi Zero:
+
+    python -m benchmarks.bench_lookup
+"""
+from __future__ import division, print_function
+import timeit
+
+from numpy import clip, interp
+
+from lookup import build_clip_table, build_normalise_table, build_tick_table
+from lookup import clip as scalar_clip
+
+JOYSTICK_RANGE = [50, 200]
+ACC_RANGE = [75, 175]
+SERVO_MIN = 900
+SERVO_MAX = 2300
+STICK = (173, 91)
+ACC = (131, 104, 150)
+
+joystick_clipped = build_clip_table(JOYSTICK_RANGE)
+joystick_normalised = build_normalise_table(JOYSTICK_RANGE)
+acc_clipped = build_clip_table(ACC_RANGE)
+acc_normalised = build_normalise_table(ACC_RANGE)
+tick_table = build_tick_table(50, SERVO_MAX)
+map_scale = (SERVO_MAX - SERVO_MIN) / 2
+map_offset = SERVO_MIN + map_scale
+
+
+def numpy_tick():
+    """One control tick's conversions as done before the lookup tables"""
+    [clip(c, *JOYSTICK_RANGE) for c in STICK]
+    stick = [interp(c, JOYSTICK_RANGE, [-1, 1]) for c in STICK]
+    [clip(c, *ACC_RANGE) for c in ACC]
+    acc = [interp(c, ACC_RANGE, [-1, 1]) for c in ACC]
+    for value in (stick[0], stick[1], acc[0]):
+        pulse = int(interp(value, [-1, 1], [SERVO_MIN, SERVO_MAX]))
+        pulse = clip(pulse, SERVO_MIN, SERVO_MAX)
+        pulse_length = 1000000
+        pulse_length /= 50
+        pulse_length /= 4096
+        int(pulse / pulse_length)
+
+
+def table_tick():
+    """The same conversions using the lookup tables"""
+    [joystick_clipped[c] for c in STICK]
+    stick = [joystick_normalised[c] for c in STICK]
+    [acc_clipped[c] for c in ACC]
+    acc = [acc_normalised[c] for c in ACC]
+    for value in (stick[0], stick[1], acc[0]):
+        pulse = int(map_offset + map_scale * scalar_clip(value, -1, 1))
+        pulse = scalar_clip(pulse, SERVO_MIN, SERVO_MAX)
+        tick_table[pulse]
+
+
+def best_of(func, number=2000, repeat=5):
+    """Best per-call time in microseconds"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+if __name__ == '__main__':
+    before = best_of(numpy_tick)
+    after = best_of(table_tick)
+    print("numpy scalars: {0:8.1f} us/tick".format(before))
+    print("lookup tables: {0:8.1f} us/tick".format(after))
+    print("speedup:       {0:8.1f}x".format(before / after))
@@ -0,0 +1,90 @@
+"""Stand-ins for the cwiid and smbus modules, so the control stack can
+be benchmarked off the robot.
+
+install() puts them in sys.modules before anything imports the real
+ones. smbus.SMBus is a SimulatedBus with a PCA9685 at the default
+address, and cwiid.Wiimote reports a nunchuk whose stick sweeps on
+every read, so no write is suppressed by the PWM shadow registers."""
+import sys
+import types
+
+from libs.PCA9685_Simulator import SimulatedBus
+
+# Buses opened through the smbus stand-in, newest last
+buses = []
+
+
+class StandinSMBus(SimulatedBus):
+    def __init__(self, busnum=1, address=0x40):
+        SimulatedBus.__init__(self)
+        self.busnum = busnum
+        self.attach(address)
+        buses.append(self)
+
+
+class StandinWiimote(object):
+    """Polled cwiid.Wiimote, with the sweep frozen when moving is False"""
+    moving = True
+
+    def __init__(self, bdaddr=None):
+        self.bdaddr = bdaddr
+        self.rpt_mode = 0
+        self.led = 0
+        self.mesg_callback = None
+        self.step = 0
+
+    @property
+    def state(self):
+        if self.moving:
+            self.step += 1
+        position = 50 + self.step % 150
+        return {
+            'buttons': 0,
+            'nunchuk': {
+                'buttons': 0,
+                'stick': (position, 255 - position),
+                'acc': (125, position, 150),
+            },
+        }
+
+    def enable(self, flags):
+        pass
+
+    def close(self):
+        pass
+
+
+def _cwiid_module():
+    module = types.ModuleType('cwiid')
+    module.Wiimote = StandinWiimote
+    module.RPT_BTN = 0x02
+    module.RPT_ACC = 0x04
+    module.RPT_EXT = 0x80
+    module.FLAG_MESG_IFC = 0x01
+    module.MESG_STATUS = 1
+    module.MESG_BTN = 2
+    module.MESG_ACC = 3
+    module.MESG_NUNCHUK = 5
+    module.MESG_ERROR = 8
+    module.EXT_NUNCHUK = 1
+    return module
+
+
+def _smbus_module():
+    module = types.ModuleType('smbus')
+    module.SMBus = StandinSMBus
+    return module
+
+
+def install():
+    """Replace cwiid and smbus, including in an already imported
+    Adafruit_I2C. Call before creating any Wiimote or DriveTrain"""
+    sys.modules['cwiid'] = _cwiid_module()
+    sys.modules['smbus'] = _smbus_module()
+    for name in ('Adafruit_I2C', 'libs.Adafruit_I2C'):
+        module = sys.modules.get(name)
+        if module is not None:
+            module.smbus = sys.modules['smbus']
+    wiimote = sys.modules.get('wiimote')
+    if wiimote is not None:
+        wiimote.cwiid = sys.modules['cwiid']
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""Benchmark suite for the drivetrain, input and PWM hot paths.
+
+Runs off the robot against stand-ins for cwiid and smbus, timing each
+hot path call and counting I2C transactions per control tick. Results
+are written as JSON and compared against a stored baseline, failing if
+any timing is more than the threshold slower or any I2C count went up.
+
+    python -m benchmarks.suite [--output results.json]
+        [--baseline benchmarks/baseline.json] [--threshold 0.25]
+        [--save-baseline]
+
+Timings are only comparable on the same machine and Python, so the
+baseline records both and a mismatch is reported with the comparison.
+"""
+from __future__ import division, print_function
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+from benchmarks import standins
+
+standins.install()
+
+import accelfilter  # noqa: E402
+import drivetrain  # noqa: E402
+import rc  # noqa: E402
+from wiimote import Wiimote  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def best_of(func, number=2000, repeat=5):
+    """Best per-call time in microseconds"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def build():
+    """An enabled drivetrain and a polled wiimote on the stand-ins"""
+    drive = drivetrain.DriveTrain()
+    drive.enable_drive()
+    wiimote = Wiimote()
+    return drive, wiimote, standins.buses[-1]
+
+
+def timings(drive, wiimote):
+    state = wiimote.get_state()
+    values = [-1.0, -0.5, 0.0, 0.25, 1.0]
+    sweep = {'step': 0}
+
+    def next_value():
+        sweep['step'] += 1
+        return values[sweep['step'] % len(values)]
+
+    def next_pulse():
+        sweep['step'] += 1
+        return 1200 + sweep['step'] % 800
+
+    controller = rc.rc(drive, wiimote)
+    averaged = accelfilter.AccelPipeline(accelfilter.moving_average(8))
+    lowpassed = accelfilter.AccelPipeline(accelfilter.lowpass(31, 0.2))
+    for index in range(256):
+        acc = (125 + index % 7, 125 - index % 5, 150)
+        averaged.add(acc)
+        lowpassed.add(acc)
+    cases = [
+        ('mix_channels_and_assign',
+         lambda: drive.mix_channels_and_assign(next_value(), 0.3)),
+        ('mix_channels_omni_and_assign',
+         lambda: drive.mix_channels_omni_and_assign(next_value(), 0.3, -0.2)),
+        ('_map_channel_value',
+         lambda: drive._map_channel_value(0.3)),
+        ('set_servo_pulse',
+         lambda: drive.set_servo_pulse(0, next_pulse())),
+        ('wiimote.get_state', wiimote.get_state),
+        ('wiimote.get_nunchuk_accel_state',
+         lambda: wiimote.get_nunchuk_accel_state(state)),
+        ('wiimote.get_joystick_state',
+         lambda: wiimote.get_joystick_state(state)),
+        ('wiimote.get_buttons',
+         lambda: wiimote.get_buttons(state)),
+        ('wiimote.get_nunchuk_buttons',
+         lambda: wiimote.get_nunchuk_buttons(state)),
+        ('rc.tick', controller.tick),
+        ('accelfilter moving_average(8)', averaged.value),
+        ('accelfilter lowpass(31)', lowpassed.value),
+    ]
+    results = {}
+    for name, func in cases:
+        results[name] = best_of(func)
+    return results
+
+
+def i2c_counts(drive, wiimote, bus, ticks=500):
+    """I2C transactions per rc tick with the stick moving every tick,
+    and held still"""
+    controller = rc.rc(drive, wiimote)
+    counts = {}
+    for name, moving in (('moving', True), ('still', False)):
+        standins.StandinWiimote.moving = moving
+        controller.tick()
+        bus.resetCounters()
+        for _ in range(ticks):
+            controller.tick()
+        counts[name] = bus.transactions / ticks
+    standins.StandinWiimote.moving = True
+    return counts
+
+
+def run():
+    drive, wiimote, bus = build()
+    return dict(
+        machine=platform.machine(),
+        python=platform.python_version(),
+        timings_us=timings(drive, wiimote),
+        i2c_per_tick=i2c_counts(drive, wiimote, bus),
+    )
+
+
+def compare(results, baseline, threshold):
+    """Return a list of regression descriptions"""
+    regressions = []
+    for name, value in sorted(results['timings_us'].items()):
+        before = baseline.get('timings_us', {}).get(name)
+        if before and value > before * (1 + threshold):
+            regressions.append("{0}: {1:.2f}us, baseline {2:.2f}us".format(
+                name, value, before))
+    for name, value in sorted(results['i2c_per_tick'].items()):
+        before = baseline.get('i2c_per_tick', {}).get(name)
+        if before is not None and value > before:
+            regressions.append(
+                "I2C per tick {0}: {1:.2f}, baseline {2:.2f}".format(
+                    name, value, before))
+    return regressions
+
+
+def report(results, baseline):
+    print("{0:36s} {1:>10s} {2:>10s}".format("benchmark", "us", "baseline"))
+    for name, value in sorted(results['timings_us'].items()):
+        before = baseline.get('timings_us', {}).get(name)
+        print("{0:36s} {1:10.2f} {2:>10s}".format(
+            name, value, "{0:.2f}".format(before) if before else "-"))
+    for name, value in sorted(results['i2c_per_tick'].items()):
+        before = baseline.get('i2c_per_tick', {}).get(name)
+        print("{0:36s} {1:10.2f} {2:>10s}".format(
+            "I2C transactions/tick " + name, value,
+            "{0:.2f}".format(before) if before is not None else "-"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', help="write the results JSON here")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed slow down as a fraction, e.g. 0.25")
+    parser.add_argument('--save-baseline', action='store_true',
+                        help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    results = run()
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as infile:
+            baseline = json.load(infile)
+    report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as outfile:
+            json.dump(results, outfile, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+            outfile.write('\n')
+        print("Saved baseline to {0}".format(args.baseline))
+        return 0
+    if not baseline:
+        print("No baseline at {0}, run with --save-baseline".format(
+            args.baseline))
+        return 0
+    if (baseline.get('machine'), baseline.get('python')) != (
+            results['machine'], results['python']):
+        print("Warning: baseline is from {0} Python {1}, timings may not "
+              "be comparable".format(baseline.get('machine'),
+                                     baseline.get('python')))
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
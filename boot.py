@@ -0,0 +1,67 @@
+"""Boot timeline, for finding where the time to a drivable robot goes.
+
+Import this first and mark each step of the launch. Times are seconds
+since the Python process was started by init, so interpreter start up
+and module imports before the first mark are included."""
+from __future__ import division
+import logging
+import os
+
+from scheduler import monotonic
+
+
+def process_age():
+    """Seconds since this process was started, from /proc, or 0 where
+    that is not available"""
+    try:
+        with open('/proc/uptime') as infile:
+            uptime = float(infile.read().split()[0])
+        with open('/proc/self/stat') as infile:
+            # The command name may hold spaces, fields follow the ')'
+            fields = infile.read().rsplit(')', 1)[1].split()
+        # starttime is field 22, the 20th after the name and state
+        started = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        return max(uptime - started, 0.0)
+    except (IOError, OSError, ValueError, IndexError, AttributeError):
+        return 0.0
+
+
+class BootTimeline(object):
+    """Named events in the order they happened, timed from process start"""
+    def __init__(self):
+        self.start = monotonic() - process_age()
+        self.events = []
+        self.reported = False
+
+    def mark(self, name):
+        """Record that name has happened now, returns the boot time"""
+        elapsed = monotonic() - self.start
+        self.events.append((name, elapsed))
+        return elapsed
+
+    def elapsed(self, name):
+        """Boot time of the first event called name, or None"""
+        for event, elapsed in self.events:
+            if event == name:
+                return elapsed
+        return None
+
+    def report(self):
+        """Each event with its boot time and time since the event before"""
+        lines = ["Boot timeline:"]
+        previous = 0.0
+        for name, elapsed in self.events:
+            lines.append("  {0:8.3f}s  +{1:.3f}s  {2}".format(
+                elapsed, elapsed - previous, name))
+            previous = elapsed
+        return "\n".join(lines)
+
+    def log_report(self):
+        """Log the report once, later calls do nothing"""
+        if not self.reported:
+            self.reported = True
+            logging.info(self.report())
+
+
+# Shared by the modules of one launch
+timeline = BootTimeline()
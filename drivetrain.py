@@ -1,7 +1,23 @@
 from __future__ import division
 import logging
 from libs.Adafruit_PWM_Servo_Driver import PWM
-from numpy import interp, clip
+from actuator import ActuatorProcess, ActuatorWriter
+from lookup import build_tick_table, clip
+from asynclog import TRACE_PULSES
+import kinematics
+
+# Mixing for the 3 wheel omni robot, rows are the left, right and front
+# motors and columns the (throttle, steering, rotate) inputs. These are
+# the tuned coefficients of the original RC mixer, with channels as
+# offsets from neutral:
+#   VLeft = -(VSide*0.15 + VFwd*0.86 - VRotate)
+#   VRight = VSide*0.15 - VFwd*0.86 - VRotate
+#   VFront = -VSide - VRotate
+OMNI_MATRIX = [
+    [-0.86, -0.15, 1.0],
+    [-0.86, 0.15, -1.0],
+    [0.0, -1.0, -1.0],
+]
 
 
 class DriveTrain():
@@ -19,6 +35,14 @@ class DriveTrain():
         aux_channel2=5,
         aux_channel3=6,
         aux_channel4=7,
+        deadband=0,
+        bus=None,
+        async_writes=False,
+        process_writes=False,
+        max_bus_rate=50,
+        layout=None,
+        pwm=None,
+        osc_calibration=1.0,
         debug=False
     ):
         # Main set of motor controller ranges
@@ -40,8 +64,40 @@ class DriveTrain():
             'front': front_channel,
         }
 
-        self.pwm = PWM(pwm_i2c, debug=debug)
-        self.pwm.setPWMFreq(pwm_freq)
+        # bus can be an I2CBus backend such as the PCA9685 simulator,
+        # by default the Pi's own SMBus is opened. Drivetrains using
+        # different channel blocks of one board share its PWM object.
+        # osc_calibration corrects for the board's oscillator, see
+        # set_pwm_freq.
+        if pwm is None:
+            pwm = PWM(
+                pwm_i2c, debug=debug, bus=bus, oscCalibration=osc_calibration
+            )
+        self.pwm = pwm
+        self.set_pwm_freq(pwm_freq)
+        self._update_channel_map()
+        # Skip drive channel updates that move by no more than
+        # deadband PWM ticks from the value already on the board
+        for channel in self.channels.values():
+            self.pwm.setDeadband(channel, deadband)
+        # With async_writes, channel updates are handed to a background
+        # writer thread so callers never wait on the I2C bus. With
+        # process_writes they go to an output process with its own I2C
+        # handle instead, so writes don't wait on this process' GIL either
+        self.writer = None
+        if process_writes:
+            self.writer = ActuatorProcess(
+                self.pwm.address, bus=bus, max_rate=max_bus_rate,
+                deadband=list(self.pwm.deadband)
+            )
+        elif async_writes:
+            self.writer = ActuatorWriter(self.pwm, max_rate=max_bus_rate)
+        # Precomputed mixing matrices, see kinematics.py
+        self.differential = kinematics.differential(track_width=2.0)
+        self.omni = kinematics.Kinematics(('left', 'right', 'front'), OMNI_MATRIX)
+        self.set_layout(layout if layout is not None else self.omni)
+        # Optional asynclog.BinaryLog, gets every set of pulses written
+        self.trace = None
         # Flag set to True when motors are allowed to move
         self.drive_enabled = False
         self.disable_drive()
@@ -49,24 +105,95 @@ class DriveTrain():
     def set_servo_pulse(self, channel, pulse):
         """Send a raw servo pulse length to a specific speed controller
         channel"""
+        self.set_servo_pulses({channel: pulse})
+
+    def set_servo_pulses(self, pulses):
+        """Send raw servo pulse lengths to several speed controller
+        channels at once, as a dict of {channel: pulse}. Contiguous
+        channels are written to the PWM board in a single burst"""
         # Only send servo pulses if drive is enabled
         if self.drive_enabled:
-            # 1,000,000 us per second
-            pulseLength = 1000000
-            #  60 Hz
-            pulseLength /= 50
-            # logging.debug("%d us per period" % pulseLength)
-            # 12 bits of resolution
-            pulseLength /= 4096
-            # logging.debug("%d us per bit" % pulseLength)
-            # pulse *= 1000
-            pulse /= pulseLength
-            logging.debug(
-                "pulse {0} - channel {1}".format(
-                    int(pulse), channel
+            if self.trace is not None:
+                # Channel and pulse pairs, cheaper than a debug message
+                # per channel
+                self._write_trace([
+                    value for item in sorted(pulses.items()) for value in item
+                ])
+            channels = dict(
+                (channel, (0, self._pulse_to_ticks(pulse)))
+                for channel, pulse in pulses.items()
+            )
+            writer = self.writer
+            if writer is not None:
+                writer.submit(channels)
+            else:
+                self.pwm.setPWMMulti(channels)
+
+    def _write_trace(self, values):
+        """Trace the pulses, a diagnostic, so a trace that cannot be
+        written (disk full, file closed) is dropped rather than stopping
+        the motor updates"""
+        try:
+            self.trace.write(TRACE_PULSES, values)
+        except (EnvironmentError, ValueError):
+            logging.exception("Pulse trace write failed, tracing stopped")
+            self.trace = None
+
+    def close(self):
+        """Stop the background writer, if any, flushing pending updates.
+        Later updates are written synchronously"""
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.stop()
+
+    def set_pwm_freq(self, pwm_freq):
+        """Set the PWM board frequency, and rebuild the pulse length
+        to PWM tick lookup table to match. ESCs that accept fast frames
+        can be run at 200-400Hz, so a new command reaches the motors in
+        2.5-5ms rather than 20ms.
+
+        The prescaler only gives whole steps of the oscillator, so the
+        tick length comes from the frequency actually programmed. If a
+        scope shows the output frequency differs from pwm.frequency,
+        construct with osc_calibration = measured / pwm.frequency to
+        keep the pulse widths accurate."""
+        period = 1000000 / pwm_freq
+        if self.servo_full_max >= period:
+            raise ValueError(
+                "{0}Hz frames are too short for {1}us pulses".format(
+                    pwm_freq, self.servo_full_max
                 )
             )
-            self.pwm.setPWM(channel, 0, int(pulse))
+        self.pwm_freq = pwm_freq
+        self.pwm.setPWMFreq(pwm_freq)
+        actual = self.pwm.frequency
+        self._tick_table = build_tick_table(actual, self.servo_full_max)
+        # Fallback for pulses outside the table
+        self._us_per_tick = 1000000 / actual / 4096
+
+    def neutral_ticks(self):
+        """The PWM off count for servo_mid at the current frequency"""
+        return self._pulse_to_ticks(self.servo_mid)
+
+    def invalidate_channels(self, channels):
+        """Forget what was last written to channels, after something
+        else such as the watchdog wrote them over its own handle, so
+        the next update goes out even if it repeats the last one"""
+        self.pwm.invalidateChannels(channels)
+        # Likewise for an output process' own copy of the registers
+        invalidate = getattr(self.writer, 'invalidate', None)
+        if invalidate is not None:
+            invalidate()
+
+    def _pulse_to_ticks(self, pulse):
+        """Convert a pulse length in microseconds into a 12 bit
+        PWM off count"""
+        index = int(pulse)
+        if 0 <= index < len(self._tick_table):
+            ticks = self._tick_table[index]
+        else:
+            ticks = int(pulse / self._us_per_tick)
+        return ticks
 
     def enable_drive(self):
         """Allow motors to be used"""
@@ -78,20 +205,54 @@ class DriveTrain():
         self.drive_enabled = False
 
     def set_neutral(self):
-        """Send the neutral servo position to both motor controllers"""
-        self.set_servo_pulse(self.channels['left'], self.servo_mid)
-        self.set_servo_pulse(self.channels['right'], self.servo_mid)
-        self.set_servo_pulse(self.channels['front'], self.servo_mid)
+        """Send the neutral servo position to all motor controllers"""
+        self.set_servo_pulses({
+            self.channels['left']: self.servo_mid,
+            self.channels['right']: self.servo_mid,
+            self.channels['front']: self.servo_mid,
+        })
 
     def set_full_speed(self):
         """Set servo range to FULL extents"""
-        self.servo_min = self.servo_full_min
-        self.servo_max = self.servo_full_max
+        if self.servo_max != self.servo_full_max:
+            self.servo_min = self.servo_full_min
+            self.servo_max = self.servo_full_max
+            self._update_channel_map()
 
     def set_low_speed(self):
         """Limit servo range extents"""
-        self.servo_min = self.servo_low_min
-        self.servo_max = self.servo_low_max
+        if self.servo_max != self.servo_low_max:
+            self.servo_min = self.servo_low_min
+            self.servo_max = self.servo_low_max
+            self._update_channel_map()
+
+    def _update_channel_map(self):
+        """Precompute the linear map used by _map_channel_value for the
+        current servo range"""
+        self._map_scale = (self.servo_max - self.servo_min) / 2
+        self._map_offset = self.servo_min + self._map_scale
+
+    def set_layout(self, layout):
+        """Use a kinematics.Kinematics wheel layout for mix_and_assign.
+        Wheel channels may be names from self.channels or PWM channel
+        numbers"""
+        self.layout = layout
+        self._layout_channels = [
+            self.channels.get(channel, channel)
+            for channel in layout.channels
+        ]
+
+    def mix_and_assign(self, throttle, strafe, rotate):
+        """Take throttle, strafe and rotate values in the range -1 to 1,
+        mix them through the wheel layout and assign the resulting
+        servo pulses to its motor controllers"""
+        if not self.drive_enabled:
+            return
+        outputs = self.layout.mix(throttle, strafe, rotate)
+        self.set_servo_pulses(dict(
+            (channel, self._output_to_pulse(output))
+            for channel, output in zip(self._layout_channels, outputs)
+        ))
 
     # TODO - flesh out setters for raw pulse values (both channels)
     def mix_channels_and_assign(self, throttle, steering):
@@ -100,22 +261,11 @@ class DriveTrain():
         assign to the left/right motor controllers"""
         if not self.drive_enabled:
             return
-        pulse_throttle = self._map_channel_value(throttle)
-        pulse_steering = self._map_channel_value(steering)
-        output_pulse_left = clip(
-            (pulse_throttle + pulse_steering) / 2,
-            self.servo_min,
-            self.servo_max
-        )
-        output_pulse_right = clip(
-            (pulse_throttle - pulse_steering) / 2 + self.servo_mid,
-            self.servo_min,
-            self.servo_max
-        )
-
-        # Set the servo pulses for left and right channels
-        self.set_servo_pulse(self.channels['left'], output_pulse_left)
-        self.set_servo_pulse(self.channels['right'], output_pulse_right)
+        outputs = self.differential.mix(throttle, 0, steering)
+        self.set_servo_pulses({
+            self.channels['left']: self._output_to_pulse(outputs[0]),
+            self.channels['right']: self._output_to_pulse(outputs[1]),
+        })
 
     def mix_channels_omni_and_assign(self, throttle, steering, rotate):
         """ Take values for throttle, steering and rotation channels
@@ -123,57 +273,23 @@ class DriveTrain():
         the channels and assign to the left, right and front motors. """
         if not self.drive_enabled:
             return
-        pulse_throttle = self._map_channel_value(throttle)
-        pulse_steering = self._map_channel_value(steering)
-        pulse_rotate = self._map_channel_value(rotate)
-
-        # Appears to be RC signal in, we don't need this section
-        # VFwd = pulseIn(pin[0], HIGH)-1500
-        # VRotate = pulseIn(pin[1], HIGH)-1500
-        # VSide =pulseIn(pin[2], HIGH)-1500
-        round_dp = 0
-
-        # VFront = constrain(-VSide-VRotate, -500, 500)+1500
-        output_pulse_front = clip(
-            (-pulse_steering-pulse_rotate),
-            self.servo_min,
-            self.servo_max
-        )
-        # VLeft = constrain(-round(VSide*0.15+VFwd*0.86-VRotate),-500,500)+1500
-        output_pulse_left = clip(
-            -round(
-                   pulse_steering*0.15+pulse_throttle*0.86-pulse_rotate,
-                   round_dp
-            ),
-            self.servo_min,
-            self.servo_max
-        )
-        # VRight = constrain(round(VSide*0.15-VFwd*0.86-VRotate),-500,500)+1500
-        output_pulse_right = clip(
-            round(
-                  pulse_steering*0.15-pulse_throttle*0.86-pulse_rotate,
-                  round_dp
-            ),
-            self.servo_min,
-            self.servo_max
-        )
-
-        # where pulsein recieves a ~1000-2000 pulse,
-        # 1000 = full left/back,
-        # 2000 = full right/forward. so Vfwd is +/-500, 0 = stopped.
-
-        # Set the servo pulses for left and right channels
-        self.set_servo_pulse(self.channels['left'], output_pulse_left)
-        self.set_servo_pulse(self.channels['right'], output_pulse_right)
-        self.set_servo_pulse(self.channels['front'], output_pulse_front)
+        left, right, front = self.omni.mix(throttle, steering, rotate)
+        # Set the servo pulses for left, right and front channels
+        # as one burst to the PWM board
+        self.set_servo_pulses({
+            self.channels['left']: self._output_to_pulse(left),
+            self.channels['right']: self._output_to_pulse(right),
+            self.channels['front']: self._output_to_pulse(front),
+        })
+
+    def _output_to_pulse(self, output):
+        """Map a motor output in the range -1 to 1 to a servo pulse, with
+        0 at servo_mid and -1/1 at servo_min/servo_max"""
+        if output >= 0:
+            return self.servo_mid + output * (self.servo_max - self.servo_mid)
+        return self.servo_mid + output * (self.servo_mid - self.servo_min)
 
     def _map_channel_value(self, value):
         """Map the supplied value from the range -1 to 1 to a corresponding
         value within the range servo_min to servo_max"""
-        return int(
-            interp(
-                value,
-                [-1, 1],
-                [self.servo_min, self.servo_max]
-            )
-        )
+        return int(self._map_offset + self._map_scale * clip(value, -1, 1))
@@ -0,0 +1,249 @@
+"""Compact controller input types shared by the input sources."""
+from __future__ import division
+from lookup import build_clip_table, build_normalise_table, clip
+
+# Button bits, with the same values as the cwiid constants, so the
+# control loop can run from any input source without cwiid installed
+BTN_2 = 0x0001
+BTN_1 = 0x0002
+BTN_B = 0x0004
+BTN_A = 0x0008
+BTN_MINUS = 0x0010
+BTN_HOME = 0x0080
+BTN_LEFT = 0x0100
+BTN_RIGHT = 0x0200
+BTN_DOWN = 0x0400
+BTN_UP = 0x0800
+BTN_PLUS = 0x1000
+NUNCHUK_BTN_Z = 0x01
+NUNCHUK_BTN_C = 0x02
+
+
+class InputScaling(object):
+    """Raw to clipped/normalised lookup tables for the nunchuk stick and
+    accelerometer, rebuilt only when a range is changed"""
+    def __init__(self, joystick_range=None, acc_range=None):
+        self.joystick_range = joystick_range if joystick_range else [50, 200]
+        self.acc_range = acc_range if acc_range else [75, 175]
+
+    @property
+    def joystick_range(self):
+        """The raw [min, max] joystick readings mapped to -1 and 1"""
+        return self._joystick_range
+
+    @joystick_range.setter
+    def joystick_range(self, value):
+        # Raw readings are 8 bit, so precompute the result for each one
+        self._joystick_range = value
+        self.joystick_clipped = build_clip_table(value)
+        self.joystick_normalised = build_normalise_table(value)
+
+    @property
+    def acc_range(self):
+        """The raw [min, max] accelerometer readings mapped to -1 and 1"""
+        return self._acc_range
+
+    @acc_range.setter
+    def acc_range(self, value):
+        self._acc_range = value
+        self.acc_clipped = build_clip_table(value)
+        self.acc_normalised = build_normalise_table(value)
+
+
+class InputSnapshot(object):
+    """One reading of the controller, refilled in place every control
+    tick so the control path allocates nothing.
+
+    stick and acc hold the raw (x, y) and (x, y, z) readings, or None
+    without a nunchuk. Clipped and normalised values are only looked up
+    when asked for, the per-axis methods return table entries and so
+    build no new objects. acc_filtered is a filtered (x, y, z) reading
+    in raw units, for sources with an accelfilter.AccelPipeline."""
+    __slots__ = (
+        'buttons', 'nunchuk_buttons', 'stick', 'acc', 'acc_filtered',
+        'timestamp', 'scaling'
+    )
+
+    def __init__(self, scaling=None):
+        self.buttons = 0
+        self.nunchuk_buttons = 0
+        self.stick = None
+        self.acc = None
+        self.acc_filtered = None
+        self.timestamp = None
+        self.scaling = scaling if scaling is not None else InputScaling()
+
+    def fill(self, state, scaling=None):
+        """Refill from a cwiid style state dict"""
+        self.buttons = state['buttons']
+        self.timestamp = state.get('timestamp')
+        self.acc_filtered = None
+        nunchuk = state.get('nunchuk')
+        if nunchuk is None:
+            self.nunchuk_buttons = 0
+            self.stick = None
+            self.acc = None
+        else:
+            self.nunchuk_buttons = nunchuk['buttons']
+            self.stick = nunchuk['stick']
+            self.acc = nunchuk['acc']
+        if scaling is not None:
+            self.scaling = scaling
+        return self
+
+    @property
+    def has_nunchuk(self):
+        return self.stick is not None
+
+    def stick_axis(self, axis):
+        """Normalised stick axis, 0 = x, 1 = y, in the range -1 to 1"""
+        return self.scaling.joystick_normalised[self.stick[axis]]
+
+    def acc_axis(self, axis):
+        """Normalised accelerometer axis, 0 = x, 1 = y, 2 = z, in the
+        range -1 to 1"""
+        return self.scaling.acc_normalised[self.acc[axis]]
+
+    def filtered_acc_axis(self, axis):
+        """As acc_axis, but from the filtered reading where there is one"""
+        if self.acc_filtered is None:
+            return self.scaling.acc_normalised[self.acc[axis]]
+        low, high = self.scaling.acc_range
+        value = clip(self.acc_filtered[axis], low, high)
+        return 2 * (value - low) / (high - low) - 1
+
+    def stick_clipped(self):
+        table = self.scaling.joystick_clipped
+        return [table[channel] for channel in self.stick]
+
+    def stick_normalised(self):
+        table = self.scaling.joystick_normalised
+        return [table[channel] for channel in self.stick]
+
+    def acc_clipped(self):
+        table = self.scaling.acc_clipped
+        return [table[channel] for channel in self.acc]
+
+    def acc_normalised(self):
+        table = self.scaling.acc_normalised
+        return [table[channel] for channel in self.acc]
+
+
+class InputSource(object):
+    """Base for controller inputs, such as the wiimote, providing
+    everything the control loop reads on top of get_state(), which
+    returns a cwiid style state dict:
+        {'buttons': int, 'timestamp': float or None,
+         'nunchuk': {'buttons': int, 'stick': (x, y), 'acc': (x, y, z)}}
+    where 'nunchuk' is missing without a nunchuk attached."""
+    def __init__(self, joystick_range=None, acc_range=None):
+        self.scaling = InputScaling(joystick_range, acc_range)
+
+    @property
+    def joystick_range(self):
+        """The raw [min, max] joystick readings mapped to -1 and 1"""
+        return self.scaling.joystick_range
+
+    @joystick_range.setter
+    def joystick_range(self, value):
+        self.scaling.joystick_range = value
+
+    @property
+    def acc_range(self):
+        """The raw [min, max] accelerometer readings mapped to -1 and 1"""
+        return self.scaling.acc_range
+
+    @acc_range.setter
+    def acc_range(self, value):
+        self.scaling.acc_range = value
+
+    def get_state(self):
+        """The latest raw state as a dict"""
+        raise NotImplementedError
+
+    def read_snapshot(self, snapshot, state=None):
+        """Refill an InputSnapshot in place from the current state.
+        Each consumer thread should own its snapshot"""
+        return snapshot.fill(
+            state if state is not None else self.get_state(),
+            self.scaling
+        )
+
+    def new_snapshot(self):
+        """An InputSnapshot using this source's ranges"""
+        return InputSnapshot(self.scaling)
+
+    def get_nunchuk_accel_state(self, state=None):
+        """ Get the nunchuck accelerometer. Kept for compatibility,
+            the control loop uses read_snapshot instead.
+            Returns a dictionary containing the state of
+            the nunchuk joystick in the form:
+            {
+            "state": {
+                    "raw": tuple of the raw joystick readings
+                           from cwiid in the form (x, y),
+                    "clipped": tuple of the raw values, clipped
+                               to the min/max range,
+                    "normalised": the 'clipped' tuple, with the
+                                values mapped to the range -1 to 1
+                }
+            "range": The min/max range to clip raw values to
+            }
+        """
+        snapshot = self.read_snapshot(self.new_snapshot(), state)
+        if not snapshot.has_nunchuk:
+            return None
+        return dict(
+            range=self.acc_range,
+            state=dict(
+                raw=snapshot.acc,
+                clipped=snapshot.acc_clipped(),
+                normalised=snapshot.acc_normalised()
+            )
+        )
+
+    def get_joystick_state(self, state=None):
+        """Returns a dictionary containing the state
+           of the nunchuk joystick, kept for compatibility,
+           the control loop uses read_snapshot instead. In the form:
+            {
+            "state": {
+                    "raw": tuple of the raw joystick readings
+                           from cwiid in the form (x, y),
+                    "clipped": tuple of the raw values,
+                               clipped to the min/max range,
+                    "normalised": the 'clipped' tuple, with
+                                  the values mapped to the range -1 to 1
+                }
+            "range": The min/max range to clip raw values to
+            }
+        """
+        snapshot = self.read_snapshot(self.new_snapshot(), state)
+        if not snapshot.has_nunchuk:
+            return None
+        return dict(
+            range=self.joystick_range,
+            state=dict(
+                raw=snapshot.stick,
+                clipped=snapshot.stick_clipped(),
+                normalised=snapshot.stick_normalised()
+            )
+        )
+
+    def get_buttons(self, state=None):
+        """Get just the current button state of the controller"""
+        if state is None:
+            state = self.get_state()
+        buttons_state = state['buttons']
+
+        return buttons_state
+
+    def get_nunchuk_buttons(self, state=None):
+        """Get just the current button state of the nunchuk"""
+        if state is None:
+            state = self.get_state()
+        if 'nunchuk' not in state:
+            return None
+        buttons_state = state['nunchuk']['buttons']
+
+        return buttons_state
@@ -0,0 +1,150 @@
+"""Mixing matrices for driving arbitrary wheel layouts.
+
+A layout is a list of wheels, each with the direction it drives in and
+its position on the robot. From that a matrix is built once, mapping
+the (throttle, strafe, rotate) inputs, each in the range -1 to 1, to a
+speed for every wheel in the range -1 to 1.
+
+Coordinates are x to the right and y forward of the robot centre,
+angles are degrees clockwise from straight ahead and positive rotate
+turns the robot clockwise."""
+from __future__ import division
+import math
+
+
+class Wheel(object):
+    """A driven wheel, with the direction (degrees) its motor pushes the
+    robot for a positive output, its position, and the drivetrain
+    channel (name or PWM channel number) it is wired to"""
+    __slots__ = ('channel', 'angle', 'x', 'y')
+
+    def __init__(self, channel, angle, x=0.0, y=0.0):
+        self.channel = channel
+        self.angle = angle
+        self.x = x
+        self.y = y
+
+    def row(self):
+        """The wheel's response to unit throttle, strafe and rotate"""
+        theta = math.radians(self.angle)
+        return [
+            math.cos(theta),
+            math.sin(theta),
+            self.y * math.sin(theta) - self.x * math.cos(theta),
+        ]
+
+
+class Kinematics(object):
+    """Precomputed input to motor mixing matrix for one wheel layout"""
+    def __init__(self, channels, matrix):
+        self.channels = tuple(channels)
+        # Plain tuples are quicker than numpy for a single 3 element
+        # input on the Pi, numpy is kept for mix_many
+        self._rows = tuple(
+            tuple(float(value) for value in row) for row in matrix
+        )
+        shape = (len(self._rows), len(self._rows[0]) if self._rows else 0)
+        if shape != (len(self.channels), 3) or any(
+            len(row) != 3 for row in self._rows
+        ):
+            raise ValueError(
+                "mixing matrix must be {0}x3, got {1}".format(
+                    len(self.channels), shape
+                )
+            )
+        self._matrix = None
+
+    @property
+    def matrix(self):
+        """The mixing matrix as a numpy array. numpy is only imported
+        here, as it takes seconds to import on a Pi Zero at boot"""
+        if self._matrix is None:
+            import numpy
+            self._matrix = numpy.array(self._rows, dtype=float)
+        return self._matrix
+
+    @classmethod
+    def from_wheels(cls, wheels):
+        """Build the matrix from wheel geometry, scaling each input column
+        so a full scale input drives the fastest wheel at full speed"""
+        matrix = [
+            [0.0 if abs(value) < 1e-9 else value for value in wheel.row()]
+            for wheel in wheels
+        ]
+        peak = [max(abs(row[column]) for row in matrix) or 1.0
+                for column in range(3)]
+        return cls(
+            [wheel.channel for wheel in wheels],
+            [[value / peak[column] for column, value in enumerate(row)]
+             for row in matrix]
+        )
+
+    def mix(self, throttle, strafe, rotate):
+        """Return a list of wheel outputs in the range -1 to 1. If any
+        output saturates, all are scaled down together so the direction
+        of travel is kept"""
+        outputs = [
+            a * throttle + b * strafe + c * rotate
+            for a, b, c in self._rows
+        ]
+        peak = max(abs(value) for value in outputs)
+        if peak > 1:
+            outputs = [value / peak for value in outputs]
+        return outputs
+
+    def mix_many(self, inputs):
+        """Vectorised mix of an (N, 3) array of (throttle, strafe, rotate)
+        inputs, such as a recorded drive, into an (N, wheels) array"""
+        import numpy
+        outputs = numpy.dot(numpy.asarray(inputs, dtype=float), self.matrix.T)
+        peak = numpy.abs(outputs).max(axis=1)
+        return outputs / numpy.maximum(peak, 1.0)[:, numpy.newaxis]
+
+
+def differential_wheels(track_width=1.0, left='left', right='right'):
+    """Wheels of a two wheel skid steer"""
+    return [
+        Wheel(left, 0, x=-track_width / 2),
+        Wheel(right, 0, x=track_width / 2),
+    ]
+
+
+def differential(track_width=1.0, left='left', right='right'):
+    """Two wheel skid steer, rotate turns on the spot, strafe is ignored"""
+    return Kinematics.from_wheels(
+        differential_wheels(track_width, left, right))
+
+
+def kiwi_wheels(radius=1.0, channels=('front', 'right', 'left')):
+    """Wheels of a three wheel omni, see kiwi"""
+    wheels = []
+    for index, channel in enumerate(channels):
+        bearing = math.radians(index * 120)
+        wheels.append(Wheel(
+            channel,
+            index * 120 + 90,
+            x=radius * math.sin(bearing),
+            y=radius * math.cos(bearing),
+        ))
+    return wheels
+
+
+def kiwi(radius=1.0, channels=('front', 'right', 'left')):
+    """Three omni wheels 120 degrees apart, each driving tangentially
+    (clockwise), with the first wheel at the front"""
+    return Kinematics.from_wheels(kiwi_wheels(radius, channels))
+
+
+def mecanum(length=1.0, width=1.0,
+            channels=('front_left', 'front_right', 'rear_left', 'rear_right')):
+    """Four mecanum wheels with 45 degree rollers in the usual X
+    arrangement, modelled by the direction each wheel pushes the robot"""
+    half_l = length / 2
+    half_w = width / 2
+    front_left, front_right, rear_left, rear_right = channels
+    return Kinematics.from_wheels([
+        Wheel(front_left, 45, x=-half_w, y=half_l),
+        Wheel(front_right, -45, x=half_w, y=half_l),
+        Wheel(rear_left, -45, x=-half_w, y=-half_l),
+        Wheel(rear_right, 45, x=half_w, y=-half_l),
+    ])
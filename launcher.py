@@ -2,18 +2,30 @@
 """ Main python script to call, waits for robot button
 presses to either start wiimote stuff, or shutdown pi """
 
+# First, so the boot timeline includes the other imports
+from boot import timeline
 import RPi.GPIO as GPIO
-import time
 import os
 import sys
-import threading
-import cwiid
-from wiimote import Wiimote, WiimoteException
+from functools import partial
+from wiimote import Wiimote
+from udpinput import DEFAULT_HOST, UDPInput
+from recorder import InputRecorder
 import drivetrain
-import rc
+from libs.Adafruit_I2C import Adafruit_I2C
+from libs.I2C_RDWR_Bus import I2CRdwrBus
 import logging
+import asynclog
+import accelfilter
+from supervisor import Supervisor, TOGGLE_RC, RC, ESTOP, RESET
+from watchdog import Watchdog
+import realtime
+import metrics
 
-logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+# Log records are formatted and written to stdout by a background
+# thread, with each logging call limited to a few lines a second
+log_listener = asynclog.setup(level=logging.INFO, rate=5)
+timeline.mark("imports")
 
 start_pin = 24
 shutdown_pin = 18
@@ -21,13 +33,49 @@ power_led_pin = 21
 wiimote_led_pin = 13
 rc_led_pin = 7
 pwm_address = 0x40
-
-# Thread pointer for RC mode
-rc_class = None
-rc_thread = None
-# class pointers to wiimote and drivetrain
-drive = None
-wiimote = None
+# Control loop updates per second
+control_rate = 50
+# ESC frame rate. ESCs that accept fast frames can take 200-400, with
+# control_rate raised to match, so commands reach the motors sooner
+pwm_freq = 50
+# Measured PWM output frequency over drive.pwm.frequency, if the board's
+# oscillator is off enough to matter
+osc_calibration = 1.0
+# Talk to the PWM board with I2C_RDWR ioctls on /dev/i2c-N instead of
+# python-smbus, so each update is one syscall however many bursts
+i2c_rdwr = False
+# Write to the PWM board from a separate output process, so bus writes
+# never wait on the control loop, instead of a writer thread
+process_writes = False
+# Nunchuk accelerometer filter, run at each tick over the newest
+# accel_taps reports: a moving average, or a low-pass at accel_cutoff of
+# the report rate if set. 0 taps uses the latest report as it is
+accel_taps = 8
+accel_cutoff = None
+# Set to a file path to record every wiimote report, for replay.py
+input_recording = None
+# Last paired wiimote address, so reconnects skip discovery
+bdaddr_file = "wiimote.bdaddr"
+# Set to a port number to take control packets over UDP instead of
+# from the wiimote, e.g. from udp_sender.py
+udp_port = None
+# Address the UDP port is bound on. Packets are not authenticated, so
+# keep to loopback or the controller's own link, not a shared network
+udp_host = DEFAULT_HOST
+# Query the control loop metrics with: python metrics.py <socket>
+metrics_socket = metrics.DEFAULT_SOCKET
+# Longest a stalled control loop can leave the last pulses on the motors
+watchdog_deadline = 0.1
+# Opt-in real time scheduling of the control loop, as root: SCHED_FIFO
+# at realtime_priority, optionally pinned to realtime_cpu, with memory
+# locked and garbage collection only between ticks. The watchdog runs
+# one priority higher, the PWM writer stays under ordinary scheduling
+realtime_mode = False
+realtime_priority = 50
+realtime_cpu = None
+# Set to a file path to log every tick's pulses and mixer inputs,
+# read back with asynclog.read_binary_log
+trace_file = None
 
 # Project installation directory
 project_dir = "/home/pi/Projects/pinoon/"
@@ -54,16 +102,7 @@ GPIO.output(power_led_pin, GPIO.HIGH)
 GPIO.output(wiimote_led_pin, GPIO.LOW)
 # Turn RC Mode led OFF
 GPIO.output(rc_led_pin, GPIO.LOW)
-
-
-def kill_rc_thread():
-    """ Stop any active RC thread """
-    global rc_class
-    global rc_thread
-    if rc_class is not None:
-        rc_class.stop()
-    rc_class = None
-    rc_thread = None
+timeline.mark("gpio setup")
 
 
 def shutdown_callback(channel):
@@ -78,44 +117,98 @@ def shutdown_callback(channel):
 def start_wiimote_callback(channel):
     """ Threaded callback function called
     when user presses the start button """
-    global drive
-    global wiimote
-    global rc_class
-    global rc_thread
-    if not rc_class:
-        print("Starting RC Mode")
-        # Create and start a new thread running the remote control script
-        rc_class = rc.rc(drive, wiimote)
-        rc_thread = threading.Thread(target=rc_class.run)
-        rc_thread.start()
-        # Turn RC Mode led ON
-        GPIO.output(rc_led_pin, GPIO.HIGH)
-    else:
-        print("Stopping RC Mode")
-        # Kill Thread
-        kill_rc_thread()
-        # Turn RC Mode led OFF
-        GPIO.output(rc_led_pin, GPIO.LOW)
+    # The control loop owns the mode, just ask it to switch. After an
+    # emergency stop (the wiimote HOME button) the first press resets
+    # it to idle, the next starts RC mode again
+    supervisor.post(RESET if supervisor.mode == ESTOP else TOGGLE_RC)
 
 
-def set_neutral(drive, wiimote):
-    """Simple method to ensure motors are disabled"""
-    if drive:
-        drive.set_neutral()
-        drive.disable_drive()
-    if wiimote is not None:
-        # turn on leds on wii remote
-        wiimote.led = 2
+def mode_changed(mode):
+    """ RC Mode led shows whether RC mode is on """
+    if mode == ESTOP:
+        print("Emergency stop, press start to reset")
+    else:
+        print("RC Mode {0}".format("started" if mode == RC else "stopped"))
+    GPIO.output(rc_led_pin, GPIO.HIGH if mode == RC else GPIO.LOW)
+
 
+def connection_changed(connected):
+    """ Wiimote connection led follows the connection state """
+    GPIO.output(wiimote_led_pin, GPIO.HIGH if connected else GPIO.LOW)
+    if connected:
+        # The robot can be driven from here, show where the time went
+        timeline.mark("wiimote connected")
+        timeline.log_report()
 
-def set_drive(drive, wiimote):
-    """Simple method to highlight that motors are enabled"""
-    if wiimote is not None:
-        # turn on leds on wii remote
-        # turn on led to show connected
-        drive.enable_drive()
-        wiimote.led = 1
 
+# Initiate the wiimote connection first, it pairs in the background
+# while the drivetrain is set up, and reconnects by itself if the remote
+# drops. The control loop holds neutral while it is disconnected
+recorder = InputRecorder(input_recording) if input_recording else None
+if udp_port:
+    print("Waiting for control packets on UDP {0}:{1}".format(
+        udp_host, udp_port))
+    wiimote = UDPInput(port=udp_port, host=udp_host)
+    input_stats = wiimote.stats
+else:
+    print("Waiting for you to press '1+2' on wiimote")
+    if not accel_taps:
+        accel_filter = None
+    elif accel_cutoff is None:
+        accel_filter = partial(accelfilter.moving_average, accel_taps)
+    else:
+        accel_filter = partial(accelfilter.lowpass, accel_taps, accel_cutoff)
+    wiimote = Wiimote(
+        callbacks=True,
+        recorder=recorder,
+        bdaddr_file=bdaddr_file,
+        background=True,
+        accel_filter=accel_filter
+    )
+    input_stats = wiimote.get_report_stats
+timeline.mark("wiimote pairing started")
+# Initiate the drivetrain, which sets the motors to neutral
+i2c_bus = I2CRdwrBus(Adafruit_I2C.getPiI2CBusNumber()) if i2c_rdwr else None
+drive = drivetrain.DriveTrain(
+    pwm_i2c=pwm_address,
+    bus=i2c_bus,
+    pwm_freq=pwm_freq,
+    osc_calibration=osc_calibration,
+    async_writes=True,
+    process_writes=process_writes,
+    max_bus_rate=max(pwm_freq, control_rate)
+)
+timeline.mark("drivetrain neutral")
+trace = asynclog.BinaryLog(trace_file) if trace_file else None
+drive.trace = trace
+# Cheap enough to leave on, read with SIGUSR1 or from metrics_socket
+loop_metrics = metrics.Metrics()
+metrics.time_pwm(drive.pwm, loop_metrics)
+loop_metrics.add_source('pwm_cache', drive.pwm.cacheStats)
+loop_metrics.add_source('input', input_stats)
+if i2c_bus is not None:
+    loop_metrics.add_source('i2c_rdwr', i2c_bus.stats)
+if drive.writer is not None:
+    loop_metrics.add_source('writer', drive.writer.stats)
+# Forces neutral over its own I2C handle if the control loop stalls
+watchdog = Watchdog(
+    drive,
+    deadline=watchdog_deadline,
+    priority=min(realtime_priority + 1, 99) if realtime_mode else None
+)
+loop_metrics.add_source('watchdog', watchdog.stats)
+metrics.dump_on_signal(loop_metrics)
+metrics_server = metrics.MetricsServer(loop_metrics, metrics_socket)
+supervisor = Supervisor(
+    drive,
+    wiimote,
+    rate=control_rate,
+    on_mode_change=mode_changed,
+    on_connection_change=connection_changed,
+    metrics=loop_metrics,
+    watchdog=watchdog
+)
+supervisor.controller.trace = trace
 
 # Callback function
 GPIO.add_event_detect(
@@ -132,48 +225,20 @@ GPIO.add_event_detect(
     bouncetime=300
 )
 
-
-# Initiate the drivetrain
-drive = drivetrain.DriveTrain(pwm_i2c=pwm_address)
-# Initiate the wiimote connection
-wiimote = None
-while not wiimote:
-    # Loop for ever waiting for the wiimote to connect.
-    try:
-        print("Waiting for you to press '1+2' on wiimote")
-        wiimote = Wiimote()
-
-    except WiimoteException:
-        print("Wiimote error")
-        wiimote = None
-        # logging.error("Could not connect to wiimote. please try again")
-
-# Turn Wiimote connection led ON
-GPIO.output(wiimote_led_pin, GPIO.HIGH)
-
+if realtime_mode:
+    # Applies to this thread, which runs the control loop, and to the
+    # watchdog thread started after it, which then raises its own
+    # priority above the loop's. The writer thread started with the
+    # drivetrain is not affected
+    realtime.enable(realtime_priority, realtime_cpu)
+    gc_scheduler = realtime.GCScheduler.for_rate(control_rate).start()
+    supervisor.scheduler.idle = gc_scheduler
+    loop_metrics.add_source('gc', gc_scheduler.stats)
+timeline.mark("control loop start")
+watchdog.start()
 try:
-    # Constantly check wiimote for button presses
-    while wiimote:
-        buttons_state = wiimote.get_buttons()
-        nunchuk_buttons_state = wiimote.get_nunchuk_buttons()
-        joystick_state = wiimote.get_joystick_state()
-
-        # Test if B or Z button is pressed
-        if (
-            joystick_state is None or
-            (buttons_state & cwiid.BTN_B) or
-            (nunchuk_buttons_state & cwiid.NUNCHUK_BTN_Z)
-        ):
-            # No nunchuk joystick detected or B or Z button
-            # pressed, must go into neutral for safety
-            set_neutral(drive, wiimote)
-        else:
-            # Enable motors
-            set_drive(drive, wiimote)
-
-        # MUST have small sleep here, otherwise PWM
-        # board gets too many events and crashes.
-        time.sleep(0.05)
+    # One loop reads the wiimote, tracks the mode and drives the motors
+    supervisor.run()
 
 except (Exception, KeyboardInterrupt) as e:
     print("Exception OR Ctrl+C Pressed")
@@ -186,6 +251,14 @@ GPIO.output(wiimote_led_pin, GPIO.LOW)
 GPIO.output(rc_led_pin, GPIO.LOW)
 
 # Finally, always close active threads
-kill_rc_thread()
+watchdog.stop()
+metrics_server.close()
+wiimote.close()
+drive.close()
+if recorder:
+    recorder.close()
+if trace:
+    trace.close()
+log_listener.stop()
 # clean up GPIO on normal exit
 GPIO.cleanup()
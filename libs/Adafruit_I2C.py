@@ -1,6 +1,46 @@
 #!/usr/bin/python
 import re
-import smbus
+import logging
+try:
+  import smbus
+except ImportError:
+  # Only needed for real hardware, a simulated bus can be passed instead
+  smbus = None
+
+# Debug output goes through logging, so it can be handled off the control thread
+logger = logging.getLogger(__name__)
+
+# ===========================================================================
+# I2CBus Interface
+# ===========================================================================
+
+class I2CBus(object):
+  "The subset of the smbus.SMBus interface used by Adafruit_I2C, for alternative bus backends"
+
+  # True if a forked copy of the bus still reaches the same devices, as
+  # one on a /dev/i2c-N file descriptor does, but not a simulated bus
+  sharedAcrossProcesses = False
+
+  def write_byte(self, addr, value):
+    raise NotImplementedError
+
+  def write_byte_data(self, addr, reg, value):
+    raise NotImplementedError
+
+  def write_word_data(self, addr, reg, value):
+    raise NotImplementedError
+
+  def write_i2c_block_data(self, addr, reg, data):
+    raise NotImplementedError
+
+  def read_byte_data(self, addr, reg):
+    raise NotImplementedError
+
+  def read_word_data(self, addr, reg):
+    raise NotImplementedError
+
+  def read_i2c_block_data(self, addr, reg, length):
+    raise NotImplementedError
 
 # ===========================================================================
 # Adafruit_I2C Class
@@ -8,9 +48,21 @@ import smbus
 
 class Adafruit_I2C(object):
 
+  # /proc/cpuinfo is only scanned once per process, it cannot change
+  piRevision = None
+  piI2CBusNumber = None
+  # Failed transactions per device address, across every instance
+  errorCounts = {}
+
   @staticmethod
   def getPiRevision():
     "Gets the version number of the Raspberry Pi board"
+    if Adafruit_I2C.piRevision is None:
+      Adafruit_I2C.piRevision = Adafruit_I2C._readPiRevision()
+    return Adafruit_I2C.piRevision
+
+  @staticmethod
+  def _readPiRevision():
     # Revision list available at: http://elinux.org/RPi_HardwareHistory#Board_Revision_History
     try:
       with open('/proc/cpuinfo', 'r') as infile:
@@ -32,16 +84,26 @@ class Adafruit_I2C(object):
   @staticmethod
   def getPiI2CBusNumber():
     # Gets the I2C bus number /dev/i2c#
-    return 1 if Adafruit_I2C.getPiRevision() > 1 else 0
+    if Adafruit_I2C.piI2CBusNumber is None:
+      Adafruit_I2C.piI2CBusNumber = 1 if Adafruit_I2C.getPiRevision() > 1 else 0
+    return Adafruit_I2C.piI2CBusNumber
 
-  def __init__(self, address, busnum=-1, debug=False):
+  def __init__(self, address, busnum=-1, debug=False, bus=None):
     self.address = address
-    # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
-    # Alternatively, you can hard-code the bus version below:
-    # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
-    # self.bus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
-    self.bus = smbus.SMBus(busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber())
+    # An I2CBus backend (e.g. a simulator) can be supplied in place of smbus
+    if bus is not None:
+      self.bus = bus
+    elif smbus is None:
+      raise ImportError("smbus is not installed and no I2C bus backend was given")
+    else:
+      # By default, the correct I2C bus is auto-detected using /proc/cpuinfo
+      # Alternatively, you can hard-code the bus version below:
+      # self.bus = smbus.SMBus(0); # Force I2C0 (early 256MB Pi's)
+      # self.bus = smbus.SMBus(1); # Force I2C1 (512MB Pi's)
+      self.bus = smbus.SMBus(busnum if busnum >= 0 else Adafruit_I2C.getPiI2CBusNumber())
     self.debug = debug
+    self.transactionBus = None
+    self.beginTransaction = None
 
   def reverseByteOrder(self, data):
     "Reverses the byte order of an int (16-bit) or long (32-bit) value"
@@ -53,8 +115,30 @@ class Adafruit_I2C(object):
       data >>= 8
     return val
 
+  def transaction(self):
+    "Opens a combined transaction if the bus backend supports them (see I2C_RDWR_Bus), else returns None"
+    # Looked up once per bus, this is on every PWM update
+    if self.bus is not self.transactionBus:
+      self.transactionBus = self.bus
+      self.beginTransaction = getattr(self.bus, 'transaction', None)
+    if self.beginTransaction is None:
+      return None
+    return self.beginTransaction()
+
+  def commit(self, transaction):
+    "Commits a transaction from transaction()"
+    try:
+      return transaction.commit()
+    except IOError, err:
+      return self.errMsg()
+
+  def abandon(self, transaction):
+    "Closes a transaction from transaction() without committing it, e.g. on an exception"
+    transaction.abandon()
+
   def errMsg(self):
-    print "Error accessing 0x%02X: Check your I2C address" % self.address
+    Adafruit_I2C.errorCounts[self.address] = Adafruit_I2C.errorCounts.get(self.address, 0) + 1
+    logger.error("Error accessing 0x%02X: Check your I2C address", self.address)
     return -1
 
   def write8(self, reg, value):
@@ -62,7 +146,7 @@ class Adafruit_I2C(object):
     try:
       self.bus.write_byte_data(self.address, reg, value)
       if self.debug:
-        print "I2C: Wrote 0x%02X to register 0x%02X" % (value, reg)
+        logger.debug("I2C: Wrote 0x%02X to register 0x%02X", value, reg)
     except IOError, err:
       return self.errMsg()
 
@@ -71,8 +155,8 @@ class Adafruit_I2C(object):
     try:
       self.bus.write_word_data(self.address, reg, value)
       if self.debug:
-        print ("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X" %
-         (value, reg, reg+1))
+        logger.debug("I2C: Wrote 0x%02X to register pair 0x%02X,0x%02X",
+         value, reg, reg+1)
     except IOError, err:
       return self.errMsg()
 
@@ -81,7 +165,7 @@ class Adafruit_I2C(object):
     try:
       self.bus.write_byte(self.address, value)
       if self.debug:
-        print "I2C: Wrote 0x%02X" % value
+        logger.debug("I2C: Wrote 0x%02X", value)
     except IOError, err:
       return self.errMsg()
 
@@ -89,8 +173,7 @@ class Adafruit_I2C(object):
     "Writes an array of bytes using I2C format"
     try:
       if self.debug:
-        print "I2C: Writing list to register 0x%02X:" % reg
-        print list
+        logger.debug("I2C: Writing list to register 0x%02X: %s", reg, list)
       self.bus.write_i2c_block_data(self.address, reg, list)
     except IOError, err:
       return self.errMsg()
@@ -100,9 +183,8 @@ class Adafruit_I2C(object):
     try:
       results = self.bus.read_i2c_block_data(self.address, reg, length)
       if self.debug:
-        print ("I2C: Device 0x%02X returned the following from reg 0x%02X" %
-         (self.address, reg))
-        print results
+        logger.debug("I2C: Device 0x%02X returned the following from reg 0x%02X: %s",
+         self.address, reg, results)
       return results
     except IOError, err:
       return self.errMsg()
@@ -112,8 +194,8 @@ class Adafruit_I2C(object):
     try:
       result = self.bus.read_byte_data(self.address, reg)
       if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
+        logger.debug("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X",
+         self.address, result & 0xFF, reg)
       return result
     except IOError, err:
       return self.errMsg()
@@ -124,8 +206,8 @@ class Adafruit_I2C(object):
       result = self.bus.read_byte_data(self.address, reg)
       if result > 127: result -= 256
       if self.debug:
-        print ("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X" %
-         (self.address, result & 0xFF, reg))
+        logger.debug("I2C: Device 0x%02X returned 0x%02X from reg 0x%02X",
+         self.address, result & 0xFF, reg)
       return result
     except IOError, err:
       return self.errMsg()
@@ -139,7 +221,7 @@ class Adafruit_I2C(object):
       if not little_endian:
         result = ((result << 8) & 0xFF00) + (result >> 8)
       if (self.debug):
-        print "I2C: Device 0x%02X returned 0x%04X from reg 0x%02X" % (self.address, result & 0xFFFF, reg)
+        logger.debug("I2C: Device 0x%02X returned 0x%04X from reg 0x%02X", self.address, result & 0xFFFF, reg)
       return result
     except IOError, err:
       return self.errMsg()
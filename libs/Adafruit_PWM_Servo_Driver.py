@@ -27,66 +27,220 @@ class PWM :
 
   # Bits
   __RESTART            = 0x80
+  __AI                 = 0x20
   __SLEEP              = 0x10
   __ALLCALL            = 0x01
   __INVRT              = 0x10
   __OUTDRV             = 0x04
 
-  general_call_i2c = Adafruit_I2C(0x00)
+  # SMBus block writes carry at most 32 bytes, i.e. 8 channels of LEDn registers
+  MAX_BURST_CHANNELS   = 8
+
+  # Nominal internal oscillator frequency, the real one varies by a few percent
+  OSC_FREQ             = 25000000.0
+  # Prescale register limits, 3 gives ~1526Hz and 255 ~24Hz
+  PRESCALE_MIN         = 3
+  PRESCALE_MAX         = 255
+
+  # Opened on first use, so importing this module does not touch the bus
+  general_call_i2c = None
 
   @classmethod
-  def softwareReset(cls):
+  def softwareReset(cls, bus=None):
     "Sends a software reset (SWRST) command to all the servo drivers on the bus"
+    if cls.general_call_i2c is None or bus is not None:
+      cls.general_call_i2c = Adafruit_I2C(0x00, bus=bus)
     cls.general_call_i2c.writeRaw8(0x06)        # SWRST
 
-  def __init__(self, address=0x40, debug=False):
-    self.i2c = Adafruit_I2C(address)
+  def __init__(self, address=0x40, debug=False, bus=None, oscCalibration=1.0, reset=True):
+    self.i2c = Adafruit_I2C(address, bus=bus)
     self.i2c.debug = debug
     self.address = address
     self.debug = debug
+    # oscCalibration is the measured output frequency over the frequency this
+    # class reports, to correct for the board's own oscillator
+    self.oscFreq = self.OSC_FREQ * oscCalibration
+    # Programmed prescale and the output frequency it gives, set by setPWMFreq
+    self.prescale = None
+    self.frequency = None
+    # Shadow copy of every register as last written, None where unknown.
+    # Writes that would not change the board are suppressed and counted.
+    self.shadow = [None] * 256
+    self.deadband = [0] * 16
+    self.cacheHits = 0
+    self.cacheMisses = 0
+    if not reset:
+      # Attach to a board already set up by another PWM object, e.g. from
+      # another process, leaving its outputs and frequency as they are
+      return
     if (self.debug):
       print "Reseting PCA9685 MODE1 (without SLEEP) and MODE2"
     self.setAllPWM(0, 0)
-    self.i2c.write8(self.__MODE2, self.__OUTDRV)
-    self.i2c.write8(self.__MODE1, self.__ALLCALL)
+    self.writeRegister(self.__MODE2, self.__OUTDRV)
+    self.writeRegister(self.__MODE1, self.__ALLCALL | self.__AI)  # auto-increment
     time.sleep(0.005)                                       # wait for oscillator
-    
+
     mode1 = self.i2c.readU8(self.__MODE1)
     mode1 = mode1 & ~self.__SLEEP                 # wake up (reset sleep)
-    self.i2c.write8(self.__MODE1, mode1)
+    self.writeRegister(self.__MODE1, mode1, force=True)
     time.sleep(0.005)                             # wait for oscillator
 
+  def writeRegister(self, reg, value, force=False):
+    "Writes an 8-bit register unless the shadow copy shows it already holds value"
+    if not force and self.shadow[reg] == value:
+      self.cacheHits += 1
+      return
+    self.cacheMisses += 1
+    if self.i2c.write8(reg, value) == -1:
+      self.shadow[reg] = None
+    elif reg == self.__MODE1:
+      self.shadow[reg] = value & ~self.__RESTART  # RESTART clears itself
+    else:
+      self.shadow[reg] = value
+
+  def setDeadband(self, channel, ticks):
+    "Suppresses channel updates whose off count moves by no more than ticks"
+    self.deadband[channel] = ticks
+
+  def forceSync(self):
+    "Rewrites every register held in the shadow copy, e.g. after a bus error or reset"
+    shadow = list(self.shadow)
+    mode1 = shadow[self.__MODE1]
+    if shadow[self.__MODE2] is not None:
+      self.writeRegister(self.__MODE2, shadow[self.__MODE2], force=True)
+    # MODE1 must be restored before any burst, a reset clears auto-increment
+    if shadow[self.__PRESCALE] is not None:
+      self._setPrescale(shadow[self.__PRESCALE], mode1)
+    elif mode1 is not None:
+      self.writeRegister(self.__MODE1, mode1, force=True)
+    channels = {}
+    for channel in range(16):
+      reg = self.__LED0_ON_L+4*channel
+      values = shadow[reg:reg+4]
+      if None not in values:
+        channels[channel] = (values[0] | values[1] << 8, values[2] | values[3] << 8)
+    self.setPWMMulti(channels, force=True)
+
+  def cacheStats(self):
+    "Returns the shadow register hit/miss counters"
+    return {'hits': self.cacheHits, 'misses': self.cacheMisses}
+
   def setPWMFreq(self, freq):
-    "Sets the PWM frequency"
-    prescaleval = 25000000.0    # 25MHz
+    "Sets the PWM frequency, the frequency actually output is left in self.frequency"
+    prescaleval = self.oscFreq  # 25MHz
     prescaleval /= 4096.0       # 12-bit
     prescaleval /= float(freq)
     prescaleval -= 1.0
     if (self.debug):
       print "Setting PWM frequency to %d Hz" % freq
       print "Estimated pre-scale: %d" % prescaleval
-    prescale = math.floor(prescaleval + 0.5)
+    prescale = int(math.floor(prescaleval + 0.5))
+    prescale = min(max(prescale, self.PRESCALE_MIN), self.PRESCALE_MAX)
     if (self.debug):
       print "Final pre-scale: %d" % prescale
+    self.prescale = prescale
+    self.frequency = self.oscFreq / (4096.0 * (prescale + 1))
 
-    oldmode = self.i2c.readU8(self.__MODE1);
+    if self.shadow[self.__PRESCALE] == prescale:
+      # Already running at this frequency, skip the sleep/restart cycle
+      self.cacheHits += 1
+      return
+    self._setPrescale(prescale)
+
+  def _setPrescale(self, prescale, oldmode=None):
+    "Programs the prescaler, which the PCA9685 only accepts while asleep"
+    if oldmode is None:
+      oldmode = self.i2c.readU8(self.__MODE1)
     newmode = (oldmode & 0x7F) | 0x10             # sleep
-    self.i2c.write8(self.__MODE1, newmode)        # go to sleep
-    self.i2c.write8(self.__PRESCALE, int(math.floor(prescale)))
-    self.i2c.write8(self.__MODE1, oldmode)
+    self.writeRegister(self.__MODE1, newmode, force=True)        # go to sleep
+    self.writeRegister(self.__PRESCALE, prescale, force=True)
+    self.writeRegister(self.__MODE1, oldmode, force=True)
     time.sleep(0.005)
-    self.i2c.write8(self.__MODE1, oldmode | 0x80)
+    self.writeRegister(self.__MODE1, oldmode | 0x80, force=True)
 
   def setPWM(self, channel, on, off):
     "Sets a single PWM channel"
-    self.i2c.write8(self.__LED0_ON_L+4*channel, on & 0xFF)
-    self.i2c.write8(self.__LED0_ON_H+4*channel, on >> 8)
-    self.i2c.write8(self.__LED0_OFF_L+4*channel, off & 0xFF)
-    self.i2c.write8(self.__LED0_OFF_H+4*channel, off >> 8)
+    # MODE1 auto-increment is enabled, so all four LEDn registers go in one burst
+    self.setPWMMulti({channel: (on, off)})
+
+  def setPWMMulti(self, channels, force=False):
+    "Sets several PWM channels from a {channel: (on, off)} dict, one burst per contiguous run"
+    # Every burst goes in one ioctl where the bus backend can combine them
+    transaction = self.i2c.transaction()
+    try:
+      self._writeRuns(channels, force, transaction)
+    except:
+      # Left open, the transaction would swallow every later write
+      if transaction is not None:
+        self.i2c.abandon(transaction)
+      raise
+    if transaction is not None:
+      self.i2c.commit(transaction)
+
+  def _writeRuns(self, channels, force, transaction):
+    "Writes the channels that changed, one burst per contiguous run"
+    run_start = None
+    run_data = []
+    for channel in sorted(channels):
+      on, off = channels[channel]
+      if not force and self._isCached(channel, on, off):
+        self.cacheHits += 1
+        continue
+      self.cacheMisses += 1
+      # Start a new burst on a gap, or when the SMBus 32 byte block limit is hit
+      if (run_start is None or
+          channel != run_start + len(run_data) // 4 or
+          len(run_data) >= self.MAX_BURST_CHANNELS * 4):
+        if run_data:
+          self._writeRun(run_start, run_data, transaction)
+        run_start = channel
+        run_data = []
+      run_data.extend([on & 0xFF, on >> 8, off & 0xFF, off >> 8])
+    if run_data:
+      self._writeRun(run_start, run_data, transaction)
+
+  def _isCached(self, channel, on, off):
+    "True if the shadow copy already holds on, and off to within the channel deadband"
+    reg = self.__LED0_ON_L+4*channel
+    shadow = self.shadow
+    if shadow[reg] != (on & 0xFF) or shadow[reg+1] != (on >> 8):
+      return False
+    if shadow[reg+2] is None or shadow[reg+3] is None:
+      return False
+    last_off = shadow[reg+2] | (shadow[reg+3] << 8)
+    return abs(off - last_off) <= self.deadband[channel]
+
+  def _writeRun(self, start, data, transaction=None):
+    "Burst writes the LEDn registers of contiguous channels from start"
+    reg = self.__LED0_ON_L+4*start
+    length = len(data)
+    if transaction is not None:
+      # Sent later, the shadow is cleared again if the commit fails
+      transaction.write(self.address, reg, data, lambda: self._forget(reg, length))
+    elif self.i2c.writeList(reg, data) == -1:
+      data = [None] * length                  # board state now unknown
+    self.shadow[reg:reg+length] = data
+
+  def invalidateChannels(self, channels):
+    "Marks channels as unknown in the shadow copy, e.g. after another handle wrote them, so the next update is sent"
+    for channel in channels:
+      self._forget(self.__LED0_ON_L+4*channel, 4)
+
+  def _forget(self, reg, length):
+    "Marks registers as unknown in the shadow copy"
+    self.shadow[reg:reg+length] = [None] * length
 
   def setAllPWM(self, on, off):
     "Sets a all PWM channels"
-    self.i2c.write8(self.__ALL_LED_ON_L, on & 0xFF)
-    self.i2c.write8(self.__ALL_LED_ON_H, on >> 8)
-    self.i2c.write8(self.__ALL_LED_OFF_L, off & 0xFF)
-    self.i2c.write8(self.__ALL_LED_OFF_H, off >> 8)
+    if all(self._isCached(channel, on, off) for channel in range(16)):
+      self.cacheHits += 1
+      return
+    self.cacheMisses += 1
+    # Single register writes, this also runs before auto-increment is enabled
+    data = [on & 0xFF, on >> 8, off & 0xFF, off >> 8]
+    for offset, value in enumerate(data):
+      if self.i2c.write8(self.__ALL_LED_ON_L+offset, value) == -1:
+        data[offset] = None
+    for channel in range(16):
+      reg = self.__LED0_ON_L+4*channel
+      self.shadow[reg:reg+4] = data
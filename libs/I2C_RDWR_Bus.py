@@ -0,0 +1,270 @@
+#!/usr/bin/python
+import ctypes
+import os
+import threading
+from Adafruit_I2C import I2CBus
+try:
+  import fcntl
+except ImportError:
+  # Not on Linux, an ioctl function must be passed in
+  fcntl = None
+
+# ===========================================================================
+# linux/i2c.h and linux/i2c-dev.h
+# ===========================================================================
+
+I2C_RDWR               = 0x0707
+I2C_M_RD               = 0x0001
+# The kernel refuses an I2C_RDWR call carrying more messages than this
+I2C_RDRW_IOCTL_MAX_MSGS = 42
+
+class i2c_msg(ctypes.Structure):
+  _fields_ = [
+    ('addr', ctypes.c_uint16),
+    ('flags', ctypes.c_uint16),
+    ('len', ctypes.c_uint16),
+    ('buf', ctypes.POINTER(ctypes.c_uint8)),
+  ]
+
+class i2c_rdwr_ioctl_data(ctypes.Structure):
+  _fields_ = [
+    ('msgs', ctypes.POINTER(i2c_msg)),
+    ('nmsgs', ctypes.c_uint32),
+  ]
+
+# ===========================================================================
+# Transaction Class
+# ===========================================================================
+
+class Transaction(object):
+  """Messages queued for one I2C_RDWR call, possibly to several devices.
+
+  Transactions opened while another is open on the same bus, in the same
+  thread, join it, so the outermost commit() sends everything, e.g. every
+  board's update for a tick. Plain bus writes made by that thread while
+  one is open are queued too. Every transaction() must be matched by a
+  commit() or, if an exception gets in the way, an abandon()."""
+
+  def __init__(self, bus):
+    self.bus = bus
+    self.messages = []
+    self.onError = []
+    self.depth = 1
+
+  def __len__(self):
+    return len(self.messages)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, exc, tb):
+    if excType is None:
+      self.commit()
+    else:
+      self.abandon()
+
+  def write(self, addr, reg, data, onError=None):
+    "Queues a write of data from register reg, onError is called if it is never sent"
+    self.messages.append((addr, 0, [reg] + list(data)))
+    if onError is not None:
+      self.onError.append(onError)
+
+  def writeRaw(self, addr, data):
+    "Queues a write of data with no register byte"
+    self.messages.append((addr, 0, list(data)))
+
+  def read(self, addr, reg, length):
+    "Queues a read of length bytes from reg, its result comes back from commit()"
+    self.messages.append((addr, 0, [reg]))
+    self.messages.append((addr, I2C_M_RD, length))
+
+  def send(self):
+    "Sends the messages queued so far, leaving the transaction open"
+    messages, self.messages = self.messages, []
+    onError, self.onError = self.onError, []
+    if not messages:
+      return []
+    try:
+      return self.bus.transfer(messages)
+    except IOError:
+      for callback in onError:
+        callback()
+      raise
+
+  def commit(self):
+    "Closes the transaction, sending everything queued once the outermost closes"
+    self.depth -= 1
+    if self.depth > 0:
+      return []
+    self._close()
+    return self.send()
+
+  def abandon(self):
+    "Closes the transaction without committing, the outermost drops everything queued"
+    # An inner abandon leaves what it queued to the outer commit, the
+    # writes themselves are still good
+    self.depth -= 1
+    if self.depth > 0:
+      return
+    self._close()
+    onError = self.onError
+    self.messages = []
+    self.onError = []
+    for callback in onError:
+      callback()
+
+  def _close(self):
+    if self.bus.open is self:
+      self.bus.open = None
+
+# ===========================================================================
+# I2C_RDWR Bus Backend
+# ===========================================================================
+
+class I2CRdwrBus(I2CBus):
+  """I2CBus backend on /dev/i2c-N using I2C_RDWR ioctls.
+
+  python-smbus makes one ioctl per SMBus command. Here a Transaction can
+  carry any number of register bursts, to any number of devices, in one
+  ioctl. ioctl can be replaced, e.g. by a SimulatedIoctl with path set
+  to an ordinary file, to run without I2C hardware."""
+
+  MAX_MESSAGES         = I2C_RDRW_IOCTL_MAX_MSGS
+  # A forked process inherits the open file descriptor
+  sharedAcrossProcesses = True
+
+  def __init__(self, busnum=1, path=None, ioctl=None):
+    self.path = path if path is not None else '/dev/i2c-%d' % busnum
+    if ioctl is None:
+      if fcntl is None:
+        raise ImportError("fcntl is not available, pass an ioctl function")
+      ioctl = fcntl.ioctl
+    self.ioctl = ioctl
+    self.fd = os.open(self.path, os.O_RDWR)
+    # Each thread's outermost open transaction, see open
+    self._local = threading.local()
+    self.syscalls = 0
+    self.messages = 0
+
+  @property
+  def open(self):
+    "The calling thread's outermost open transaction, if any"
+    return getattr(self._local, 'transaction', None)
+
+  @open.setter
+  def open(self, transaction):
+    self._local.transaction = transaction
+
+  def transaction(self):
+    "Opens a transaction, or joins the one already open"
+    transaction = self.open
+    if transaction is not None:
+      transaction.depth += 1
+      return transaction
+    transaction = self.open = Transaction(self)
+    return transaction
+
+  def transfer(self, messages):
+    "Sends (addr, flags, data or read length) messages, returning the data of each read"
+    results = []
+    for start in range(0, len(messages), self.MAX_MESSAGES):
+      chunk = messages[start:start+self.MAX_MESSAGES]
+      msgs = (i2c_msg * len(chunk))()
+      buffers = []
+      for msg, (addr, flags, data) in zip(msgs, chunk):
+        if flags & I2C_M_RD:
+          buf = (ctypes.c_uint8 * data)()
+        else:
+          buf = (ctypes.c_uint8 * len(data))(*data)
+        buffers.append(buf)
+        msg.addr = addr
+        msg.flags = flags
+        msg.len = len(buf)
+        msg.buf = ctypes.cast(buf, ctypes.POINTER(ctypes.c_uint8))
+      self.syscalls += 1
+      self.messages += len(chunk)
+      self.ioctl(self.fd, I2C_RDWR, i2c_rdwr_ioctl_data(msgs, len(chunk)))
+      for (addr, flags, data), buf in zip(chunk, buffers):
+        if flags & I2C_M_RD:
+          results.append(list(buf))
+    return results
+
+  def _write(self, addr, data):
+    transaction = self.open
+    if transaction is not None:
+      transaction.writeRaw(addr, data)
+    else:
+      self.transfer([(addr, 0, data)])
+
+  def _read(self, addr, reg, length):
+    # Anything queued goes first, so the read sees it
+    transaction = self.open
+    if transaction is not None:
+      transaction.send()
+    return self.transfer([(addr, 0, [reg]), (addr, I2C_M_RD, length)])[0]
+
+  def write_byte(self, addr, value):
+    self._write(addr, [value])
+
+  def write_byte_data(self, addr, reg, value):
+    self._write(addr, [reg, value])
+
+  def write_word_data(self, addr, reg, value):
+    self._write(addr, [reg, value & 0xFF, value >> 8])
+
+  def write_i2c_block_data(self, addr, reg, data):
+    self._write(addr, [reg] + list(data))
+
+  def read_byte_data(self, addr, reg):
+    return self._read(addr, reg, 1)[0]
+
+  def read_word_data(self, addr, reg):
+    low, high = self._read(addr, reg, 2)
+    return low | high << 8
+
+  def read_i2c_block_data(self, addr, reg, length):
+    return self._read(addr, reg, length)
+
+  def stats(self):
+    return {'syscalls': self.syscalls, 'messages': self.messages}
+
+  def close(self):
+    os.close(self.fd)
+
+# ===========================================================================
+# Simulated ioctl
+# ===========================================================================
+
+class SimulatedIoctl(object):
+  """Stands in for fcntl.ioctl, carrying out I2C_RDWR calls on the devices
+  of a SimulatedBus, whose counters see one transaction per message"""
+
+  def __init__(self, bus):
+    self.bus = bus
+    self.calls = 0
+
+  def __call__(self, fd, request, arg):
+    if request != I2C_RDWR:
+      raise IOError(25, "Inappropriate ioctl for device")
+    self.calls += 1
+    for i in range(arg.nmsgs):
+      msg = arg.msgs[i]
+      if msg.flags & I2C_M_RD:
+        device = self.bus._targets(msg.addr)[0]
+        self.bus._transaction(0, msg.len)
+        data = device.read(device.pointer, msg.len)
+        for j, value in enumerate(data):
+          msg.buf[j] = value
+        continue
+      data = msg.buf[:msg.len]
+      if len(data) == 1:
+        # Covers the general call reset as well as pointer writes
+        self.bus.write_byte(msg.addr, data[0])
+        continue
+      targets = self.bus._targets(msg.addr)
+      # Unlike SMBus block writes, a message has no 32 byte limit
+      self.bus._transaction(msg.len)
+      for device in targets:
+        device.pointer = data[0]
+        device.write(data[0], data[1:])
+    return 0
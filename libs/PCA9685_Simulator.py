@@ -0,0 +1,210 @@
+#!/usr/bin/python
+import time
+from Adafruit_I2C import I2CBus
+
+# ===========================================================================
+# Simulated PCA9685 16-Channel PWM Servo Driver
+# ===========================================================================
+
+class SimulatedPCA9685(object):
+  "Register level model of a PCA9685, for driving PWM code without hardware"
+
+  # Registers/etc.
+  MODE1                = 0x00
+  MODE2                = 0x01
+  LED0_ON_L            = 0x06
+  LED15_OFF_H          = 0x45
+  ALL_LED_ON_L         = 0xFA
+  ALL_LED_OFF_H        = 0xFD
+  PRESCALE             = 0xFE
+
+  # Bits
+  RESTART              = 0x80
+  AI                   = 0x20
+  SLEEP                = 0x10
+  ALLCALL              = 0x01
+  FULL                 = 0x10         # full on/off bit in LEDn_ON_H/OFF_H
+
+  def __init__(self, oscFreq=25000000.0):
+    self.oscFreq = oscFreq
+    self.restarts = 0
+    self.reset()
+
+  def reset(self):
+    "Puts the register file into its power on state"
+    self.registers = [0] * 256
+    self.registers[self.MODE1] = self.SLEEP | self.ALLCALL
+    self.registers[self.MODE2] = 0x04
+    self.registers[self.PRESCALE] = 0x1E
+    for channel in range(16):
+      # Every output starts fully off
+      self.registers[self.LED0_ON_L+4*channel+3] = self.FULL
+    self.restartPending = False
+    # Register a read with no register byte starts from
+    self.pointer = 0
+
+  def isSleeping(self):
+    return bool(self.registers[self.MODE1] & self.SLEEP)
+
+  def respondsToAllCall(self):
+    return bool(self.registers[self.MODE1] & self.ALLCALL)
+
+  def write(self, reg, data):
+    "Writes a run of bytes from reg, following MODE1 auto-increment"
+    for value in data:
+      self.writeRegister(reg, value)
+      if self.registers[self.MODE1] & self.AI:
+        reg = (reg + 1) & 0xFF
+
+  def read(self, reg, length):
+    "Reads a run of bytes from reg, following MODE1 auto-increment"
+    data = []
+    for i in range(length):
+      data.append(self.readRegister(reg))
+      if self.registers[self.MODE1] & self.AI:
+        reg = (reg + 1) & 0xFF
+    return data
+
+  def writeRegister(self, reg, value):
+    value &= 0xFF
+    if reg == self.MODE1:
+      self._writeMode1(value)
+    elif reg == self.PRESCALE:
+      # The prescaler only accepts writes while the oscillator is asleep
+      if self.isSleeping():
+        self.registers[reg] = max(value, 3)
+    elif self.ALL_LED_ON_L <= reg <= self.ALL_LED_OFF_H:
+      offset = reg - self.ALL_LED_ON_L
+      for channel in range(16):
+        self.registers[self.LED0_ON_L+4*channel+offset] = value
+    elif reg <= self.LED15_OFF_H:
+      self.registers[reg] = value
+    # Writes to reserved registers are ignored
+
+  def readRegister(self, reg):
+    if reg == self.MODE1:
+      return self.registers[reg] | (self.RESTART if self.restartPending else 0)
+    if self.ALL_LED_ON_L <= reg <= self.ALL_LED_OFF_H:
+      return 0                              # ALL_LED registers read back as zero
+    return self.registers[reg]
+
+  def _writeMode1(self, value):
+    wasSleeping = self.isSleeping()
+    if value & self.RESTART:
+      # Writing RESTART resumes the outputs stopped by a previous SLEEP
+      if self.restartPending and not value & self.SLEEP:
+        self.restartPending = False
+        self.restarts += 1
+    elif value & self.SLEEP and not wasSleeping:
+      self.restartPending = True
+    self.registers[self.MODE1] = value & ~self.RESTART
+
+  def frequency(self):
+    "Output frequency in Hz set by the oscillator and prescaler"
+    return self.oscFreq / (4096.0 * (self.registers[self.PRESCALE] + 1))
+
+  def getChannel(self, channel):
+    "Returns the (on, off) counts of a channel, including the full on/off bits"
+    reg = self.LED0_ON_L+4*channel
+    r = self.registers
+    return (r[reg] | r[reg+1] << 8, r[reg+2] | r[reg+3] << 8)
+
+  def getDutyTicks(self, channel):
+    "Number of high ticks per 4096 tick period on a channel"
+    on, off = self.getChannel(channel)
+    if off & (self.FULL << 8):
+      return 0
+    if on & (self.FULL << 8):
+      return 4096
+    return (off - on) % 4096
+
+  def getPulseWidth(self, channel):
+    "Output pulse width of a channel in microseconds"
+    if self.isSleeping():
+      return 0.0
+    return self.getDutyTicks(channel) * 1000000.0 / (self.frequency() * 4096.0)
+
+# ===========================================================================
+# Simulated I2C Bus
+# ===========================================================================
+
+class SimulatedBus(I2CBus):
+  "I2CBus backend routing transactions to simulated devices, with traffic counters"
+
+  GENERAL_CALL         = 0x00
+  ALLCALL_ADDRESS      = 0x70
+  SWRST                = 0x06
+
+  def __init__(self, latency=0.0):
+    # Seconds added to every transaction, to model bus speed
+    self.latency = latency
+    self.devices = {}
+    self.resetCounters()
+
+  def resetCounters(self):
+    self.transactions = 0
+    self.bytesWritten = 0
+    self.bytesRead = 0
+
+  def attach(self, address, device=None):
+    "Adds a device at address, a new SimulatedPCA9685 if none given"
+    if device is None:
+      device = SimulatedPCA9685()
+    self.devices[address] = device
+    return device
+
+  def _targets(self, addr):
+    if addr in self.devices:
+      return [self.devices[addr]]
+    if addr == self.ALLCALL_ADDRESS:
+      targets = [d for d in self.devices.values() if d.respondsToAllCall()]
+      if targets:
+        return targets
+    raise IOError(121, "Remote I/O error (no device at 0x%02X)" % addr)
+
+  def _transaction(self, written, read=0):
+    self.transactions += 1
+    # The address byte is sent in every transaction
+    self.bytesWritten += written + 1
+    self.bytesRead += read
+    if self.latency:
+      time.sleep(self.latency)
+
+  def write_byte(self, addr, value):
+    if addr == self.GENERAL_CALL:
+      self._transaction(1)
+      if value == self.SWRST:
+        for device in self.devices.values():
+          device.reset()
+      return
+    targets = self._targets(addr)
+    self._transaction(1)
+    for device in targets:
+      # A lone byte just sets the register pointer
+      device.pointer = value
+
+  def write_byte_data(self, addr, reg, value):
+    self.write_i2c_block_data(addr, reg, [value])
+
+  def write_word_data(self, addr, reg, value):
+    self.write_i2c_block_data(addr, reg, [value & 0xFF, value >> 8])
+
+  def write_i2c_block_data(self, addr, reg, data):
+    if len(data) > 32:
+      raise ValueError("SMBus block writes are limited to 32 bytes")
+    targets = self._targets(addr)
+    self._transaction(1 + len(data))
+    for device in targets:
+      device.write(reg, data)
+
+  def read_byte_data(self, addr, reg):
+    return self.read_i2c_block_data(addr, reg, 1)[0]
+
+  def read_word_data(self, addr, reg):
+    low, high = self.read_i2c_block_data(addr, reg, 2)
+    return low | high << 8
+
+  def read_i2c_block_data(self, addr, reg, length):
+    device = self._targets(addr)[0]
+    self._transaction(1, length)
+    return device.read(reg, length)
@@ -0,0 +1,40 @@
+"""Precomputed lookup tables for the control path.
+
+The nunchuk stick and accelerometer report 8 bit readings, so every
+possible raw value can be mapped once up front rather than calling
+numpy on single scalars every control tick."""
+from __future__ import division
+
+# Nunchuk readings are single bytes
+RAW_SIZE = 256
+
+
+def clip(value, low, high):
+    """Scalar clip without the numpy round trip"""
+    return low if value < low else high if value > high else value
+
+
+def build_clip_table(value_range, size=RAW_SIZE):
+    """Return a list mapping each raw reading to itself clipped
+    to value_range"""
+    low, high = value_range
+    return [clip(raw, low, high) for raw in range(size)]
+
+
+def build_normalise_table(value_range, size=RAW_SIZE):
+    """Return a list mapping each raw reading to the range -1 to 1,
+    where value_range gives the raw readings at -1 and 1. Readings
+    outside the range are clipped, matching numpy.interp"""
+    low, high = value_range
+    span = high - low
+    return [
+        2 * (clip(raw, low, high) - low) / span - 1
+        for raw in range(size)
+    ]
+
+
+def build_tick_table(pwm_freq, max_pulse, steps=4096):
+    """Return a list mapping each whole pulse length in microseconds,
+    up to max_pulse, to the 12 bit PWM off count at pwm_freq"""
+    us_per_tick = 1000000 / pwm_freq / steps
+    return [int(pulse / us_per_tick) for pulse in range(int(max_pulse) + 1)]
@@ -0,0 +1,242 @@
+"""Lightweight hot path metrics for the control loop.
+
+Each phase of a tick is timed into a fixed size ring buffer, so the
+cost per sample is two clock reads and a list store, and percentiles
+are only worked out when the stats are asked for. Stats can be read
+while running from a UNIX socket, or logged on SIGUSR1:
+
+    python metrics.py /tmp/pinoon-metrics.sock
+    kill -USR1 <pid>
+"""
+from __future__ import division
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+
+from libs.Adafruit_I2C import Adafruit_I2C, I2CBus
+from scheduler import monotonic
+
+DEFAULT_SOCKET = '/tmp/pinoon-metrics.sock'
+
+
+class RingBuffer(object):
+    """The last size samples of a phase, with running count and max"""
+    def __init__(self, size=1024):
+        self.size = size
+        self.samples = [0.0] * size
+        self.index = 0
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, value):
+        self.samples[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def percentiles(self):
+        """p50/p95/p99/max of the samples held, max is over all time"""
+        held = sorted(self.samples[:min(self.count, self.size)])
+        if not held:
+            return dict(count=0, p50=None, p95=None, p99=None,
+                        recent_max=None, max=None)
+
+        def percentile(fraction):
+            return held[int(round(fraction * (len(held) - 1)))]
+
+        return dict(
+            count=self.count,
+            p50=percentile(0.50),
+            p95=percentile(0.95),
+            p99=percentile(0.99),
+            recent_max=held[-1],
+            max=self.max,
+        )
+
+
+class Metrics(object):
+    """Phase timings, counters and stats sources for one process"""
+    def __init__(self, size=1024):
+        self.size = size
+        self.phases = {}
+        self.counters = {}
+        # name -> function returning a dict, e.g. scheduler.stats
+        self.sources = {}
+        self.started = monotonic()
+
+    def phase(self, name):
+        """The ring buffer for a phase, created on first use. Look it up
+        once outside the loop and call its add() in the loop"""
+        buffer = self.phases.get(name)
+        if buffer is None:
+            buffer = self.phases[name] = RingBuffer(self.size)
+        return buffer
+
+    def add(self, name, seconds):
+        self.phase(name).add(seconds)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_source(self, name, stats):
+        self.sources[name] = stats
+
+    def stats(self):
+        """Everything as a dict of plain values, ready for json"""
+        stats = dict(
+            uptime=monotonic() - self.started,
+            phases=dict(
+                (name, buffer.percentiles())
+                for name, buffer in list(self.phases.items())
+            ),
+            counters=dict(self.counters),
+            i2c_errors=dict(
+                ("0x{0:02x}".format(address), errors)
+                for address, errors in Adafruit_I2C.errorCounts.items()
+            ),
+        )
+        for name, source in list(self.sources.items()):
+            try:
+                stats[name] = source()
+            except Exception as e:
+                stats[name] = "unavailable: {0}".format(e)
+        return stats
+
+    def dump(self):
+        return json.dumps(self.stats(), sort_keys=True, default=str)
+
+
+class TimedBus(I2CBus):
+    """Wraps an I2C bus, timing every transaction into a metrics phase"""
+    def __init__(self, bus, metrics, name='i2c'):
+        self.bus = bus
+        self.transactions = metrics.phase(name)
+
+    def __getattr__(self, name):
+        # Anything beyond the I2CBus interface, e.g. transaction(), is
+        # the wrapped bus'. Combined transactions are not timed.
+        if name == 'bus':
+            raise AttributeError(name)
+        return getattr(self.bus, name)
+
+    def _timed(self, method, *args):
+        start = monotonic()
+        try:
+            return method(*args)
+        finally:
+            self.transactions.add(monotonic() - start)
+
+    def write_byte(self, addr, value):
+        return self._timed(self.bus.write_byte, addr, value)
+
+    def write_byte_data(self, addr, reg, value):
+        return self._timed(self.bus.write_byte_data, addr, reg, value)
+
+    def write_word_data(self, addr, reg, value):
+        return self._timed(self.bus.write_word_data, addr, reg, value)
+
+    def write_i2c_block_data(self, addr, reg, data):
+        return self._timed(self.bus.write_i2c_block_data, addr, reg, data)
+
+    def read_byte_data(self, addr, reg):
+        return self._timed(self.bus.read_byte_data, addr, reg)
+
+    def read_word_data(self, addr, reg):
+        return self._timed(self.bus.read_word_data, addr, reg)
+
+    def read_i2c_block_data(self, addr, reg, length):
+        return self._timed(self.bus.read_i2c_block_data, addr, reg, length)
+
+
+def time_pwm(pwm, metrics, name='i2c'):
+    """Time the I2C transactions of an already set up PWM board"""
+    if not isinstance(pwm.i2c.bus, TimedBus):
+        pwm.i2c.bus = TimedBus(pwm.i2c.bus, metrics, name)
+
+
+class MetricsServer(object):
+    """Answers every connection to a UNIX socket with the stats as json"""
+    def __init__(self, metrics, path=DEFAULT_SOCKET):
+        self.metrics = metrics
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(path)
+        self.sock.listen(1)
+        self.killed = False
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        while not self.killed:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                break
+            try:
+                conn.sendall(self.metrics.dump().encode('utf-8') + b'\n')
+            except socket.error:
+                pass
+            finally:
+                conn.close()
+
+    def close(self):
+        self.killed = True
+        self.sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def dump_on_signal(metrics, signum=signal.SIGUSR1):
+    """Log the stats whenever the process gets the signal, this must be
+    called from the main thread.
+
+    The handler runs in the main thread between bytecodes, wherever that
+    thread is, possibly inside the logging lock or partway through
+    updating a counter. So it only sets an event, and a background thread
+    builds the stats and logs them. Returns the event, setting it asks
+    for a dump too"""
+    requested = threading.Event()
+
+    def dump():
+        while True:
+            requested.wait()
+            requested.clear()
+            logging.warning("Metrics: {0}".format(metrics.dump()))
+
+    thread = threading.Thread(target=dump, name='metrics-dump')
+    thread.daemon = True
+    thread.start()
+
+    def handler(signum, frame):
+        requested.set()
+    signal.signal(signum, handler)
+    return requested
+
+
+def query(path=DEFAULT_SOCKET):
+    """Read the stats from a running MetricsServer"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    sock.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+if __name__ == '__main__':
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_SOCKET
+    print(json.dumps(query(path), indent=2, sort_keys=True))
@@ -0,0 +1,283 @@
+"""Vectorised 2D physics for tuning the drivetrain without the robot.
+
+DriveSimulator steps any number of robots with the same wheel layout at
+once, each with its own state and, if wanted, its own parameters, so a
+sweep over thousands of parameter sets is a handful of numpy operations
+per step.
+
+Per wheel, the ESC turns the servo pulse into a target wheel speed,
+with a deadband around neutral, and follows it with a first order lag.
+The motor pushes the robot along the wheel's drive direction in
+proportion to the difference between wheel and ground speed, up to a
+force limit. The wheel forces move a rigid body with linear and
+rotational drag, plus sideways grip for wheels that cannot slide.
+
+Coordinates follow kinematics.py, x to the right and y forward, with
+headings and rotation clockwise. Body velocities are held as (forward,
+right, clockwise) to line up with the (throttle, strafe, rotate) rows
+of the kinematics matrices. Units are metres, seconds and kilograms.
+
+To run the real DriveTrain code against it, give the DriveTrain a
+SimulatedBus and step a BoardLink, which reads the pulses back out of
+each SimulatedPCA9685. omni() takes its wheels from the DriveTrain's
+own mixer, so throttle drives the model forward, strafe sideways and
+rotate turns it:
+
+    bus = SimulatedBus()
+    board = bus.attach(0x40)
+    drive = DriveTrain(bus=bus)
+    drive.enable_drive()
+    simulator = omni(layout=drive.omni)
+    link = BoardLink(simulator, [board],
+                     [drive.channels[name] for name in simulator.channels])
+    drive.mix_channels_omni_and_assign(1.0, 0.0, 0.0)
+    link.step(0.02)
+"""
+from __future__ import division, print_function
+
+import numpy
+
+from drivetrain import OMNI_MATRIX
+from kinematics import Kinematics, differential_wheels, kiwi_wheels
+
+# Matches the DriveTrain defaults
+SERVO_MIN = 900
+SERVO_MID = 1650
+SERVO_MAX = 2300
+
+
+class Params(object):
+    """Robot and ESC parameters. Each may be a scalar, shared by every
+    robot, or a sequence with one value per robot"""
+    def __init__(
+        self,
+        mass=0.8,
+        inertia=0.004,
+        max_speed=1.5,
+        esc_time_constant=0.08,
+        esc_deadband=0.04,
+        traction=25.0,
+        max_force=6.0,
+        drag=0.5,
+        rotational_drag=1.0,
+        lateral_grip=0.0
+    ):
+        # Top wheel surface speed at full command, m/s
+        self.max_speed = max_speed
+        # Seconds for the ESC output to get 63% of the way to a new command
+        self.esc_time_constant = esc_time_constant
+        # Commands closer than this to neutral give no output, -1 to 1 scale
+        self.esc_deadband = esc_deadband
+        # Wheel force per m/s of wheel slip, N/(m/s), up to max_force N
+        self.traction = traction
+        self.max_force = max_force
+        self.mass = mass
+        self.inertia = inertia
+        # Velocity decay rates, 1/s
+        self.drag = drag
+        self.rotational_drag = rotational_drag
+        # Decay rate of sideways velocity, high for wheels that cannot
+        # slide sideways such as a skid steer's
+        self.lateral_grip = lateral_grip
+
+    def arrays(self, count):
+        """Every parameter as a float array of shape (count,)"""
+        return dict(
+            (name, numpy.broadcast_to(
+                numpy.asarray(value, dtype=float), (count,)).copy())
+            for name, value in vars(self).items()
+        )
+
+
+class MixerWheel(object):
+    """A wheel known only by its row of a mixing matrix, its output for
+    unit (throttle, strafe, rotate), rather than by its geometry. The
+    rotate term is scaled by radius, the lever arm it acts through"""
+    __slots__ = ('channel', 'coefficients')
+
+    def __init__(self, channel, coefficients, radius):
+        self.channel = channel
+        throttle, strafe, rotate = coefficients
+        self.coefficients = [throttle, strafe, rotate * radius]
+
+    def row(self):
+        return list(self.coefficients)
+
+
+class DriveSimulator(object):
+    """count robots of one wheel layout, stepped together"""
+    def __init__(self, wheels, count=1, params=None):
+        self.wheels = list(wheels)
+        self.channels = [wheel.channel for wheel in self.wheels]
+        self.count = count
+        # Wheel drive speed per unit (forward, right, clockwise) body
+        # velocity, and the body force and torque per unit wheel force
+        self.jacobian = numpy.array([wheel.row() for wheel in self.wheels])
+        for name, value in (params or Params()).arrays(count).items():
+            setattr(self, name, value)
+        self.reset()
+
+    def reset(self):
+        count = self.count
+        # World x, y and clockwise heading from +y, radians
+        self.pose = numpy.zeros((count, 3))
+        # Body frame (forward, right, clockwise) velocity
+        self.velocity = numpy.zeros((count, 3))
+        # Wheel speed the ESC is currently driving each motor at
+        self.wheel_speed = numpy.zeros((count, len(self.wheels)))
+        self.time = 0.0
+
+    def commands_from_pulses(
+        self,
+        pulses,
+        servo_min=SERVO_MIN,
+        servo_mid=SERVO_MID,
+        servo_max=SERVO_MAX
+    ):
+        """ESC commands in the range -1 to 1 from pulse widths in
+        microseconds, as DriveTrain maps them. A pulse of 0, such as a
+        sleeping board, is taken as no signal and gives neutral"""
+        pulses = numpy.asarray(pulses, dtype=float)
+        offset = pulses - servo_mid
+        commands = numpy.where(
+            offset > 0,
+            offset / (servo_max - servo_mid),
+            offset / (servo_mid - servo_min),
+        )
+        commands[pulses <= 0] = 0.0
+        return numpy.clip(commands, -1.0, 1.0)
+
+    def step(self, commands, dt):
+        """Advance every robot by dt seconds under an array of ESC
+        commands of shape (count, wheels), or (wheels,) for all robots"""
+        commands = numpy.broadcast_to(
+            numpy.asarray(commands, dtype=float), self.wheel_speed.shape)
+        commands = numpy.clip(commands, -1.0, 1.0)
+        deadband = self.esc_deadband[:, None]
+        commands = numpy.where(numpy.abs(commands) <= deadband, 0.0, commands)
+
+        # ESC response, an exact first order lag over the step
+        target = commands * self.max_speed[:, None]
+        follow = 1.0 - numpy.exp(-dt / self.esc_time_constant)[:, None]
+        self.wheel_speed += (target - self.wheel_speed) * follow
+
+        # Motor force from wheel slip against the ground, saturating
+        ground = numpy.dot(self.velocity, self.jacobian.T)
+        limit = self.max_force[:, None]
+        force = numpy.clip(
+            self.traction[:, None] * (self.wheel_speed - ground), -limit, limit)
+
+        # Rigid body, semi-implicit Euler with exact drag decay
+        generalised = numpy.dot(force, self.jacobian)
+        velocity = self.velocity
+        velocity[:, 0:2] += generalised[:, 0:2] / self.mass[:, None] * dt
+        velocity[:, 2] += generalised[:, 2] / self.inertia * dt
+        velocity[:, 0] *= numpy.exp(-self.drag * dt)
+        velocity[:, 1] *= numpy.exp(-(self.drag + self.lateral_grip) * dt)
+        velocity[:, 2] *= numpy.exp(-self.rotational_drag * dt)
+
+        heading = self.pose[:, 2]
+        sin, cos = numpy.sin(heading), numpy.cos(heading)
+        forward, right = velocity[:, 0], velocity[:, 1]
+        self.pose[:, 0] += (forward * sin + right * cos) * dt
+        self.pose[:, 1] += (forward * cos - right * sin) * dt
+        self.pose[:, 2] += velocity[:, 2] * dt
+        self.time += dt
+
+    def step_pulses(self, pulses, dt, **servo_range):
+        """step() from pulse widths in microseconds"""
+        self.step(self.commands_from_pulses(pulses, **servo_range), dt)
+
+    def run(self, commands, dt, steps):
+        """Step the same commands several times, returns the poses"""
+        for _ in range(steps):
+            self.step(commands, dt)
+        return self.pose
+
+
+def differential(track_width=0.15, count=1, params=None, **kwargs):
+    """A two wheel skid steer, which cannot slide sideways"""
+    if params is None:
+        params = Params(lateral_grip=50.0)
+    return DriveSimulator(
+        differential_wheels(track_width, **kwargs), count, params)
+
+
+def omni(radius=0.08, count=1, params=None, layout=None):
+    """The three wheel omni as the DriveTrain mixes for it, with the
+    wheels taken from layout, by default OMNI_MATRIX, so the channel
+    order (left, right, front) and the motor polarities are the
+    mixer's. Whatever the matrix, throttle then drives the model
+    straight forward, strafe sideways and rotate turns it clockwise"""
+    if layout is None:
+        layout = Kinematics(('left', 'right', 'front'), OMNI_MATRIX)
+    return DriveSimulator([
+        MixerWheel(channel, row, radius)
+        for channel, row in zip(layout.channels, layout.matrix.tolist())
+    ], count, params)
+
+
+def kiwi(radius=0.08, count=1, params=None,
+         channels=('front', 'right', 'left')):
+    """An ideal three wheel omni with wheels 120 degrees apart, each
+    driving clockwise, to pair with kinematics.kiwi"""
+    return DriveSimulator(kiwi_wheels(radius, channels), count, params)
+
+
+class BoardLink(object):
+    """Steps a DriveSimulator from the outputs of simulated PCA9685s,
+    one board per robot, so DriveTrain can drive the model unchanged.
+    channels gives the board channel for each of the simulator's wheels,
+    and polarity is -1 for any motor wired to drive the wheel backwards"""
+    def __init__(self, simulator, boards, channels, polarity=None,
+                 **servo_range):
+        if len(boards) != simulator.count:
+            raise ValueError("need one board per simulated robot")
+        self.simulator = simulator
+        self.boards = boards
+        self.board_channels = list(channels)
+        self.polarity = numpy.ones(len(self.board_channels))
+        if polarity is not None:
+            self.polarity[:] = polarity
+        self.servo_range = servo_range
+
+    def pulses(self):
+        return numpy.array([
+            [board.getPulseWidth(channel) for channel in self.board_channels]
+            for board in self.boards
+        ])
+
+    def step(self, dt):
+        simulator = self.simulator
+        commands = simulator.commands_from_pulses(
+            self.pulses(), **self.servo_range)
+        simulator.step(commands * self.polarity, dt)
+
+
+def main():
+    """Sweep ESC time constants over many simulated robots, timing the
+    simulation against real time"""
+    import time
+
+    count = 10000
+    dt = 0.01
+    seconds = 2.0
+    taus = numpy.linspace(0.02, 0.5, count)
+    layout = Kinematics(('left', 'right', 'front'), OMNI_MATRIX)
+    simulator = omni(
+        count=count, params=Params(esc_time_constant=taus), layout=layout)
+    # Full throttle, through the DriveTrain omni mixer
+    commands = numpy.array(layout.mix(1.0, 0.0, 0.0))
+    started = time.time()
+    simulator.run(commands, dt, int(seconds / dt))
+    elapsed = time.time() - started
+    distance = numpy.hypot(simulator.pose[:, 0], simulator.pose[:, 1])
+    print("{0} robots for {1}s in {2:.2f}s, {3:.0f}x real time".format(
+        count, seconds, elapsed, count * seconds / elapsed))
+    for index in numpy.linspace(0, count - 1, 6).astype(int):
+        print("esc tau {0:.3f}s: {1:.2f}m in {2}s".format(
+            taus[index], distance[index], seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,60 +1,181 @@
 #!/usr/bin/env python
 import logging
-import time
-import cwiid
+from scheduler import FixedRateScheduler, monotonic
+import inputs
+from inputs import InputSnapshot
+from asynclog import TRACE_INPUT
+
+
+def must_hold(snapshot):
+    """True if the outputs must be held neutral: no nunchuk (or no
+    connection), or B or Z held"""
+    return bool(
+        not snapshot.has_nunchuk or
+        (snapshot.buttons & inputs.BTN_B) or
+        (snapshot.nunchuk_buttons & inputs.NUNCHUK_BTN_Z)
+    )
 
 
 class rc:
-    def __init__(self, drive, wiimote):
+    def __init__(
+        self,
+        drive,
+        wiimote,
+        rate=50,
+        metrics=None,
+        trace=None,
+        watchdog=None
+    ):
         self.killed = False
         self.drive = drive
         self.wiimote = wiimote
+        # Control updates per second. Channel updates go to the PWM
+        # board as a single burst, so this only needs to keep pace with
+        # the servo frame rate rather than protect the board.
+        self.scheduler = FixedRateScheduler(rate)
+        # Refilled in place every tick
+        self.inputs = InputSnapshot()
+        # Optional asynclog.BinaryLog, gets the mixer inputs every tick
+        self.trace = trace
+        # Optional watchdog.Watchdog, kicked after every tick
+        self.watchdog = watchdog
+        # Optional metrics.Metrics, timing each phase of the tick
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.add_source('loop', self.scheduler.stats)
+            self._read_time = metrics.phase('read')
+            self._snapshot_time = metrics.phase('snapshot')
+            self._drive_time = metrics.phase('drive')
+            # Within drive, the stick and accelerometer normalisation,
+            # and the mixing through to the PWM write or submit
+            self._normalise_time = metrics.phase('normalise')
+            self._mix_time = metrics.phase('mix')
+            self._tick_time = metrics.phase('tick')
 
     def stop(self):
         """Simple method to stop the RC loop"""
         self.killed = True
+        self.scheduler.stop()
+
+    def running(self):
+        """True while the RC loop should keep going"""
+        return bool(self.wiimote) and not self.killed
 
     def run(self):
         """Start listening to the wiimote and drive the motors"""
-        # Initiate the drivetrain
-        while self.wiimote and not self.killed:
-            buttons_state = self.wiimote.get_buttons()
-            nunchuk_buttons_state = self.wiimote.get_nunchuk_buttons()
-            joystick_state = self.wiimote.get_joystick_state()
-            nunchuk_accel_state = self.wiimote.get_nunchuk_accel_state()
-
-            # If 'C' is pressed, go to full speed
-            if (nunchuk_buttons_state & cwiid.NUNCHUK_BTN_C):
-                self.drive.set_full_speed()
-            else:
-                self.drive.set_low_speed()
-
-            if (buttons_state & cwiid.BTN_MINUS):
-                self.drive.set_skittle_motors_on()
-
-            if (buttons_state & cwiid.BTN_PLUS):
-                self.drive.set_skittle_motors_off()
-
-            if (buttons_state & cwiid.BTN_1):
-                self.drive.set_skittle_arms_open()
-
-            if (buttons_state & cwiid.BTN_2):
-                self.drive.set_skittle_arms_closed()
-
-            # Get the normalised joystick postion as a tuple of
-            # (throttle, steering), where values are in the range -1 to 1
-            joystick_pos = joystick_state['state']['normalised']
-            nunchuck_accel = nunchuk_accel_state['state']['normalised']
-            throttle, steering = joystick_pos
-            accel_x, accel_y, accel_z = nunchuck_accel
-            logging.info("mixing channels: {0} : {1}".format(throttle, steering))
-            logging.info("accel channels: {0} : {1} : {2}".format(accel_x, accel_y, accel_z))
-            # self.drive.mix_channels_and_assign(throttle, steering)
-            self.drive.mix_channels_omni_and_assign(throttle, steering, accel_x)
-
-            time.sleep(0.05)
+        self.scheduler.run(self.tick, self.running)
+        logging.info("RC loop stats: {0}".format(self.scheduler.stats()))
         # Final thing we do leaving RC mode is to
         # set back into neutral for safety
         if self.drive:
             self.drive.set_neutral()
             self.drive.set_full_speed()
+
+    def tick(self):
+        """Read the wiimote once and update the motors"""
+        self.read_and_drive(self.drive_or_hold)
+        if self.watchdog is not None:
+            self.watchdog.kick()
+
+    def read_and_drive(self, drive):
+        """Read the wiimote once and pass the snapshot to drive, timing
+        each phase when there are metrics. The Supervisor's tick uses this
+        too, with its own drive by mode"""
+        # One input snapshot per tick, refilled in place
+        if self.metrics is None:
+            drive(self.wiimote.read_snapshot(self.inputs))
+            return
+        start = monotonic()
+        state = self.wiimote.get_state()
+        read = monotonic()
+        snapshot = self.wiimote.read_snapshot(self.inputs, state)
+        filled = monotonic()
+        drive(snapshot)
+        end = monotonic()
+        self._read_time.add(read - start)
+        self._snapshot_time.add(filled - read)
+        self._drive_time.add(end - filled)
+        self._tick_time.add(end - start)
+
+    def hold_neutral(self):
+        """Neutral and disabled, only writing on the transition"""
+        if self.drive.drive_enabled:
+            self.drive.disable_drive()
+
+    def drive_or_hold(self, snapshot):
+        """Update the motors from an InputSnapshot, or hold them neutral
+        for safety if must_hold says so"""
+        if must_hold(snapshot):
+            self.hold_neutral()
+        else:
+            self.drive.enable_drive()
+            self.drive_from(snapshot)
+
+    def _attachment(self, name):
+        """Call a drivetrain's attachment method, if it has one, only
+        some drivetrains have the skittle motors and arms"""
+        action = getattr(self.drive, name, None)
+        if action is not None:
+            action()
+
+    def drive_from(self, snapshot):
+        """Update the motors from an InputSnapshot"""
+        buttons_state = snapshot.buttons
+        nunchuk_buttons_state = snapshot.nunchuk_buttons
+
+        # If 'C' is pressed, go to full speed
+        if (nunchuk_buttons_state & inputs.NUNCHUK_BTN_C):
+            self.drive.set_full_speed()
+        else:
+            self.drive.set_low_speed()
+
+        if (buttons_state & inputs.BTN_MINUS):
+            self._attachment('set_skittle_motors_on')
+
+        if (buttons_state & inputs.BTN_PLUS):
+            self._attachment('set_skittle_motors_off')
+
+        if (buttons_state & inputs.BTN_1):
+            self._attachment('set_skittle_arms_open')
+
+        if (buttons_state & inputs.BTN_2):
+            self._attachment('set_skittle_arms_closed')
+
+        if not snapshot.has_nunchuk:
+            # No joystick to drive from, hold neutral
+            self.drive.set_neutral()
+            return
+
+        timed = self.metrics is not None
+        if timed:
+            start = monotonic()
+        # Get the normalised joystick postion as
+        # (throttle, steering), where values are in the range -1 to 1
+        throttle = snapshot.stick_axis(0)
+        steering = snapshot.stick_axis(1)
+        # Filtered over the newest reports where the input source has
+        # an accelerometer filter, see accelfilter.py
+        accel_x = snapshot.filtered_acc_axis(0)
+        accel_y = snapshot.filtered_acc_axis(1)
+        accel_z = snapshot.filtered_acc_axis(2)
+        if timed:
+            self._normalise_time.add(monotonic() - start)
+        # Formatted only if debug logging is on, and then by asynclog's
+        # background thread when it is set up
+        logging.debug("mixing channels: %s : %s", throttle, steering)
+        logging.debug("accel channels: %s : %s : %s", accel_x, accel_y, accel_z)
+        if self.trace is not None:
+            try:
+                self.trace.write(
+                    TRACE_INPUT, (throttle, steering, accel_x, accel_y, accel_z)
+                )
+            except (EnvironmentError, ValueError):
+                # Only a diagnostic, it must not stop the driving
+                logging.exception("Input trace write failed, tracing stopped")
+                self.trace = None
+        if timed:
+            start = monotonic()
+        # self.drive.mix_channels_and_assign(throttle, steering)
+        self.drive.mix_channels_omni_and_assign(throttle, steering, accel_x)
+        if timed:
+            self._mix_time.add(monotonic() - start)
@@ -0,0 +1,166 @@
+"""Opt-in real time running for the control loop.
+
+Each step is tried on its own and skipped with a warning if it is not
+possible, e.g. when not running as root or on a Python without the
+call, so the robot still runs, just with ordinary scheduling:
+
+- SCHED_FIFO for the calling thread, at a given priority
+- pinning the calling thread to a CPU
+- mlockall, so the loop never waits on a page fault
+- gc.freeze (Python 3.7+), moving everything allocated during start up
+  out of the collector's way
+- garbage collection only in the slack time between ticks, via
+  GCScheduler as the scheduler's idle hook
+
+Threads started after enable() inherit the scheduling policy and CPU
+of the thread that called it. The watchdog instead sets its own, one
+priority above the loop, so a loop spinning under SCHED_FIFO cannot
+starve the thread meant to catch it. The ActuatorWriter thread, or
+output process, is started with the DriveTrain before enable() and so
+stays under ordinary scheduling, where a busy loop can delay its bus
+writes; the watchdog still bounds how long the motors are left
+running."""
+from __future__ import division
+import ctypes
+import ctypes.util
+import gc
+import logging
+import os
+
+SCHED_FIFO = 1
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(
+            ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+def _check(result):
+    if result != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+
+
+def set_fifo(priority=50):
+    """Run the calling thread under SCHED_FIFO at priority, 1 to 99"""
+    if hasattr(os, 'sched_setscheduler'):
+        os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+        return
+    param = ctypes.c_int(priority)
+    _check(_get_libc().sched_setscheduler(
+        0, SCHED_FIFO, ctypes.byref(param)))
+
+
+def pin_cpu(cpu):
+    """Run the calling thread only on the given CPU"""
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, [cpu])
+        return
+    # cpu_set_t is a 1024 bit mask
+    mask = (ctypes.c_ulong * (1024 // (8 * ctypes.sizeof(ctypes.c_ulong))))()
+    bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+    mask[cpu // bits] = 1 << (cpu % bits)
+    _check(_get_libc().sched_setaffinity(
+        0, ctypes.sizeof(mask), ctypes.byref(mask)))
+
+
+def lock_memory():
+    """Lock all current and future pages of the process into RAM"""
+    _check(_get_libc().mlockall(MCL_CURRENT | MCL_FUTURE))
+
+
+def freeze_gc():
+    """Collect, then exclude every object that survives from later
+    collections. Needs Python 3.7+"""
+    gc.collect()
+    gc.freeze()
+
+
+class GCScheduler(object):
+    """Idle hook for FixedRateScheduler, running garbage collection only
+    when a tick has left enough slack before the next deadline, with
+    automatic collection disabled.
+
+    At high control rates the slack may rarely reach min_slack, so after
+    max_skipped ticks in a row without one the young generation is
+    collected anyway, a late tick being better than memory growing
+    without bound. for_rate() scales min_slack to the tick period"""
+    def __init__(self, min_slack=0.005, full_every=1000, max_skipped=50):
+        self.min_slack = min_slack
+        # Ticks between collections of every generation, the young
+        # generation is collected whenever it has anything in it
+        self.full_every = full_every
+        self.max_skipped = max_skipped
+        self.ticks = 0
+        self.collections = 0
+        self.skipped = 0
+        self.forced = 0
+        self._skipped_in_row = 0
+
+    @classmethod
+    def for_rate(cls, rate, **kwargs):
+        """A GCScheduler for a loop at rate Hz, needing at most a quarter
+        of the period as slack"""
+        kwargs.setdefault('min_slack', min(0.005, 0.25 / rate))
+        return cls(**kwargs)
+
+    def start(self):
+        gc.disable()
+        return self
+
+    def stop(self):
+        gc.enable()
+
+    def __call__(self, slack):
+        self.ticks += 1
+        if slack < self.min_slack:
+            self.skipped += 1
+            self._skipped_in_row += 1
+            if self._skipped_in_row >= self.max_skipped:
+                self._skipped_in_row = 0
+                gc.collect(0)
+                self.collections += 1
+                self.forced += 1
+            return
+        self._skipped_in_row = 0
+        if self.ticks % self.full_every == 0:
+            gc.collect()
+            self.collections += 1
+        elif gc.get_count()[0] > 0:
+            gc.collect(0)
+            self.collections += 1
+
+    def stats(self):
+        return dict(
+            collections=self.collections,
+            skipped=self.skipped,
+            forced=self.forced,
+        )
+
+
+def enable(priority=50, cpu=None, lock=True, freeze=True):
+    """Apply each real time setting, from the control thread. Returns
+    a dict of setting to True if applied or the reason it was not"""
+    steps = [('fifo', lambda: set_fifo(priority))]
+    if cpu is not None:
+        steps.append(('cpu', lambda: pin_cpu(cpu)))
+    if lock:
+        steps.append(('mlockall', lock_memory))
+    if freeze:
+        steps.append(('gc_freeze', freeze_gc))
+    applied = {}
+    for name, step in steps:
+        try:
+            step()
+            applied[name] = True
+        except (OSError, AttributeError) as e:
+            applied[name] = str(e)
+            logging.warning("Real time {0} not applied: {1}".format(name, e))
+    return applied
@@ -0,0 +1,134 @@
+"""Recording and replay of controller input.
+
+InputRecorder appends fixed size binary records of the raw controller
+state to a file, cheaply enough to leave running during a match.
+ReplayInput reads a recording back through the same interface as
+wiimote.Wiimote, in real time, faster or as fast as possible, so the
+whole control stack can be rerun deterministically."""
+from __future__ import division
+import struct
+import threading
+
+from inputs import InputSource
+from scheduler import monotonic
+
+MAGIC = b'PNIN\x01'
+# time, buttons, flags, nunchuk buttons, stick x/y, acc x/y/z
+RECORD = struct.Struct('<dHBBBBBBB')
+FLAG_NUNCHUK = 0x01
+
+
+class InputRecorder(object):
+    """Append only writer of timestamped controller states"""
+    def __init__(self, path, buffering=65536):
+        self.file = open(path, 'ab', buffering)
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.records = 0
+        # Records may come from the cwiid thread and the control loop
+        self._lock = threading.Lock()
+
+    def record(self, state, timestamp=None):
+        """Append a cwiid style state dict, stamped with the given time
+        or the current monotonic time"""
+        if timestamp is None:
+            timestamp = monotonic()
+        nunchuk = state.get('nunchuk')
+        if nunchuk is None:
+            record = RECORD.pack(
+                timestamp, state['buttons'], 0, 0, 0, 0, 0, 0, 0
+            )
+        else:
+            stick = nunchuk['stick']
+            acc = nunchuk['acc']
+            record = RECORD.pack(
+                timestamp, state['buttons'], FLAG_NUNCHUK,
+                nunchuk['buttons'], stick[0], stick[1],
+                acc[0], acc[1], acc[2]
+            )
+        with self._lock:
+            self.file.write(record)
+            self.records += 1
+
+    def flush(self):
+        with self._lock:
+            self.file.flush()
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+def read_recording(path):
+    """Return a list of (timestamp, state dict) from a recording"""
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("{0} is not an input recording".format(path))
+    records = []
+    # Ignore a partial record left by an interrupted run
+    end = len(data) - (len(data) - len(MAGIC)) % RECORD.size
+    for offset in range(len(MAGIC), end, RECORD.size):
+        (timestamp, buttons, flags, nunchuk_buttons,
+         stick_x, stick_y, acc_x, acc_y, acc_z) = RECORD.unpack_from(
+            data, offset
+        )
+        state = {'buttons': buttons, 'timestamp': timestamp}
+        if flags & FLAG_NUNCHUK:
+            state['nunchuk'] = {
+                'buttons': nunchuk_buttons,
+                'stick': (stick_x, stick_y),
+                'acc': (acc_x, acc_y, acc_z),
+            }
+        records.append((timestamp, state))
+    return records
+
+
+class ReplayInput(InputSource):
+    """Feeds a recording back with the same interface as Wiimote.
+
+    speed scales the recorded timing, 1 is real time and 4 is four
+    times faster. With speed None every get_state() call steps to the
+    next record, as fast as the consumer can go. The replay is false
+    once the recording has run out, which ends the RC loop."""
+    def __init__(
+        self,
+        path,
+        speed=1.0,
+        joystick_range=None,
+        acc_range=None
+    ):
+        super(ReplayInput, self).__init__(joystick_range, acc_range)
+        self.records = read_recording(path)
+        if not self.records:
+            raise ValueError("{0} holds no records".format(path))
+        self.speed = speed
+        self.led = 1
+        self.index = 0
+        self.finished = False
+        self._first = self.records[0][0]
+        self._started = None
+
+    def __bool__(self):
+        return not self.finished
+
+    __nonzero__ = __bool__
+
+    def get_state(self):
+        """The recorded state due at the current replay time"""
+        records = self.records
+        if self._started is None:
+            self._started = monotonic()
+            return records[0][1]
+        if self.speed is None:
+            self.index = min(self.index + 1, len(records) - 1)
+            # Finished once the last record has been handed out
+            self.finished = self.index == len(records) - 1
+        else:
+            due = self._first + (monotonic() - self._started) * self.speed
+            index = self.index
+            while index + 1 < len(records) and records[index + 1][0] <= due:
+                index += 1
+            self.index = index
+            self.finished = due > records[-1][0]
+        return records[self.index][1]
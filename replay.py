@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+""" Replay a recorded wiimote session through the RC loop and
+drivetrain, against a simulated PWM board, and report the cost """
+from __future__ import division, print_function
+import argparse
+import logging
+import time
+
+import drivetrain
+import rc
+from recorder import ReplayInput
+from libs.PCA9685_Simulator import SimulatedBus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('recording', help="file written by InputRecorder")
+    parser.add_argument(
+        '--speed', type=float, default=1.0,
+        help="replay speed multiplier, default real time"
+    )
+    parser.add_argument(
+        '--fast', action='store_true',
+        help="one record per control tick, as fast as possible"
+    )
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help="simulated seconds per I2C transaction"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    source = ReplayInput(args.recording, speed=None if args.fast else args.speed)
+    bus = SimulatedBus(latency=args.latency)
+    bus.attach(0x40)
+    drive = drivetrain.DriveTrain(bus=bus)
+    drive.enable_drive()
+    bus.resetCounters()
+
+    # A huge rate makes the scheduler run ticks back to back
+    controller = rc.rc(drive, source, rate=1e6 if args.fast else 50)
+    started = time.time()
+    controller.run()
+    elapsed = time.time() - started
+
+    ticks = controller.scheduler.ticks
+    print("records:       {0}".format(len(source.records)))
+    print("ticks:         {0}".format(ticks))
+    print("elapsed:       {0:.3f} s".format(elapsed))
+    print("per tick:      {0:.1f} us".format(elapsed / max(ticks, 1) * 1e6))
+    print("transactions:  {0} ({1:.2f} per tick)".format(
+        bus.transactions, bus.transactions / max(ticks, 1)))
+    print("bytes written: {0}".format(bus.bytesWritten))
+
+
+if __name__ == '__main__':
+    main()
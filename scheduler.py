@@ -0,0 +1,166 @@
+"""Fixed rate scheduling for the control loops.
+
+Ticks are timed from absolute deadlines on a monotonic clock, so the
+rate does not drift with the time spent doing each tick. A tick that
+overruns its slot skips the frames it missed rather than bursting to
+catch up."""
+from __future__ import division
+import ctypes
+import logging
+import time
+
+import realtime
+
+CLOCK_MONOTONIC = 1
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _clock_gettime_monotonic():
+    """A monotonic() for Python 2, which has none in the standard
+    library, from clock_gettime(CLOCK_MONOTONIC). The wall clock is no
+    substitute: a Pi has no RTC, so NTP or fake-hwclock step it, and a
+    deadline on it then sleeps through a backward step or overruns on
+    a forward one"""
+    clock_gettime = realtime._get_libc().clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    spec = _timespec()
+    reference = ctypes.byref(spec)
+    if clock_gettime(CLOCK_MONOTONIC, reference) != 0:
+        raise OSError(ctypes.get_errno(), "clock_gettime failed")
+
+    def monotonic():
+        clock_gettime(CLOCK_MONOTONIC, reference)
+        return spec.tv_sec + spec.tv_nsec * 1e-9
+    return monotonic
+
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+else:
+    try:
+        monotonic = _clock_gettime_monotonic()
+    except (OSError, AttributeError) as e:
+        # Not Linux, e.g. a development machine, not the robot
+        logging.warning("No monotonic clock, using time.time: {0}".format(e))
+        monotonic = time.time
+
+# Histogram bucket upper bounds, in seconds
+DEFAULT_BOUNDS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1)
+
+
+class Histogram(object):
+    """Count of samples per bucket, plus running min/max/mean"""
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = tuple(bounds)
+        # Final bucket is everything above the last bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        index = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def as_dict(self):
+        labels = ["<={0:g}ms".format(bound * 1000) for bound in self.bounds]
+        labels.append(">{0:g}ms".format(self.bounds[-1] * 1000))
+        return dict(
+            count=self.count,
+            mean=self.mean(),
+            min=self.min,
+            max=self.max,
+            buckets=list(zip(labels, self.counts)),
+        )
+
+
+class FixedRateScheduler(object):
+    """Call a function at a fixed rate in Hz, recording the loop
+    period, the jitter of each tick against its deadline and overruns"""
+    def __init__(self, rate, bounds=DEFAULT_BOUNDS):
+        self.rate = rate
+        self.period = 1 / rate
+        self.killed = False
+        self.bounds = bounds
+        # Optional idle(slack) hook, called after each tick with the
+        # seconds left before the next deadline, e.g. to collect garbage
+        self.idle = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.periods = Histogram(self.bounds)
+        self.jitter = Histogram(self.bounds)
+        self.overrun_lengths = Histogram(self.bounds)
+
+    def stop(self):
+        """Stop the loop after the current tick"""
+        self.killed = True
+
+    def run(self, tick, running=None):
+        """Call tick() once per period until stop() is called, or until
+        the optional running() returns False"""
+        deadline = monotonic()
+        last_start = None
+        while not self.killed and (running is None or running()):
+            start = monotonic()
+            # How late this tick started against its deadline
+            self.jitter.add(max(start - deadline, 0.0))
+            if last_start is not None:
+                self.periods.add(start - last_start)
+            last_start = start
+
+            tick()
+            self.ticks += 1
+
+            deadline += self.period
+            now = monotonic()
+            if now > deadline:
+                # Overran into the next slot, skip the missed frames
+                # and line up on the next deadline still in the future
+                late = now - deadline
+                missed = int(late // self.period) + 1
+                self.overruns += 1
+                self.skipped += missed
+                self.overrun_lengths.add(late)
+                deadline += missed * self.period
+            if self.idle is not None:
+                self.idle(deadline - monotonic())
+            time.sleep(max(deadline - monotonic(), 0.0))
+
+    def achieved_rate(self):
+        """Mean loop rate actually achieved, in Hz"""
+        mean = self.periods.mean()
+        return 1 / mean if mean else 0.0
+
+    def stats(self):
+        """Loop period, jitter and overrun statistics"""
+        return dict(
+            rate=self.rate,
+            achieved_rate=self.achieved_rate(),
+            ticks=self.ticks,
+            overruns=self.overruns,
+            skipped=self.skipped,
+            period=self.periods.as_dict(),
+            jitter=self.jitter.as_dict(),
+            overrun=self.overrun_lengths.as_dict(),
+        )
@@ -0,0 +1,164 @@
+"""Single owner of the robot's control loop.
+
+One loop reads the input once per tick, tracks the mode and is the only
+writer to the drivetrain. Other threads, such as the GPIO button
+callbacks, change mode by posting messages rather than starting and
+stopping threads."""
+import logging
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import inputs
+import rc
+from scheduler import FixedRateScheduler
+
+# Modes
+IDLE = 'idle'
+RC = 'rc'
+ESTOP = 'estop'
+
+# Messages
+START_RC = 'start_rc'
+STOP_RC = 'stop_rc'
+TOGGLE_RC = 'toggle_rc'
+# Latches neutral until RESET, whatever the controller does
+EMERGENCY_STOP = 'estop'
+RESET = 'reset'
+
+# Controller button latching the emergency stop from any mode, read
+# along with the rest of the input every tick
+ESTOP_BUTTON = inputs.BTN_HOME
+
+
+class Supervisor(object):
+    """Runs the control loop, owning input reading, mode and outputs"""
+    def __init__(
+        self,
+        drive,
+        wiimote,
+        rate=50,
+        on_mode_change=None,
+        on_connection_change=None,
+        metrics=None,
+        watchdog=None
+    ):
+        self.drive = drive
+        self.wiimote = wiimote
+        self.mode = IDLE
+        # Called with the new mode after every mode change
+        self.on_mode_change = on_mode_change
+        # Called with True or False when the wiimote connects or drops,
+        # input sources without a connection count as always connected
+        self.on_connection_change = on_connection_change
+        self.connected = None
+        # Ticks that raised, each one held neutral and the loop went on
+        self.errors = 0
+        self.messages = queue.Queue()
+        self.scheduler = FixedRateScheduler(rate)
+        # Optional watchdog.Watchdog, kicked after every tick
+        self.watchdog = watchdog
+        # Optional metrics.Metrics, the controller times each phase of
+        # the tick
+        self.metrics = metrics
+        # RC mode drive logic, fed from this loop's single input read
+        self.controller = rc.rc(drive, wiimote, metrics=metrics)
+        if metrics is not None:
+            # This loop's stats, not those of the controller's own loop,
+            # which never runs
+            metrics.add_source('loop', self.scheduler.stats)
+
+    def post(self, message):
+        """Queue a message for the control loop, safe from any thread"""
+        self.messages.put(message)
+
+    def _set_mode(self, mode):
+        if mode == self.mode:
+            return
+        logging.info("Mode {0} -> {1}".format(self.mode, mode))
+        if self.mode == RC:
+            # Leaving RC mode, set back into neutral for safety
+            self._hold_neutral()
+            self.drive.set_full_speed()
+        self.mode = mode
+        if self.on_mode_change is not None:
+            self.on_mode_change(mode)
+
+    def _handle(self, message):
+        if message == EMERGENCY_STOP:
+            self._set_mode(ESTOP)
+        elif self.mode == ESTOP:
+            if message == RESET:
+                self._set_mode(IDLE)
+        elif message == START_RC:
+            self._set_mode(RC)
+        elif message == STOP_RC:
+            self._set_mode(IDLE)
+        elif message == TOGGLE_RC:
+            self._set_mode(IDLE if self.mode == RC else RC)
+        elif message != RESET:
+            logging.error("Unknown supervisor message {0}".format(message))
+
+    def _hold_neutral(self):
+        self.controller.hold_neutral()
+
+    def _check_connection(self):
+        event = getattr(self.wiimote, 'connected', None)
+        connected = event is None or event.is_set()
+        if connected != self.connected:
+            self.connected = connected
+            self.on_connection_change(connected)
+
+    def tick(self):
+        try:
+            while True:
+                try:
+                    self._handle(self.messages.get_nowait())
+                except queue.Empty:
+                    break
+            if self.on_connection_change is not None:
+                self._check_connection()
+            self.controller.read_and_drive(self._drive)
+        except Exception:
+            # One bad tick must not end the loop, or the robot process
+            # with it. Logging is rate limited by asynclog.
+            self.errors += 1
+            if self.metrics is not None:
+                self.metrics.count('tick_errors')
+            logging.exception("Control loop tick failed, holding neutral")
+            self._fail_safe()
+        finally:
+            if self.watchdog is not None:
+                self.watchdog.kick()
+
+    def _fail_safe(self):
+        """Hold neutral after a failed tick. The fault may be in the
+        drive path itself, so the drive is disabled even if writing
+        neutral fails too"""
+        try:
+            self.drive.disable_drive()
+        except Exception:
+            logging.exception("Could not set neutral after a failed tick")
+        finally:
+            self.drive.drive_enabled = False
+
+    def _drive(self, snapshot):
+        if snapshot.buttons & ESTOP_BUTTON:
+            self._set_mode(ESTOP)
+        if self.mode == RC:
+            self.controller.drive_or_hold(snapshot)
+        else:
+            self._hold_neutral()
+
+    def run(self):
+        """Run the control loop until stopped, finishing in neutral"""
+        try:
+            self.scheduler.run(self.tick)
+        finally:
+            self._hold_neutral()
+            logging.info("Supervisor loop stats: {0}".format(
+                self.scheduler.stats()))
+
+    def stop(self):
+        self.scheduler.stop()
@@ -0,0 +1,21 @@
+"""Stand-in inputs shared by the tests."""
+from inputs import InputSource
+
+
+class FixedInput(InputSource):
+    """Stick pushed fully forward, with the given buttons held"""
+    def __init__(self):
+        super(FixedInput, self).__init__()
+        self.buttons = 0
+        self.nunchuk_buttons = 0
+
+    def get_state(self):
+        return {
+            'buttons': self.buttons,
+            'timestamp': None,
+            'nunchuk': {
+                'buttons': self.nunchuk_buttons,
+                'stick': (200, 125),
+                'acc': (125, 125, 150),
+            },
+        }
@@ -0,0 +1,54 @@
+"""The output process writes with the drivetrain's settings, to a bus
+it can reach."""
+import time
+import unittest
+
+import drivetrain
+from actuator import ActuatorProcess, ActuatorWriter
+from benchmarks.bench_actuator import ADDRESS, RecordingBus
+from libs.Adafruit_PWM_Servo_Driver import PWM
+from libs.PCA9685_Simulator import SimulatedBus
+
+
+class ActuatorProcessTest(unittest.TestCase):
+    def test_rejects_bus_not_shared_across_processes(self):
+        bus = SimulatedBus()
+        bus.attach(ADDRESS)
+        self.assertRaises(ValueError, ActuatorProcess, ADDRESS, bus)
+        self.assertRaises(
+            ValueError, drivetrain.DriveTrain,
+            pwm_i2c=ADDRESS, bus=bus, process_writes=True)
+
+    def test_applies_deadband_in_output_process(self):
+        bus = RecordingBus()
+        PWM(ADDRESS, bus=bus).setPWMFreq(50)
+        writer = ActuatorProcess(ADDRESS, bus=bus, deadband=[5] * 16)
+        try:
+            for off in (300, 303, 310):
+                writer.submit({0: (0, off)})
+                time.sleep(0.1)
+        finally:
+            writer.stop()
+        self.assertEqual(sorted(bus.written()), [300, 310])
+
+
+
+class ActuatorWriterTest(unittest.TestCase):
+    def test_writes_without_polling_delay(self):
+        bus = RecordingBus()
+        pwm = PWM(ADDRESS, bus=bus)
+        pwm.setPWMFreq(50)
+        writer = ActuatorWriter(pwm, max_rate=1000)
+        try:
+            for off in range(300, 320):
+                writer.submit({0: (0, off)})
+                time.sleep(0.01)
+        finally:
+            writer.stop()
+        self.assertEqual(writer.stats()['written'], 20)
+        # Polling with Event.wait on Python 2 made this 5-20ms
+        self.assertLess(writer.stats()['latency_mean'], 0.003)
+
+
+if __name__ == '__main__':
+    unittest.main()
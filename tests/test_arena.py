@@ -0,0 +1,73 @@
+"""Arena pairings hold neutral the same way the Supervisor does."""
+import unittest
+
+import drivetrain
+import inputs
+from arena import Arena
+from libs.PCA9685_Simulator import SimulatedBus
+from tests.helpers import FixedInput
+
+
+class ArenaHoldTest(unittest.TestCase):
+    def setUp(self):
+        self.bus = SimulatedBus()
+        self.arena = Arena()
+        self.sources = []
+        self.drives = []
+        for index in range(3):
+            address = 0x40 + index
+            board = self.bus.attach(address)
+            drive = drivetrain.DriveTrain(pwm_i2c=address, bus=self.bus)
+            source = FixedInput()
+            self.arena.add("robot{0}".format(index), source, drive)
+            self.sources.append(source)
+            self.drives.append((drive, board))
+
+    def pulses(self, drive, board):
+        return [
+            round(board.getPulseWidth(drive.channels[name]))
+            for name in ('left', 'right', 'front')
+        ]
+
+    def assertNeutral(self):
+        for drive, board in self.drives:
+            self.assertFalse(drive.drive_enabled)
+            for pulse in self.pulses(drive, board):
+                self.assertAlmostEqual(pulse, drive.servo_mid, delta=10)
+
+    def test_drives_without_buttons(self):
+        self.arena.tick()
+        for drive, board in self.drives:
+            self.assertTrue(drive.drive_enabled)
+            self.assertNotEqual(self.pulses(drive, board)[:2],
+                                [drive.servo_mid] * 2)
+
+    def test_b_holds_every_pairing_neutral(self):
+        self.arena.tick()
+        for source in self.sources:
+            source.buttons = inputs.BTN_B
+        self.arena.tick()
+        self.assertNeutral()
+
+    def test_z_holds_every_pairing_neutral(self):
+        self.arena.tick()
+        for source in self.sources:
+            source.nunchuk_buttons = inputs.NUNCHUK_BTN_Z
+        self.arena.tick()
+        self.assertNeutral()
+
+    def test_releasing_drives_again(self):
+        self.arena.tick()
+        for source in self.sources:
+            source.buttons = inputs.BTN_B
+        self.arena.tick()
+        self.assertNeutral()
+        for source in self.sources:
+            source.buttons = 0
+        self.arena.tick()
+        for drive, board in self.drives:
+            self.assertTrue(drive.drive_enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()
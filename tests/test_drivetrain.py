@@ -0,0 +1,33 @@
+"""A failing trace does not stop the motor updates."""
+import unittest
+
+import drivetrain
+from libs.PCA9685_Simulator import SimulatedBus
+
+
+class FullDisk(object):
+    def __init__(self):
+        self.writes = 0
+
+    def write(self, kind, values, timestamp=None):
+        self.writes += 1
+        raise IOError(28, "No space left on device")
+
+
+class TraceFailureTest(unittest.TestCase):
+    def test_failing_trace_is_dropped(self):
+        bus = SimulatedBus()
+        board = bus.attach(0x40)
+        drive = drivetrain.DriveTrain(bus=bus)
+        trace = drive.trace = FullDisk()
+        drive.enable_drive()
+        drive.set_servo_pulses({drive.channels['left']: 2000})
+        drive.set_servo_pulses({drive.channels['left']: 2100})
+        self.assertIsNone(drive.trace)
+        self.assertEqual(trace.writes, 1)
+        self.assertAlmostEqual(
+            board.getPulseWidth(drive.channels['left']), 2100, delta=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
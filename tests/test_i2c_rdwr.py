@@ -0,0 +1,74 @@
+"""Combined I2C_RDWR transactions survive exceptions and threads."""
+import os
+import tempfile
+import threading
+import unittest
+
+from libs.Adafruit_PWM_Servo_Driver import PWM
+from libs.I2C_RDWR_Bus import I2CRdwrBus, SimulatedIoctl
+from libs.PCA9685_Simulator import SimulatedBus
+
+
+class TransactionTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.device = tempfile.mkstemp(prefix='i2c-')
+        os.close(handle)
+        simulated = SimulatedBus()
+        self.board = simulated.attach(0x40)
+        self.ioctl = SimulatedIoctl(simulated)
+        self.bus = I2CRdwrBus(path=self.device, ioctl=self.ioctl)
+        self.pwm = PWM(0x40, bus=self.bus)
+        self.pwm.setPWMFreq(50)
+
+    def tearDown(self):
+        self.bus.close()
+        os.unlink(self.device)
+
+    def test_inner_abandon_keeps_outer_open(self):
+        outer = self.bus.transaction()
+        inner = self.bus.transaction()
+        self.assertIs(inner, outer)
+        inner.write(0x40, 0x06, [0, 0, 50, 1])
+        inner.abandon()
+        self.assertIs(self.bus.open, outer)
+        calls = self.ioctl.calls
+        outer.commit()
+        self.assertIsNone(self.bus.open)
+        self.assertEqual(self.ioctl.calls, calls + 1)
+
+    def test_failed_update_does_not_wedge_the_bus(self):
+        def fail(*args):
+            raise RuntimeError("burst failed")
+        self.pwm._writeRun = fail
+        self.assertRaises(RuntimeError, self.pwm.setPWMMulti, {0: (0, 300)})
+        self.assertIsNone(self.bus.open)
+
+        del self.pwm._writeRun
+        self.pwm.setPWMMulti({0: (0, 300)})
+        self.assertEqual(self.board.read(0x08, 2), [300 & 0xFF, 300 >> 8])
+
+    def test_abandon_forgets_queued_shadow(self):
+        transaction = self.bus.transaction()
+        self.pwm.setPWMMulti({0: (0, 300)})
+        transaction.abandon()
+        self.assertEqual(self.pwm.shadow[0x06:0x0A], [None] * 4)
+
+    def test_transactions_are_per_thread(self):
+        outer = self.bus.transaction()
+        seen = []
+
+        def other():
+            seen.append(self.bus.open)
+            self.pwm.setPWMMulti({0: (0, 300)})
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None])
+        # Written straight away, not queued in this thread's transaction
+        self.assertEqual(len(outer), 0)
+        self.assertEqual(self.board.read(0x08, 2), [300 & 0xFF, 300 >> 8])
+        outer.commit()
+
+
+if __name__ == '__main__':
+    unittest.main()
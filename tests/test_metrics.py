@@ -0,0 +1,66 @@
+"""Metrics dumps on a signal and the Supervisor's phase timings."""
+import logging
+import os
+import signal
+import threading
+import unittest
+
+import drivetrain
+from libs.PCA9685_Simulator import SimulatedBus
+from metrics import Metrics, dump_on_signal
+from supervisor import RC, Supervisor
+from tests.helpers import FixedInput
+
+
+class Captured(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.logged = threading.Event()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+        self.logged.set()
+
+
+class DumpOnSignalTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = Captured()
+        logging.getLogger().addHandler(self.handler)
+        self.previous = signal.getsignal(signal.SIGUSR1)
+
+    def tearDown(self):
+        logging.getLogger().removeHandler(self.handler)
+        signal.signal(signal.SIGUSR1, self.previous)
+
+    def test_dumps_from_background_thread(self):
+        metrics = Metrics()
+        metrics.count('ticks', 3)
+        threads = []
+        metrics.add_source(
+            'thread', lambda: threads.append(threading.current_thread()))
+        dump_on_signal(metrics)
+        os.kill(os.getpid(), signal.SIGUSR1)
+        self.assertTrue(self.handler.logged.wait(5))
+        self.assertIn('"ticks": 3', self.handler.messages[0])
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+class SupervisorMetricsTest(unittest.TestCase):
+    def test_phases_timed_once_per_tick(self):
+        bus = SimulatedBus()
+        bus.attach(0x40)
+        metrics = Metrics()
+        supervisor = Supervisor(
+            drivetrain.DriveTrain(bus=bus), FixedInput(), metrics=metrics)
+        supervisor._set_mode(RC)
+        for _ in range(3):
+            supervisor.tick()
+        for name in ('read', 'snapshot', 'drive', 'normalise', 'mix', 'tick'):
+            self.assertEqual(metrics.phases[name].count, 3)
+        self.assertEqual(
+            metrics.sources['loop'], supervisor.scheduler.stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""The DriveTrain driving the physics model through simulated boards."""
+import math
+import unittest
+
+import drivetrain
+import physics
+from libs.PCA9685_Simulator import SimulatedBus
+
+
+class OmniBoardLinkTest(unittest.TestCase):
+    def setUp(self):
+        bus = SimulatedBus()
+        board = bus.attach(0x40)
+        self.drive = drivetrain.DriveTrain(bus=bus)
+        self.drive.enable_drive()
+        self.simulator = physics.omni(layout=self.drive.omni)
+        self.link = physics.BoardLink(
+            self.simulator, [board],
+            [self.drive.channels[name] for name in self.simulator.channels])
+
+    def run_for(self, throttle, strafe, rotate, seconds=1.0, dt=0.01):
+        self.drive.mix_channels_omni_and_assign(throttle, strafe, rotate)
+        for _ in range(int(seconds / dt)):
+            self.link.step(dt)
+        return self.simulator.pose[0]
+
+    def test_throttle_drives_forward(self):
+        x, y, heading = self.run_for(1.0, 0.0, 0.0)
+        self.assertGreater(y, 0.3)
+        self.assertLess(abs(x), 0.05 * y)
+        self.assertLess(abs(heading), 0.05)
+
+    def test_reverse_throttle_drives_backward(self):
+        x, y, heading = self.run_for(-1.0, 0.0, 0.0)
+        self.assertLess(y, -0.3)
+        self.assertLess(abs(heading), 0.05)
+
+    def test_strafe_moves_sideways_with_little_yaw(self):
+        # OMNI_MATRIX's strafe and rotate columns are not orthogonal, so
+        # some yaw comes with strafing on any rigid body, but it is small
+        # next to what rotate gives
+        x, y, heading = self.run_for(0.0, 1.0, 0.0)
+        strafe_yaw = self.simulator.velocity[0, 2]
+        self.assertGreater(abs(x), 0.3)
+        self.assertLess(abs(y), 0.25 * abs(x))
+        self.setUp()
+        self.run_for(0.0, 0.0, 1.0)
+        self.assertLess(abs(strafe_yaw), 0.01 * self.simulator.velocity[0, 2])
+
+    def test_rotate_yaws_on_the_spot(self):
+        x, y, heading = self.run_for(0.0, 0.0, 1.0)
+        self.assertGreater(heading, math.radians(90))
+        self.assertLess(math.hypot(x, y), 0.02)
+
+    def test_default_layout_is_the_mixer(self):
+        self.assertEqual(
+            physics.omni().channels, list(self.drive.omni.channels))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+"""Garbage collection between ticks still happens at high rates."""
+import gc
+import unittest
+
+import realtime
+
+
+class GCSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.was_enabled = gc.isenabled()
+
+    def tearDown(self):
+        if self.was_enabled:
+            gc.enable()
+
+    def test_collects_after_too_many_short_ticks(self):
+        scheduler = realtime.GCScheduler(max_skipped=10).start()
+        for _ in range(25):
+            scheduler(0.0)
+        self.assertEqual(scheduler.stats()['forced'], 2)
+        self.assertEqual(scheduler.stats()['skipped'], 25)
+
+    def test_slack_resets_the_run(self):
+        scheduler = realtime.GCScheduler(max_skipped=10).start()
+        for _ in range(3):
+            for _ in range(9):
+                scheduler(0.0)
+            scheduler(1.0)
+        self.assertEqual(scheduler.stats()['forced'], 0)
+
+    def test_min_slack_scales_with_rate(self):
+        self.assertEqual(realtime.GCScheduler.for_rate(50).min_slack, 0.005)
+        self.assertEqual(realtime.GCScheduler.for_rate(400).min_slack, 0.000625)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+"""Deadlines are on a monotonic clock, not the wall clock."""
+import time
+import unittest
+
+from scheduler import monotonic
+
+
+class MonotonicTest(unittest.TestCase):
+    def test_not_the_wall_clock(self):
+        self.assertIsNot(monotonic, time.time)
+        # CLOCK_MONOTONIC counts from boot, not from the epoch
+        self.assertGreater(abs(time.time() - monotonic()), 1e6)
+
+    def test_measures_elapsed_time(self):
+        start = monotonic()
+        time.sleep(0.05)
+        self.assertAlmostEqual(monotonic() - start, 0.05, delta=0.04)
+
+
+if __name__ == '__main__':
+    unittest.main()
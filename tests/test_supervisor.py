@@ -0,0 +1,105 @@
+"""The Supervisor keeps looping, in neutral, through failing ticks, and
+latches the emergency stop."""
+import unittest
+
+import drivetrain
+import inputs
+from libs.PCA9685_Simulator import SimulatedBus
+from metrics import Metrics
+from supervisor import (
+    ESTOP, IDLE, RC, RESET, START_RC, TOGGLE_RC, Supervisor)
+from tests.helpers import FixedInput
+
+
+class SupervisorErrorTest(unittest.TestCase):
+    def setUp(self):
+        bus = SimulatedBus()
+        self.board = bus.attach(0x40)
+        self.drive = drivetrain.DriveTrain(bus=bus)
+        self.source = FixedInput()
+        self.metrics = Metrics()
+        self.supervisor = Supervisor(
+            self.drive, self.source, metrics=self.metrics)
+        self.supervisor._set_mode(RC)
+
+    def test_attachment_buttons_without_attachments(self):
+        for button in (inputs.BTN_MINUS, inputs.BTN_PLUS,
+                       inputs.BTN_1, inputs.BTN_2):
+            self.source.buttons = button
+            self.supervisor.tick()
+        self.assertEqual(self.supervisor.errors, 0)
+        self.assertTrue(self.drive.drive_enabled)
+
+    def test_failing_tick_holds_neutral_and_continues(self):
+        self.supervisor.tick()
+
+        def fail(*args):
+            raise RuntimeError("mixer failed")
+        self.drive.mix_channels_omni_and_assign = fail
+        self.supervisor.tick()
+        self.supervisor.tick()
+        self.assertEqual(self.supervisor.errors, 2)
+        self.assertEqual(self.metrics.counters['tick_errors'], 2)
+        self.assertFalse(self.drive.drive_enabled)
+        left = self.board.getPulseWidth(self.drive.channels['left'])
+        self.assertAlmostEqual(left, self.drive.servo_mid, delta=10)
+
+        del self.drive.mix_channels_omni_and_assign
+        self.supervisor.tick()
+        self.assertTrue(self.drive.drive_enabled)
+
+
+    def test_fault_in_neutral_path_still_disables(self):
+        kicks = []
+
+        class Watchdog(object):
+            def kick(self):
+                kicks.append(None)
+        self.supervisor.watchdog = Watchdog()
+        self.supervisor.tick()
+
+        def fail(*args):
+            raise IOError(5, "Input/output error")
+        self.drive.set_servo_pulses = fail
+        self.supervisor.tick()
+        self.assertEqual(self.supervisor.errors, 1)
+        self.assertFalse(self.drive.drive_enabled)
+        self.assertEqual(len(kicks), 2)
+
+
+class EmergencyStopTest(unittest.TestCase):
+    def setUp(self):
+        bus = SimulatedBus()
+        self.board = bus.attach(0x40)
+        self.drive = drivetrain.DriveTrain(bus=bus)
+        self.source = FixedInput()
+        self.supervisor = Supervisor(self.drive, self.source)
+        self.supervisor._set_mode(RC)
+        self.supervisor.tick()
+
+    def test_home_button_latches_until_reset(self):
+        self.source.buttons = inputs.BTN_HOME
+        self.supervisor.tick()
+        self.assertEqual(self.supervisor.mode, ESTOP)
+        self.assertFalse(self.drive.drive_enabled)
+        left = self.board.getPulseWidth(self.drive.channels['left'])
+        self.assertAlmostEqual(left, self.drive.servo_mid, delta=10)
+
+        self.source.buttons = 0
+        for message in (START_RC, TOGGLE_RC):
+            self.supervisor.post(message)
+            self.supervisor.tick()
+            self.assertEqual(self.supervisor.mode, ESTOP)
+            self.assertFalse(self.drive.drive_enabled)
+
+        self.supervisor.post(RESET)
+        self.supervisor.tick()
+        self.assertEqual(self.supervisor.mode, IDLE)
+        self.supervisor.post(START_RC)
+        self.supervisor.tick()
+        self.assertEqual(self.supervisor.mode, RC)
+        self.assertTrue(self.drive.drive_enabled)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""UDP input sessions across timeouts."""
+import socket
+import time
+import unittest
+
+import udpinput
+from udpinput import UDPInput, encode_state
+
+STATE = {'buttons': 0, 'nunchuk': {
+    'buttons': 0, 'stick': (200, 125), 'acc': (125, 125, 150)}}
+
+
+class UDPInputTest(unittest.TestCase):
+    def setUp(self):
+        self.input = UDPInput(port=0, timeout=0.05)
+        self.address = self.input.sock.getsockname()
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def tearDown(self):
+        self.sender.close()
+        self.input.close()
+
+    def send(self, sequence):
+        self.sender.sendto(encode_state(sequence, STATE), self.address)
+        time.sleep(0.01)
+
+    def test_binds_loopback_by_default(self):
+        self.assertEqual(self.address[0], udpinput.DEFAULT_HOST)
+
+    def test_restarted_sender_accepted_after_timeout(self):
+        for sequence in range(100, 110):
+            self.send(sequence)
+        self.input.get_state()
+        time.sleep(0.1)
+        self.assertNotIn('nunchuk', self.input.get_state())
+        self.assertFalse(self.input.connected.is_set())
+
+        # The sender restarts a little behind its old sequence
+        self.send(5)
+        self.assertIn('nunchuk', self.input.get_state())
+        self.assertTrue(self.input.connected.is_set())
+        self.assertEqual(self.input.stale, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""The watchdog's neutral follows the drivetrain's current settings,
+and stalls are counted when they trip it."""
+import time
+import unittest
+
+import drivetrain
+from libs.PCA9685_Simulator import SimulatedBus
+from watchdog import Watchdog
+
+
+class WatchdogNeutralTest(unittest.TestCase):
+    def setUp(self):
+        bus = SimulatedBus()
+        self.board = bus.attach(0x40)
+        self.drive = drivetrain.DriveTrain(bus=bus)
+        self.watchdog = Watchdog(self.drive, bus=bus)
+
+    def neutral_written(self):
+        self.watchdog.force_neutral()
+        return [self.board.getPulseWidth(self.drive.channels[name])
+                for name in ('left', 'right', 'front')]
+
+    def test_neutral_after_frequency_change(self):
+        self.drive.set_pwm_freq(200)
+        for pulse in self.neutral_written():
+            self.assertAlmostEqual(pulse, self.drive.servo_mid, delta=10)
+
+    def test_neutral_after_servo_mid_change(self):
+        self.drive.servo_mid = 1500
+        for pulse in self.neutral_written():
+            self.assertAlmostEqual(pulse, 1500, delta=10)
+
+
+
+class WatchdogTripTest(unittest.TestCase):
+    def setUp(self):
+        bus = SimulatedBus()
+        self.board = bus.attach(0x40)
+        self.drive = drivetrain.DriveTrain(bus=bus)
+        self.drive.enable_drive()
+        self.watchdog = Watchdog(self.drive, deadline=0.04, bus=bus)
+
+    def tearDown(self):
+        self.watchdog.stop()
+
+    def test_stall_recorded_without_recovery(self):
+        self.watchdog.start()
+        self.watchdog.kick()
+        time.sleep(0.2)
+        self.assertEqual(self.watchdog.trips, 1)
+        self.assertTrue(self.watchdog.tripped)
+        self.assertEqual(self.watchdog.stats()['stalls']['count'], 1)
+
+    def test_loop_rewrites_after_trip(self):
+        left = self.drive.channels['left']
+        self.drive.set_servo_pulses({left: 2000})
+        self.watchdog.force_neutral()
+        self.assertAlmostEqual(
+            self.board.getPulseWidth(left), self.drive.servo_mid, delta=10)
+        # The same command again must reach the board
+        self.drive.set_servo_pulses({left: 2000})
+        self.assertAlmostEqual(self.board.getPulseWidth(left), 2000, delta=10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Polled accelerometer samples are taken once per tick, and the filter
+is ready before the first connection attempt."""
+import unittest
+
+from benchmarks import standins
+from inputs import InputSnapshot
+
+standins.install()
+import wiimote  # noqa: E402, after the cwiid stand-in is in place
+
+
+class PolledAccelTest(unittest.TestCase):
+    def setUp(self):
+        self.wiimote = wiimote.Wiimote(
+            bdaddr='00:11:22:33:44:55', accel_filter=[0.5, 0.5])
+        self.snapshot = InputSnapshot()
+
+    def tearDown(self):
+        self.wiimote.close()
+
+    def test_one_sample_per_snapshot(self):
+        for _ in range(5):
+            # Other readers of the state between ticks, e.g. the LEDs
+            self.wiimote.get_state()
+            self.wiimote.get_state()
+            self.wiimote.read_snapshot(self.snapshot)
+        self.assertEqual(self.wiimote.accel.count, 5)
+
+    def test_state_passed_in_is_sampled(self):
+        state = self.wiimote.get_state()
+        self.wiimote.read_snapshot(self.snapshot, state)
+        self.assertEqual(self.wiimote.accel.count, 1)
+        self.assertEqual(
+            self.snapshot.acc_filtered, tuple(
+                float(value) for value in state['nunchuk']['acc']))
+
+
+
+class PipelineOrderTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.pipeline = wiimote.AccelPipeline
+        self.cwiid = wiimote._import_cwiid()
+        self.cwiid_wiimote = self.cwiid.Wiimote
+        events = self.events
+        pipeline = self.pipeline
+        cwiid_wiimote = self.cwiid_wiimote
+
+        def create_pipeline(*args):
+            events.append('pipeline')
+            return pipeline(*args)
+
+        def connect(*args):
+            events.append('connect')
+            return cwiid_wiimote(*args)
+        wiimote.AccelPipeline = create_pipeline
+        self.cwiid.Wiimote = connect
+
+    def tearDown(self):
+        wiimote.AccelPipeline = self.pipeline
+        self.cwiid.Wiimote = self.cwiid_wiimote
+
+    def test_pipeline_created_before_connecting(self):
+        remote = wiimote.Wiimote(
+            bdaddr='00:11:22:33:44:55', accel_filter=[0.5, 0.5])
+        remote.close()
+        self.assertEqual(self.events, ['pipeline', 'connect'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""Send controller packets to a robot running udpinput.UDPInput.
+
+Stands in for a laptop or gamepad bridge: sweeps the stick, or sends
+a recorded wiimote session from recorder.py at its recorded timing.
+
+    python udp_sender.py [--host HOST] [--port PORT] [--rate HZ]
+        [--recording FILE] [--seconds N]
+"""
+from __future__ import division, print_function
+import argparse
+import math
+import socket
+import time
+
+from recorder import read_recording
+from scheduler import monotonic
+from udpinput import DEFAULT_PORT, encode_state
+
+
+def sweep_states(rate):
+    """Stick circling slowly around the centre, forever"""
+    step = 0
+    while True:
+        angle = step / rate
+        step += 1
+        yield {
+            'buttons': 0,
+            'nunchuk': {
+                'buttons': 0,
+                'stick': (
+                    int(125 + 60 * math.cos(angle)),
+                    int(125 + 60 * math.sin(angle)),
+                ),
+                'acc': (125, 125, 150),
+            },
+        }
+
+
+def recorded_states(path, rate):
+    """The recorded states resampled at rate"""
+    records = read_recording(path)
+    first = records[0][0]
+    index = 0
+    step = 0
+    while index < len(records):
+        due = first + step / rate
+        while index + 1 < len(records) and records[index + 1][0] <= due:
+            index += 1
+        yield records[index][1]
+        if index == len(records) - 1:
+            return
+        step += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--rate', type=float, default=100,
+                        help="packets per second")
+    parser.add_argument('--recording', help="recorder.py file to send")
+    parser.add_argument('--seconds', type=float, default=None,
+                        help="stop after this long")
+    args = parser.parse_args()
+
+    if args.recording:
+        states = recorded_states(args.recording, args.rate)
+    else:
+        states = sweep_states(args.rate)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    period = 1 / args.rate
+    started = monotonic()
+    deadline = started
+    sequence = 0
+    try:
+        for state in states:
+            sock.sendto(encode_state(sequence, state), (args.host, args.port))
+            sequence += 1
+            if args.seconds is not None and monotonic() - started > args.seconds:
+                break
+            deadline += period
+            time.sleep(max(deadline - monotonic(), 0.0))
+    except KeyboardInterrupt:
+        pass
+    print("Sent {0} packets".format(sequence))
+
+
+if __name__ == '__main__':
+    main()
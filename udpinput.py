@@ -0,0 +1,202 @@
+"""Controller input over UDP, as an alternative to the wiimote.
+
+Each datagram is one fixed size packet holding a full controller state
+with a sequence number and the send time. Every read takes the newest
+packet waiting, anything older or out of order is dropped, so a late
+packet can never overwrite a newer command. If no packet arrives for
+timeout seconds the state reads as disconnected, which holds neutral.
+
+Latency is the receive time less the send time, so it is only
+meaningful when the sender's clock is synchronised with the robot's,
+e.g. over NTP or from the same machine. See udp_sender.py for a sender.
+
+Packets are not authenticated, anything that can reach the port can
+drive the robot. So by default only the loopback interface is bound,
+for a bridge on the robot itself; bind the address of the interface
+the controller is on, never a shared network, to take packets from
+another machine."""
+from __future__ import division
+import errno
+import socket
+import struct
+import threading
+import time
+
+from inputs import InputSource
+from scheduler import Histogram, monotonic
+
+MAGIC = b'PN'
+VERSION = 1
+# magic, version, sequence, send time, buttons, flags, nunchuk buttons,
+# stick x/y, acc x/y/z
+PACKET = struct.Struct('<2sBIdHBBBBBBB')
+FLAG_NUNCHUK = 0x01
+
+DEFAULT_PORT = 5005
+DEFAULT_HOST = '127.0.0.1'
+SEQUENCE_MOD = 1 << 32
+# A packet this far behind the newest is taken as the sender restarting
+# its sequence, rather than as a very late packet
+RESTART_WINDOW = 1000
+
+# Reported while no packets are arriving
+DISCONNECTED_STATE = {'buttons': 0, 'timestamp': None}
+
+LATENCY_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25)
+
+
+def encode_state(sequence, state, sent=None):
+    """Pack a cwiid style state dict into a packet"""
+    if sent is None:
+        sent = time.time()
+    nunchuk = state.get('nunchuk')
+    if nunchuk is None:
+        return PACKET.pack(
+            MAGIC, VERSION, sequence % SEQUENCE_MOD, sent,
+            state['buttons'], 0, 0, 0, 0, 0, 0, 0
+        )
+    stick = nunchuk['stick']
+    acc = nunchuk['acc']
+    return PACKET.pack(
+        MAGIC, VERSION, sequence % SEQUENCE_MOD, sent,
+        state['buttons'], FLAG_NUNCHUK, nunchuk['buttons'],
+        stick[0], stick[1], acc[0], acc[1], acc[2]
+    )
+
+
+def decode_packet(data):
+    """Return (sequence, send time, state dict), or None if data is not
+    a packet of this version"""
+    if len(data) != PACKET.size:
+        return None
+    (magic, version, sequence, sent, buttons, flags, nunchuk_buttons,
+     stick_x, stick_y, acc_x, acc_y, acc_z) = PACKET.unpack(data)
+    if magic != MAGIC or version != VERSION:
+        return None
+    state = {'buttons': buttons, 'timestamp': sent}
+    if flags & FLAG_NUNCHUK:
+        state['nunchuk'] = {
+            'buttons': nunchuk_buttons,
+            'stick': (stick_x, stick_y),
+            'acc': (acc_x, acc_y, acc_z),
+        }
+    return sequence, sent, state
+
+
+class UDPInput(InputSource):
+    """Reads controller packets from a UDP port, with the same interface
+    as wiimote.Wiimote, so rc.rc and the Supervisor can use either"""
+    def __init__(
+        self,
+        port=DEFAULT_PORT,
+        host=DEFAULT_HOST,
+        timeout=0.25,
+        joystick_range=None,
+        acc_range=None
+    ):
+        super(UDPInput, self).__init__(joystick_range, acc_range)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+        self.timeout = timeout
+        self.led = 1
+        # Set while packets are arriving, like Wiimote.connected
+        self.connected = threading.Event()
+        self._state = DISCONNECTED_STATE
+        self._last_sequence = None
+        self._last_received = None
+
+        self.received = 0
+        self.accepted = 0
+        # Older than, or a repeat of, the newest packet already taken
+        self.stale = 0
+        # Newer than the last accepted, but replaced by a still newer
+        # packet in the same read
+        self.superseded = 0
+        # Sequence numbers skipped over, not seen before a newer one
+        self.lost = 0
+        self.malformed = 0
+        self.restarts = 0
+        self.latency = Histogram(LATENCY_BOUNDS)
+
+    def _accept(self, sequence):
+        """True if sequence is newer than the last accepted packet"""
+        last = self._last_sequence
+        if last is None:
+            return True
+        ahead = (sequence - last) % SEQUENCE_MOD
+        if ahead == 0:
+            self.stale += 1
+            return False
+        if ahead < SEQUENCE_MOD // 2:
+            self.lost += ahead - 1
+            return True
+        if SEQUENCE_MOD - ahead > RESTART_WINDOW:
+            self.restarts += 1
+            return True
+        self.stale += 1
+        return False
+
+    def get_state(self):
+        """The newest state received, read once per control tick"""
+        newest = None
+        while True:
+            try:
+                data = self.sock.recv(64)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            # Wall clock, to compare with the sender's send time
+            received = time.time()
+            self.received += 1
+            packet = decode_packet(data)
+            if packet is None:
+                self.malformed += 1
+                continue
+            sequence, sent, state = packet
+            if not self._accept(sequence):
+                continue
+            if newest is not None:
+                self.superseded += 1
+            self._last_sequence = sequence
+            self.latency.add(max(received - sent, 0.0))
+            newest = state
+
+        # The link timeout is on the monotonic clock, so a step of the
+        # wall clock neither drops nor holds the link
+        now = monotonic()
+        if newest is not None:
+            self.accepted += 1
+            self._state = newest
+            self._last_received = now
+            self.connected.set()
+        elif (self._last_received is not None and
+              now - self._last_received > self.timeout):
+            # The link has gone quiet, stop driving on the last command
+            self._state = DISCONNECTED_STATE
+            self._last_received = None
+            # Whatever comes next is a new session, even a restarted
+            # sender whose sequence is just behind the old one
+            self._last_sequence = None
+            self.connected.clear()
+        return self._state
+
+    def stats(self):
+        """Packet counts, loss rate and latency in seconds"""
+        expected = self.accepted + self.superseded + self.lost
+        return dict(
+            received=self.received,
+            accepted=self.accepted,
+            stale=self.stale,
+            superseded=self.superseded,
+            lost=self.lost,
+            loss=self.lost / expected if expected else 0.0,
+            malformed=self.malformed,
+            restarts=self.restarts,
+            latency=self.latency.as_dict(),
+        )
+
+    def close(self):
+        self.connected.clear()
+        self.sock.close()
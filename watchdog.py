@@ -0,0 +1,135 @@
+"""Deadline watchdog for the control loop.
+
+The PCA9685 keeps outputting the last pulse it was given, so a control
+loop stalled on a hung I2C write, a bluetooth hiccup or a GC pause
+leaves the robot driving. The watchdog thread checks how long ago the
+loop last completed a tick, and once that passes the deadline it writes
+servo_mid to the drive channels itself, over its own I2C handle so it
+does not wait on anything the stalled loop holds.
+
+The control loop calls kick() at the end of every tick. Under real time
+scheduling, give the watchdog a SCHED_FIFO priority above the loop's,
+or a loop spinning without sleeping would keep it from ever running."""
+from __future__ import division
+import logging
+import threading
+import time
+
+import realtime
+from libs.Adafruit_I2C import Adafruit_I2C
+from scheduler import Histogram, monotonic
+
+LED0_ON_L = 0x06
+
+# Histogram bucket upper bounds for tick gaps and stalls, in seconds
+WATCHDOG_BOUNDS = (0.02, 0.03, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+
+
+class Watchdog(object):
+    """Forces the drive channels to neutral when kick() has not been
+    called for deadline seconds"""
+    def __init__(
+        self,
+        drive,
+        deadline=0.1,
+        busnum=-1,
+        bus=None,
+        bounds=WATCHDOG_BOUNDS,
+        priority=None
+    ):
+        self.drive = drive
+        self.deadline = deadline
+        # SCHED_FIFO priority the watchdog thread sets for itself, or
+        # None to keep whatever it inherits
+        self.priority = priority
+        # Checked several times per deadline, so a stall is caught
+        # at most a quarter of the deadline late
+        self.interval = deadline / 4
+        # A separate handle on the same board, not the PWM object, whose
+        # constructor would reset the board
+        self.i2c = Adafruit_I2C(drive.pwm.address, busnum=busnum, bus=bus)
+        self.channels = sorted(
+            drive.channels[name] for name in ('left', 'right', 'front'))
+
+        self.last_tick = monotonic()
+        self.tripped = False
+        self.trips = 0
+        self.write_errors = 0
+        # Gap between every pair of completed ticks, to show how often
+        # the loop comes close to the deadline
+        self.gaps = Histogram(bounds)
+        # Age of the last completed tick each time the watchdog tripped,
+        # recorded on tripping so a stall that never ends is counted
+        self.stalls = Histogram(bounds)
+        self.killed = False
+        self._thread = None
+
+    def start(self):
+        """Start watching, timed from now"""
+        self.last_tick = monotonic()
+        self.killed = False
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def kick(self):
+        """Record a completed control tick"""
+        now = monotonic()
+        gap = now - self.last_tick
+        self.last_tick = now
+        self.gaps.add(gap)
+        if self.tripped:
+            self.tripped = False
+            logging.warning(
+                "Control loop recovered after {0:.3f}s".format(gap))
+
+    def run(self):
+        if self.priority is not None:
+            try:
+                realtime.set_fifo(self.priority)
+            except (OSError, AttributeError) as e:
+                logging.warning(
+                    "Watchdog real time priority not applied: {0}".format(e))
+        while not self.killed:
+            time.sleep(self.interval)
+            age = monotonic() - self.last_tick
+            if age > self.deadline and not self.tripped:
+                self.tripped = True
+                self.trips += 1
+                self.stalls.add(age)
+                self.force_neutral()
+                logging.error(
+                    "Control loop missed its deadline by {0:.3f}s, "
+                    "drive set to neutral".format(age - self.deadline))
+
+    def force_neutral(self):
+        """Write servo_mid to the drive channels"""
+        # Worked out now rather than at start up, in case servo_mid or
+        # the PWM frequency have been changed since
+        neutral = self.drive.neutral_ticks()
+        data = [0, 0, neutral & 0xFF, neutral >> 8]
+        for channel in self.channels:
+            reg = LED0_ON_L + 4 * channel
+            # All four LEDn registers in one transaction, so no part
+            # updated pulse is ever output
+            if self.i2c.writeList(reg, data) == -1:
+                self.write_errors += 1
+        # The drivetrain's record of the registers no longer matches the
+        # board
+        self.drive.invalidate_channels(self.channels)
+
+    def stop(self):
+        self.killed = True
+        if self._thread is not None:
+            self._thread.join()
+
+    def stats(self):
+        return dict(
+            deadline=self.deadline,
+            trips=self.trips,
+            write_errors=self.write_errors,
+            tripped=self.tripped,
+            gaps=self.gaps.as_dict(),
+            stalls=self.stalls.as_dict(),
+        )
@@ -1,7 +1,12 @@
-import cwiid
 import logging
+import re
+import subprocess
+import threading
+import time
 
-from numpy import clip, interp
+from accelfilter import AccelPipeline
+from inputs import InputSource
+from scheduler import monotonic
 
 
 class WiimoteException(Exception):
@@ -12,28 +17,153 @@ class WiimoteNunchukException(WiimoteException):
     pass
 
 
-class Wiimote():
+# Reported while there is no connection, no nunchuk means no driving
+DISCONNECTED_STATE = {'buttons': 0, 'timestamp': None}
+
+BDADDR_RE = re.compile(r'([0-9A-Fa-f]{2}(?::[0-9A-Fa-f]{2}){5})')
+
+# Imported on the first connection attempt, which runs in the pairing
+# thread when connecting in the background, so the import overlaps the
+# rest of the boot rather than delaying it
+cwiid = None
+
+
+def _import_cwiid():
+    global cwiid
+    if cwiid is None:
+        import cwiid as module
+        cwiid = module
+    return cwiid
+
+
+class Wiimote(InputSource):
     """Wrapper class for the wiimote interaction"""
     def __init__(
         self,
         max_tries=5,
         joystick_range=None,
-        acc_range=None
+        acc_range=None,
+        callbacks=False,
+        recorder=None,
+        bdaddr=None,
+        bdaddr_file=None,
+        background=False,
+        max_backoff=5.0,
+        accel_filter=None,
+        accel_buffer=256
     ):
-        self.joystick_range = joystick_range if joystick_range else [50, 200]
-        self.acc_range = acc_range if acc_range else [75, 175]
+        super(Wiimote, self).__init__(joystick_range, acc_range)
         self.wm = None
-        attempts = 0
+        # In callback mode cwiid pushes each report to _on_mesg, which
+        # swaps in a new state snapshot, so reading the state needs no
+        # bluetooth round trip or dict build from the cwiid object
+        self.callbacks = callbacks
+        # Optional recorder.InputRecorder, logs every report in callback
+        # mode, otherwise every poll
+        self.recorder = recorder
+        self.reports_received = 0
+        self.reports_consumed = 0
+        self._snapshot = DISCONNECTED_STATE
+        self._snapshot_seq = 0
+        self._consumed_seq = 0
+        # With accel_filter, FIR coefficients or a function giving them,
+        # see accelfilter.AccelPipeline, every nunchuk accelerometer
+        # report is kept, and snapshots get the filtered reading at
+        # tick time. In polled mode there is one sample per tick, taken
+        # from the state each snapshot is read from.
+        self.accel_filter = accel_filter
+        self.accel_buffer = accel_buffer
+        self.accel = None
+
+        # Connecting straight to a known address skips the discovery
+        # scan, the last paired address is kept in bdaddr_file
+        self.bdaddr_file = bdaddr_file
+        self.bdaddr = bdaddr if bdaddr else self._load_bdaddr()
+        self.max_backoff = max_backoff
+        self.connected = threading.Event()
+        self.connect_time = None
+        self._connect_thread = None
+        self._connect_lock = threading.Lock()
+        self.killed = False
 
         logging.info("Press 1+2 on your Wiimote now...")
+        if background:
+            # Return straight away, reading the state gives
+            # DISCONNECTED_STATE until the wiimote is paired
+            self.reconnect()
+        else:
+            self._connect(max_tries)
 
+    def _load_bdaddr(self):
+        if not self.bdaddr_file:
+            return None
+        try:
+            with open(self.bdaddr_file) as infile:
+                match = BDADDR_RE.search(infile.read())
+                return match.group(1) if match else None
+        except IOError:
+            return None
+
+    def _save_bdaddr(self, bdaddr):
+        if not self.bdaddr_file or bdaddr == self._load_bdaddr():
+            return
+        try:
+            with open(self.bdaddr_file, 'w') as outfile:
+                outfile.write(bdaddr + '\n')
+        except IOError:
+            logging.error("Could not save wiimote address to {0}".format(
+                self.bdaddr_file))
+
+    @staticmethod
+    def _acl_connections():
+        """Addresses in the bluetooth ACL connection list, or None if it
+        cannot be read"""
+        try:
+            output = subprocess.check_output(['hcitool', 'con'])
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return set(BDADDR_RE.findall(output.decode('ascii', 'ignore')))
+
+    @classmethod
+    def _new_connection(cls, before):
+        """Address of the wiimote just connected by a discovery scan, as
+        cwiid does not report it. Other remotes or bluetooth devices may
+        be connected too, so this is only the connection that appeared
+        since before, and None unless exactly one did"""
+        after = cls._acl_connections()
+        if before is None or after is None:
+            return None
+        new = after - before
+        return new.pop() if len(new) == 1 else None
+
+    def _connect(self, max_tries=None):
+        """Open the wiimote connection, backing off between attempts.
+        Gives up after max_tries attempts, or keeps trying if None"""
+        started = monotonic()
+        _import_cwiid()
+        if self.accel_filter is not None and self.accel is None:
+            # Created here, before the first attempt rather than once
+            # connected, so the numpy import overlaps the wait for 1+2
+            # instead of delaying the first drivable moment
+            self.accel = AccelPipeline(self.accel_filter, self.accel_buffer)
+        attempts = 0
+        backoff = 0.1
+        wm = None
+        before = None
         # Attempt to get a connection to the wiimote
         # try a few times, as it can take a few attempts
-        while not self.wm:
+        while wm is None and not self.killed:
+            # Go straight to the pinned address, with a discovery scan
+            # every third attempt in case a different remote is used
+            pinned = self.bdaddr if attempts % 3 != 2 else None
             try:
-                self.wm = cwiid.Wiimote()
+                if pinned:
+                    wm = cwiid.Wiimote(pinned)
+                else:
+                    before = self._acl_connections()
+                    wm = cwiid.Wiimote()
             except RuntimeError:
-                if attempts == max_tries:
+                if max_tries is not None and attempts == max_tries:
                     logging.error("cannot create connection")
                     raise WiimoteException(
                         "Could not create connection within {0} tries".format(
@@ -43,107 +173,151 @@ class Wiimote():
                 logging.error("Error opening wiimote connection")
                 logging.error("attempt {0}".format(attempts))
                 attempts += 1
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        if wm is None:
+            return
+        self._setup(wm)
+        self.connect_time = monotonic() - started
+        logging.info(
+            "Wiimote connected in {0:.2f}s after {1} failed attempts".format(
+                self.connect_time, attempts
+            )
+        )
+        # Only pin an address known to be this remote's
+        bdaddr = pinned if pinned else self._new_connection(before)
+        if bdaddr:
+            self.bdaddr = bdaddr
+            self._save_bdaddr(bdaddr)
 
+    def _setup(self, wm):
         # set wiimote to report button presses and accelerometer state
-        self.wm.rpt_mode = cwiid.RPT_BTN | cwiid.RPT_ACC | cwiid.RPT_EXT
+        wm.rpt_mode = cwiid.RPT_BTN | cwiid.RPT_ACC | cwiid.RPT_EXT
 
         # Set led state
-        self.wm.led = 1
+        wm.led = 1
 
-    def get_state(self):
-        """Get the full raw state of the wiimote.
-        Returns: dict"""
-        return self.wm.state if self.wm else None
-
-    def get_nunchuk_accel_state(self):
-        """ Get the nunchuck accelerometer
-            Returns a dictionary containing the state of
-            the nunchuk joystick in the form:
-            {
-            "state": {
-                    "raw": tuple of the raw joystick readings
-                           from cwiid in the form (x, y),
-                    "clipped": tuple of the raw values, clipped
-                               to the min/max range,
-                    "normalised": the 'clipped' tuple, with the
-                                values mapped to the range -1 to 1
-                }
-            "range": The min/max range to clip raw values to
-            }
-        """
-        if 'nunchuk' not in self.get_state():
-            logging.debug("state: {0}".format(self.get_state()))
-            return None
-        else:
-            acc_state_raw = self.wm.state['nunchuk']['acc']
-            acc_state_clipped = [
-                clip(channel, *self.acc_range)
-                for channel
-                in acc_state_raw
-            ]
-            acc_state_normalised = [
-                interp(channel, self.acc_range, [-1, 1])
-                for channel
-                in acc_state_raw
-            ]
-            return dict(
-                range=self.acc_range,
-                state=dict(
-                    raw=acc_state_raw,
-                    clipped=acc_state_clipped,
-                    normalised=acc_state_normalised
-                )
-            )
+        if self.accel is not None:
+            self.accel.reset()
 
-    def get_joystick_state(self):
-        """Returns a dictionary containing the state
-           of the nunchuk joystick in the form:
-            {
-            "state": {
-                    "raw": tuple of the raw joystick readings
-                           from cwiid in the form (x, y),
-                    "clipped": tuple of the raw values,
-                               clipped to the min/max range,
-                    "normalised": the 'clipped' tuple, with
-                                  the values mapped to the range -1 to 1
-                }
-            "range": The min/max range to clip raw values to
-            }
-        """
-        if 'nunchuk' not in self.get_state():
-            logging.debug("state: {0}".format(self.get_state()))
-            return None
-        else:
-            joystick_state_raw = self.wm.state['nunchuk']['stick']
-            joystick_state_clipped = [
-                clip(channel, *self.joystick_range)
-                for channel
-                in joystick_state_raw
-            ]
-            joystick_state_normalised = [
-                interp(channel, self.joystick_range, [-1, 1])
-                for channel
-                in joystick_state_raw
-            ]
-            return dict(
-                range=self.joystick_range,
-                state=dict(
-                    raw=joystick_state_raw,
-                    clipped=joystick_state_clipped,
-                    normalised=joystick_state_normalised
-                )
-            )
+        # Seeded from a poll, until the first report arrives
+        self._snapshot = dict(wm.state, timestamp=None)
+        if self.callbacks:
+            wm.mesg_callback = self._on_mesg
+            wm.enable(cwiid.FLAG_MESG_IFC)
+        self.wm = wm
+        self.connected.set()
 
-    def get_buttons(self):
-        """Get just the current button state of the wiimote"""
-        buttons_state = self.wm.state['buttons']
+    def reconnect(self):
+        """Reconnect in a background thread. Meanwhile the state reads
+        as DISCONNECTED_STATE, so the control loop holds neutral"""
+        with self._connect_lock:
+            thread = self._connect_thread
+            if thread is not None and thread.is_alive():
+                return
+            self._connect_thread = threading.Thread(target=self._reconnect)
+            self._connect_thread.daemon = True
+            self._connect_thread.start()
 
-        return buttons_state
+    def _reconnect(self):
+        self._disconnected()
+        self._connect()
 
-    def get_nunchuk_buttons(self):
-        """Get just the current button state of the wiimote nunchuk"""
-        if 'nunchuk' not in self.get_state():
-            return None
-        buttons_state = self.wm.state['nunchuk']['buttons']
+    def _disconnected(self):
+        self.connected.clear()
+        self._snapshot = DISCONNECTED_STATE
+        wm, self.wm = self.wm, None
+        if wm is not None:
+            try:
+                wm.close()
+            except (RuntimeError, ValueError):
+                pass
+
+    def wait_connected(self, timeout=None):
+        """Block until the wiimote is connected, True if it is"""
+        return self.connected.wait(timeout)
+
+    def close(self):
+        """Stop reconnecting and close the connection"""
+        self.killed = True
+        self._disconnected()
+
+    def _on_mesg(self, mesg_list, timestamp):
+        """cwiid message callback, runs on the cwiid thread"""
+        # Copy on write, then swap the reference in a single assignment
+        # so readers always see a complete snapshot
+        state = dict(self._snapshot)
+        for mesg_type, data in mesg_list:
+            if mesg_type == cwiid.MESG_BTN:
+                state['buttons'] = data
+            elif mesg_type == cwiid.MESG_ACC:
+                state['acc'] = data
+            elif mesg_type == cwiid.MESG_NUNCHUK:
+                state['nunchuk'] = data
+                if self.accel is not None:
+                    self.accel.add(data['acc'])
+            elif mesg_type == cwiid.MESG_STATUS:
+                if data.get('ext_type') != cwiid.EXT_NUNCHUK:
+                    state.pop('nunchuk', None)
+            elif mesg_type == cwiid.MESG_ERROR:
+                logging.error("Wiimote error message {0}".format(data))
+                # Connection lost, hold neutral and pair again
+                self._snapshot = DISCONNECTED_STATE
+                if not self.killed:
+                    self.reconnect()
+                return
+        state['timestamp'] = timestamp
+        if self.recorder is not None:
+            self.recorder.record(state)
+        self.reports_received += 1
+        self._snapshot_seq = self.reports_received
+        self._snapshot = state
+
+    def get_state(self):
+        """Get the full raw state of the wiimote. Read this once per
+        control tick and pass it to the other getters.
+        Returns: dict"""
+        if self.callbacks:
+            if self._consumed_seq != self._snapshot_seq:
+                self._consumed_seq = self._snapshot_seq
+                self.reports_consumed += 1
+            return self._snapshot
+        wm = self.wm
+        if not wm:
+            return DISCONNECTED_STATE
+        try:
+            state = wm.state
+        except (RuntimeError, ValueError):
+            logging.error("Lost wiimote connection")
+            self.reconnect()
+            return DISCONNECTED_STATE
+        if self.recorder is not None:
+            self.recorder.record(state)
+        return state
+
+    def read_snapshot(self, snapshot, state=None):
+        """As InputSource.read_snapshot, adding the filtered
+        accelerometer reading when accel_filter is set"""
+        if state is None:
+            state = self.get_state()
+        snapshot.fill(state, self.scaling)
+        accel = self.accel
+        if accel is not None and snapshot.acc is not None:
+            if not self.callbacks:
+                # Polled, the sample is taken here rather than in
+                # get_state, which other callers may read at any rate
+                accel.add(snapshot.acc)
+            snapshot.acc_filtered = accel.value()
+        return snapshot
 
-        return buttons_state
+    def get_report_stats(self):
+        """Count of reports received from the wiimote in callback mode,
+        and how many of them were read before being replaced, with the
+        accelerometer filter's samples and cost if it is on"""
+        stats = dict(
+            received=self.reports_received,
+            consumed=self.reports_consumed,
+        )
+        if self.accel is not None:
+            stats['accel'] = self.accel.stats()
+        return stats